@@ -27,7 +27,7 @@ def get_local_ip():
         return 'localhost'
 
 if __name__ == '__main__':
-    port = 7450
+    port = int(os.environ.get('PORT', '7450'))
     local_ip = get_local_ip()
     
     # Print startup message to stderr so it shows in Docker logs
@@ -0,0 +1,382 @@
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import requests
+
+from .leases import parse_timestamp
+
+# Limits applied to a single ingest request
+MAX_BATCH_REPORTS = 5000
+MAX_BODY_BYTES = 8 * 1024 * 1024
+
+
+class IngestRejected(Exception):
+    """Raised when an ingest batch is malformed or cannot be accepted right now"""
+    def __init__(self, message, status_code=400, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def _normalise_timestamp(value):
+    """Agent timestamp (ISO 8601 or epoch s/ms) as a local ISO string; now when missing, None when invalid
+
+    Every stored timestamp has the same type and format, so rows sort and
+    compare correctly as text.
+    """
+    if value is None or value == '':
+        return datetime.now().isoformat()
+    if isinstance(value, bool):
+        return None
+    ts = parse_timestamp(value)
+    if ts is None:
+        return None
+    try:
+        return datetime.fromtimestamp(ts).isoformat()
+    except (OverflowError, OSError, ValueError):
+        return None
+
+
+class AggregatorStore:
+    """SQLite store of per-site check/change reports received from remote agents"""
+    def __init__(self, db_path="data/aggregator.db", max_inflight=4):
+        self.db_path = db_path
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._lock = threading.Lock()
+        # Concurrent ingest requests beyond this are told to retry later
+        self._inflight = threading.BoundedSemaphore(max_inflight)
+        self._create_tables()
+
+    def _create_tables(self):
+        with self._lock, self._conn:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS sites (
+                    site text PRIMARY KEY,
+                    last_ip text,
+                    last_status text,
+                    last_seen text NOT NULL,
+                    last_change text,
+                    change_count integer NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS reports (
+                    id integer PRIMARY KEY,
+                    site text NOT NULL,
+                    timestamp text NOT NULL,
+                    status text NOT NULL,
+                    ip text,
+                    message text
+                );
+                CREATE INDEX IF NOT EXISTS idx_reports_site_time ON reports (site, timestamp);
+                CREATE INDEX IF NOT EXISTS idx_reports_status_time ON reports (status, timestamp);
+                CREATE TABLE IF NOT EXISTS ingest_batches (
+                    key text PRIMARY KEY,
+                    site text NOT NULL,
+                    received_at text NOT NULL,
+                    count integer NOT NULL
+                );
+            """)
+
+    def decode_batch(self, body, content_encoding=None):
+        """Decompress and validate a raw ingest body"""
+        if len(body) > MAX_BODY_BYTES:
+            raise IngestRejected("Batch too large", status_code=413)
+        if content_encoding == 'gzip':
+            try:
+                with gzip.GzipFile(fileobj=io.BytesIO(body)) as f:
+                    body = f.read(MAX_BODY_BYTES + 1)
+            except OSError as e:
+                raise IngestRejected(f"Invalid gzip body: {e}")
+        if len(body) > MAX_BODY_BYTES:
+            raise IngestRejected("Batch too large", status_code=413)
+
+        try:
+            batch = json.loads(body)
+        except ValueError as e:
+            raise IngestRejected(f"Invalid JSON: {e}")
+
+        if not isinstance(batch, dict) or not batch.get('site'):
+            raise IngestRejected("Batch must include a site")
+        reports = batch.get('reports')
+        if not isinstance(reports, list):
+            raise IngestRejected("Batch must include a reports list")
+        if len(reports) > MAX_BATCH_REPORTS:
+            raise IngestRejected(f"At most {MAX_BATCH_REPORTS} reports per batch", status_code=413)
+        return batch
+
+    def ingest(self, batch, idempotency_key):
+        """Store a decoded batch once; returns (stored_rows, duplicate)"""
+        if not idempotency_key:
+            raise IngestRejected("Missing Idempotency-Key header")
+        if not self._inflight.acquire(blocking=False):
+            raise IngestRejected("Aggregator busy", status_code=429, retry_after=5)
+
+        try:
+            site = str(batch['site'])
+            rows = []
+            for report in batch['reports']:
+                if not isinstance(report, dict) or not report.get('status'):
+                    continue
+                timestamp = _normalise_timestamp(report.get('timestamp'))
+                if timestamp is None:
+                    continue
+                rows.append((
+                    site,
+                    timestamp,
+                    report['status'],
+                    report.get('ip'),
+                    report.get('message')
+                ))
+            rows.sort(key=lambda r: r[1])
+
+            with self._lock:
+                try:
+                    with self._conn:
+                        self._conn.execute(
+                            "INSERT INTO ingest_batches (key, site, received_at, count) VALUES (?, ?, ?, ?)",
+                            (idempotency_key, site, datetime.now().isoformat(), len(rows))
+                        )
+                        self._conn.executemany(
+                            "INSERT INTO reports (site, timestamp, status, ip, message) VALUES (?, ?, ?, ?, ?)",
+                            rows
+                        )
+                        self._update_site(site, rows)
+                except sqlite3.IntegrityError:
+                    return [], True
+            return rows, False
+        finally:
+            self._inflight.release()
+
+    def _update_site(self, site, rows):
+        """Fold a batch of rows into the per-site summary"""
+        current = self._conn.execute(
+            "SELECT last_ip, last_status, last_seen, last_change, change_count FROM sites WHERE site = ?",
+            (site,)
+        ).fetchone()
+        last_ip, last_status, last_seen, last_change, change_count = current or (None, None, '', None, 0)
+
+        for _, timestamp, status, ip, _ in rows:
+            if status == 'changed':
+                change_count += 1
+            if timestamp < last_seen:
+                # Late report from an older batch; keep it in history only
+                continue
+            if status == 'changed':
+                last_change = timestamp
+            if ip:
+                last_ip = ip
+            last_status = status
+            last_seen = timestamp
+
+        self._conn.execute("""
+            INSERT INTO sites (site, last_ip, last_status, last_seen, last_change, change_count)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(site) DO UPDATE SET
+                last_ip = excluded.last_ip,
+                last_status = excluded.last_status,
+                last_seen = excluded.last_seen,
+                last_change = excluded.last_change,
+                change_count = excluded.change_count
+        """, (site, last_ip, last_status, last_seen or datetime.now().isoformat(), last_change, change_count))
+
+    def get_sites(self):
+        """Return the summary row for every known site"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT site, last_ip, last_status, last_seen, last_change, change_count FROM sites ORDER BY site"
+            ).fetchall()
+        keys = ('site', 'last_ip', 'last_status', 'last_seen', 'last_change', 'change_count')
+        return [dict(zip(keys, row)) for row in rows]
+
+    def get_site_history(self, site, limit=100, changes_only=True):
+        """Return the newest reports for a site"""
+        sql = "SELECT timestamp, status, ip, message FROM reports WHERE site = ?"
+        if changes_only:
+            sql += " AND status = 'changed'"
+        sql += " ORDER BY timestamp DESC LIMIT ?"
+        with self._lock:
+            rows = self._conn.execute(sql, (site, limit)).fetchall()
+        keys = ('timestamp', 'status', 'ip', 'message')
+        return [dict(zip(keys, row)) for row in rows]
+
+    def prune_keys(self, days=7):
+        """Forget idempotency keys older than the agents' retry horizon"""
+        cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM ingest_batches WHERE received_at < ?", (cutoff,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class AgentUploader:
+    """Buffers check reports in a local spool file and pushes them to an aggregator in batches"""
+    def __init__(self, aggregator_url, site, data_dir="data", token=None,
+                 batch_size=500, max_buffer=100000, interval=300):
+        self.aggregator_url = aggregator_url.rstrip('/')
+        self.site = site
+        self.token = token
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        self.interval = interval
+        self.spool_file = Path(data_dir) / 'agent_outbox.jsonl'
+        self.spool_file.parent.mkdir(parents=True, exist_ok=True)
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._backoff_until = 0
+        self._failures = 0
+        self._thread = None
+        self.running = False
+
+    @classmethod
+    def from_env(cls, data_dir="data"):
+        """Build an uploader from ENABLE_AGENT / AGGREGATOR_URL, or None when agent mode is off"""
+        if os.getenv('ENABLE_AGENT', 'false').lower() != 'true':
+            return None
+        url = os.getenv('AGGREGATOR_URL')
+        if not url:
+            logging.error("ENABLE_AGENT is set but AGGREGATOR_URL is missing")
+            return None
+        return cls(
+            url,
+            site=os.getenv('SITE_ID') or socket.gethostname(),
+            data_dir=data_dir,
+            token=os.getenv('AGGREGATOR_TOKEN'),
+            interval=int(os.getenv('AGENT_INTERVAL', '300'))
+        )
+
+    def record(self, result):
+        """Append one check result to the spool"""
+        report = {
+            'timestamp': datetime.now().isoformat(),
+            'status': result.get('status', 'error'),
+            'ip': result.get('ip'),
+            'message': result.get('message')
+        }
+        with self._lock:
+            with open(self.spool_file, 'a') as f:
+                f.write(json.dumps(report) + '\n')
+        if result.get('status') == 'changed':
+            # Changes are pushed right away rather than waiting for the interval
+            self._wake.set()
+
+    def _read_spool(self):
+        if not self.spool_file.exists():
+            return []
+        with open(self.spool_file, 'r') as f:
+            return [line for line in f if line.strip()]
+
+    def _rewrite_spool(self, lines):
+        tmp = self.spool_file.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            f.writelines(lines)
+        os.replace(tmp, self.spool_file)
+
+    def flush(self):
+        """Push buffered reports; returns the number of reports delivered"""
+        if time.time() < self._backoff_until:
+            return 0
+
+        with self._lock:
+            lines = self._read_spool()
+            if len(lines) > self.max_buffer:
+                self.dropped += len(lines) - self.max_buffer
+                lines = lines[-self.max_buffer:]
+                self._rewrite_spool(lines)
+
+        delivered = 0
+        try:
+            while delivered < len(lines):
+                batch_lines = lines[delivered:delivered + self.batch_size]
+                # The key is derived from the batch content so a retried batch is recognised as a duplicate
+                key = hashlib.sha256(f"{self.site}\n".encode() + ''.join(batch_lines).encode()).hexdigest()
+                if not self._post_batch(batch_lines, key):
+                    break
+                delivered += len(batch_lines)
+        finally:
+            if delivered:
+                # Drop what was delivered in one rewrite; reports recorded meanwhile were appended after it
+                with self._lock:
+                    self._rewrite_spool(self._read_spool()[delivered:])
+        return delivered
+
+    def _post_batch(self, batch_lines, key):
+        body = json.dumps({
+            'site': self.site,
+            'sent_at': datetime.now().isoformat(),
+            'reports': [json.loads(line) for line in batch_lines]
+        }).encode('utf-8')
+        headers = {
+            'Content-Type': 'application/json',
+            'Content-Encoding': 'gzip',
+            'Idempotency-Key': key
+        }
+        if self.token:
+            headers['Authorization'] = f"Bearer {self.token}"
+
+        try:
+            response = requests.post(
+                f"{self.aggregator_url}/api/ingest",
+                data=gzip.compress(body),
+                headers=headers,
+                timeout=10
+            )
+        except Exception as e:
+            logging.debug(f"Aggregator unreachable, keeping reports buffered: {e}")
+            self._back_off()
+            return False
+
+        if response.status_code == 200:
+            self._failures = 0
+            return True
+        if response.status_code in (429, 503):
+            retry_after = response.headers.get('Retry-After', '')
+            self._back_off(int(retry_after) if retry_after.isdigit() else None)
+            return False
+        logging.error(f"Aggregator rejected batch: {response.status_code} - {response.text}")
+        self._back_off()
+        return False
+
+    def _back_off(self, seconds=None):
+        self._failures += 1
+        if seconds is None:
+            seconds = min(300, 2 ** self._failures)
+        self._backoff_until = time.time() + seconds
+
+    def start(self):
+        """Start the background flush loop"""
+        if self._thread is not None:
+            return
+        self.running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.running = False
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while self.running:
+            self._wake.wait(timeout=self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Agent upload error: {e}")
@@ -0,0 +1,225 @@
+"""Check an IP against locally synced blocklists (DNSBL exports, FireHOL netsets, DROP lists)
+
+Every file in the blocklist directory is one list named after the file. The
+prefixes of all lists are flattened into one sorted table of address
+boundaries, each carrying a bitmask of the lists covering the range up to the
+next boundary. That is the leaf-pushed form of a prefix trie: one bisect
+answers a lookup with every list that matches, and the table is two flat
+arrays, so it is saved as a binary snapshot and loaded in milliseconds.
+"""
+import bisect
+import ipaddress
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+from array import array
+from pathlib import Path
+
+SNAPSHOT_MAGIC = b'IPSBL1\n'
+LIST_SUFFIXES = ('.txt', '.netset', '.ipset', '.cidr', '.list', '.drop')
+MAX_LISTS = 32  # One bit per list in the range masks
+
+
+def _parse_v4(token):
+    """(first, last) addresses of an IPv4 address or CIDR as integers, or None"""
+    address, _, length = token.partition('/')
+    try:
+        first = struct.unpack('>I', socket.inet_aton(address))[0]
+        bits = int(length) if length else 32
+    except (OSError, ValueError):
+        return None
+    if not 0 <= bits <= 32 or address.count('.') != 3:
+        return None
+    host_mask = (1 << (32 - bits)) - 1
+    first &= ~host_mask & 0xFFFFFFFF
+    return first, first | host_mask
+
+
+def _parse_v6(token):
+    try:
+        network = ipaddress.IPv6Network(token, strict=False)
+    except ValueError:
+        return None
+    return int(network.network_address), int(network.broadcast_address)
+
+
+def read_list(path):
+    """Yield (version, first, last) for every entry; '#' and ';' start comments"""
+    with open(path, 'r', errors='replace') as f:
+        for line in f:
+            token = line.split('#', 1)[0].split(';', 1)[0].strip().split(None, 1)
+            if not token:
+                continue
+            token = token[0]
+            if ':' in token:
+                parsed = _parse_v6(token)
+                if parsed:
+                    yield 6, parsed[0], parsed[1]
+            else:
+                parsed = _parse_v4(token)
+                if parsed:
+                    yield 4, parsed[0], parsed[1]
+
+
+def _flatten(ranges):
+    """Sweep (first, last, bit) ranges into boundaries and the list mask in effect from each"""
+    events = {}
+    for first, last, bit in ranges:
+        events.setdefault(first, []).append((1, bit))
+        events.setdefault(last + 1, []).append((-1, bit))
+    counts = [0] * MAX_LISTS
+    boundaries, masks = [], []
+    mask = 0
+    for point in sorted(events):
+        for delta, bit in events[point]:
+            counts[bit] += delta
+            if counts[bit]:
+                mask |= 1 << bit
+            else:
+                mask &= ~(1 << bit)
+        if not masks or masks[-1] != mask:
+            boundaries.append(point)
+            masks.append(mask)
+    return boundaries, masks
+
+
+class Blocklist:
+    """Range-mask table over every list in a directory, rebuilt only when a list file changes
+
+    The table is one (names, v4 starts, v4 masks, v6 starts, v6 masks) tuple
+    swapped in whole, so a lookup never mixes the names of one load with the
+    ranges of another.
+    """
+    def __init__(self, directory, snapshot_file=None):
+        self.directory = Path(directory)
+        self.snapshot_file = Path(snapshot_file) if snapshot_file else self.directory / '.snapshot'
+        self._table = ([], array('I'), array('I'), [], [])
+        self._loaded_fingerprint = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, data_dir="data"):
+        return cls(os.getenv('BLOCKLIST_DIR', os.path.join(data_dir, 'blocklists')))
+
+    @property
+    def enabled(self):
+        return bool(self._sources())
+
+    @property
+    def names(self):
+        return self._table[0]
+
+    def _sources(self):
+        if not self.directory.is_dir():
+            return []
+        files = sorted(p for p in self.directory.iterdir() if p.is_file() and p.suffix in LIST_SUFFIXES)
+        if len(files) > MAX_LISTS:
+            logging.warning(f"Only the first {MAX_LISTS} blocklists in {self.directory} are used")
+        return files[:MAX_LISTS]
+
+    @staticmethod
+    def _fingerprint(sources):
+        fingerprint = []
+        for p in sources:
+            try:
+                stat = p.stat()
+            except OSError:
+                continue  # Removed since the directory was listed
+            fingerprint.append([p.name, stat.st_size, stat.st_mtime_ns])
+        return fingerprint
+
+    def load(self, fingerprint=None):
+        """Load from the snapshot when it matches the list files, otherwise rebuild and save one"""
+        with self._lock:
+            sources = self._sources()
+            fingerprint = fingerprint if fingerprint is not None else self._fingerprint(sources)
+            if fingerprint == self._loaded_fingerprint:
+                return  # Another thread reloaded while this one waited for the lock
+            table = self._load_snapshot(fingerprint)
+            if table is None:
+                table = self._build(sources)
+                self._save_snapshot(fingerprint, table)
+            self._table = table
+            self._loaded_fingerprint = fingerprint
+
+    def _current(self):
+        """The loaded table, reloaded first when a list file was added, removed or rewritten"""
+        fingerprint = self._fingerprint(self._sources())
+        if fingerprint != self._loaded_fingerprint:
+            self.load(fingerprint)
+        with self._lock:
+            return self._table
+
+    def _build(self, sources):
+        v4, v6 = [], []
+        for bit, path in enumerate(sources):
+            try:
+                for version, first, last in read_list(path):
+                    (v4 if version == 4 else v6).append((first, last, bit))
+            except OSError as e:
+                logging.error(f"Error reading blocklist {path}: {e}")
+        starts, masks = _flatten(v4)
+        v4_starts = array('I', starts[:-1] if starts and starts[-1] > 0xFFFFFFFF else starts)
+        v4_masks = array('I', masks[:len(v4_starts)])
+        v6_starts, v6_masks = _flatten(v6)
+        logging.info(f"Built blocklist table from {len(sources)} lists: "
+                     f"{len(v4) + len(v6)} entries, {len(v4_starts) + len(v6_starts)} ranges")
+        return [p.stem for p in sources], v4_starts, v4_masks, v6_starts, v6_masks
+
+    def _save_snapshot(self, fingerprint, table):
+        names, v4_starts, v4_masks, v6_starts, v6_masks = table
+        header = json.dumps({
+            'sources': fingerprint,
+            'names': names,
+            'v4': len(v4_starts),
+            'v6': [[hex(s), m] for s, m in zip(v6_starts, v6_masks)]
+        }).encode()
+        try:
+            tmp = self.snapshot_file.with_suffix('.tmp')
+            with open(tmp, 'wb') as f:
+                f.write(SNAPSHOT_MAGIC + struct.pack('>I', len(header)) + header)
+                f.write(v4_starts.tobytes())
+                f.write(v4_masks.tobytes())
+            os.replace(tmp, self.snapshot_file)
+        except OSError as e:
+            logging.error(f"Error saving blocklist snapshot: {e}")
+
+    def _load_snapshot(self, fingerprint):
+        """The table saved for these list files, or None"""
+        try:
+            with open(self.snapshot_file, 'rb') as f:
+                if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                    return None
+                header = json.loads(f.read(struct.unpack('>I', f.read(4))[0]))
+                if header['sources'] != fingerprint:
+                    return None
+                starts, masks = array('I'), array('I')
+                starts.fromfile(f, header['v4'])
+                masks.fromfile(f, header['v4'])
+        except (OSError, ValueError, EOFError, KeyError):
+            return None
+        v6_starts = [int(s, 16) for s, _ in header['v6']]
+        v6_masks = [m for _, m in header['v6']]
+        return header['names'], starts, masks, v6_starts, v6_masks
+
+    def check(self, ip):
+        """Names of the lists containing ip (empty when not listed)"""
+        names, v4_starts, v4_masks, v6_starts, v6_masks = self._current()
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return []
+        if address.version == 4:
+            starts, masks = v4_starts, v4_masks
+        else:
+            starts, masks = v6_starts, v6_masks
+        i = bisect.bisect_right(starts, int(address)) - 1
+        mask = masks[i] if i >= 0 else 0
+        return [name for bit, name in enumerate(names) if mask >> bit & 1]
+
+    def stats(self):
+        names, v4_starts, _, v6_starts, _ = self._current()
+        return {'lists': names, 'ranges': len(v4_starts) + len(v6_starts)}
@@ -1,8 +1,12 @@
 import click
 import json
 import os
+import sys
+from datetime import datetime, timedelta
 from crontab import CronSlices
 from .ip_monitor import IPMonitor
+from .timeseries import CheckRecorder
+from . import logreader, leases
 
 @click.group()
 def cli():
@@ -13,9 +17,11 @@ def cli():
 def check():
     """Check current public IP address"""
     monitor = IPMonitor()
+    monitor.recorder = CheckRecorder(monitor.db_file)
     status = monitor.check_ip_change()
+    monitor.recorder.close()
     
-    if status['status'] == 'error':
+    if status['status'] in ('error', 'offline'):
         click.secho(status['message'], fg='red')
         exit(1)
     
@@ -23,24 +29,87 @@ def check():
     click.secho(status['message'], fg=color)
     click.echo(f"Current IP: {status['ip']}")
 
+def _parse_since(value):
+    """Accept an absolute date/time or a relative age such as 30m, 24h or 7d"""
+    units = {'m': 60, 'h': 3600, 'd': 86400}
+    if value[-1:] in units and value[:-1].isdigit():
+        return datetime.now() - timedelta(seconds=int(value[:-1]) * units[value[-1]])
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise click.BadParameter(f"Unrecognised time: {value}")
+
 @cli.command()
-def history():
-    """Show IP address change history"""
+@click.option('--limit', '-n', type=int, help="Show at most N entries")
+@click.option('--since', help="Only entries after this time (YYYY-MM-DD[ HH:MM:SS] or 30m/24h/7d)")
+@click.option('--changes', is_flag=True, help="Only show IP change entries")
+@click.option('--json', 'as_json', is_flag=True, help="Output JSON lines")
+def history(limit, since, changes, as_json):
+    """Show IP address change history, newest first"""
     monitor = IPMonitor()
-    try:
-        with open(monitor.log_file, 'r') as f:
-            logs = f.readlines()
-        
-        if not logs:
-            click.echo("No history found")
-            return
-        
-        for log in logs:
-            click.echo(log.strip())
-    except FileNotFoundError:
+    if not os.path.exists(monitor.log_file):
         click.secho("No history file found", fg='yellow')
+        return
+    since = _parse_since(since) if since else None
+
+    shown = 0
+    try:
+        # Streams from the end of the log, so only the requested entries are read
+        lines = logreader.change_lines(monitor.log_file) if changes else logreader.reverse_lines(monitor.log_file)
+        for line in lines:
+            if limit is not None and shown >= limit:
+                break
+            timestamp = logreader.parse_timestamp(line)
+            if since and timestamp and timestamp < since:
+                break
+            if not line.strip():
+                continue
+            if as_json:
+                message = line[22:] if timestamp else line
+                entry = {'timestamp': timestamp.isoformat() if timestamp else None, 'message': message}
+                change = logreader.parse_change(line)
+                if change:
+                    entry['ip'] = change[1]
+                click.echo(json.dumps(entry))
+            else:
+                click.echo(line)
+            shown += 1
     except Exception as e:
         click.secho(f"Error reading history: {e}", fg='red')
+        return
+
+    if not shown and not as_json:
+        click.echo("No history found")
+
+@cli.command()
+@click.argument('source', type=click.File('r'), default='-')
+@click.option('--field', '-f', type=int, help="Take the timestamp from this whitespace-separated field (1-based)")
+@click.option('--delimiter', '-d', help="Field delimiter instead of whitespace")
+@click.option('--json', 'as_json', is_flag=True, help="Output JSON lines")
+def lookup(source, field, delimiter, as_json):
+    """Annotate timestamps (one per line, or a field of each line) with the IP held at that time"""
+    monitor = IPMonitor()
+    index = leases.LeaseIndex.load(monitor.db_file, monitor.log_file)
+    if not len(index):
+        click.secho("No IP change history recorded", fg='yellow')
+        exit(1)
+
+    # Streams the input: each line is answered before the next is read
+    out = sys.stdout
+    for line in source:
+        line = line.rstrip('\n')
+        value = line
+        if field:
+            parts = line.split(delimiter) if delimiter else line.split()
+            value = parts[field - 1] if len(parts) >= field else ''
+        result = index.resolve(value)
+        if as_json:
+            result['line'] = line
+            out.write(json.dumps(result) + '\n')
+        else:
+            out.write(f"{result['ip'] or '-'}\t{line}\n")
 
 @cli.command()
 def current():
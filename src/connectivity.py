@@ -0,0 +1,217 @@
+import errno
+import logging
+import os
+import random
+import socket
+import struct
+import threading
+import time
+from datetime import datetime
+
+from . import database
+from .tracing import tracer
+
+# Any address outside the LAN works; a UDP connect() only consults the routing table
+ROUTE_PROBE_V4 = ('192.0.2.1', 53)
+
+
+def has_default_route():
+    """Check whether the kernel has a route to the internet (no packets are sent)"""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.connect(ROUTE_PROBE_V4)
+        return True
+    except OSError as e:
+        if e.errno in (errno.ENETUNREACH, errno.EHOSTUNREACH, errno.EADDRNOTAVAIL):
+            return False
+        raise
+
+
+def default_gateway(route_file='/proc/net/route'):
+    """Return the IPv4 default gateway from the Linux routing table, if available"""
+    try:
+        with open(route_file) as f:
+            next(f)
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 4 and fields[1] == '00000000' and int(fields[3], 16) & 0x2:
+                    return socket.inet_ntoa(struct.pack('<L', int(fields[2], 16)))
+    except (OSError, StopIteration, ValueError):
+        pass
+    return None
+
+
+def gateway_reachable(gateway, timeout=1.0, arp_file='/proc/net/arp'):
+    """Check the gateway answers: a resolved ARP entry or any TCP response counts"""
+    try:
+        with open(arp_file) as f:
+            next(f)
+            for line in f:
+                fields = line.split()
+                if fields and fields[0] == gateway and fields[2] == '0x2':
+                    return True
+    except (OSError, StopIteration, IndexError):
+        pass
+
+    for port in (53, 80, 443):
+        try:
+            with socket.create_connection((gateway, port), timeout=timeout):
+                return True
+        except ConnectionRefusedError:
+            return True  # A RST still proves the gateway is up
+        except OSError:
+            continue
+    return False
+
+
+def system_resolvers(resolv_conf='/etc/resolv.conf'):
+    """Nameservers configured for the system resolver"""
+    servers = []
+    try:
+        with open(resolv_conf) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] == 'nameserver':
+                    servers.append(parts[1])
+    except OSError:
+        pass
+    return servers
+
+
+def resolver_responding(server, timeout=1.0):
+    """Send a minimal DNS query for the root NS set; any reply means the resolver is up"""
+    query_id = random.randint(0, 0xFFFF)
+    query = struct.pack('>HHHHHH', query_id, 0x0100, 1, 0, 0, 0) + b'\x00' + struct.pack('>HH', 2, 1)
+    family = socket.AF_INET6 if ':' in server else socket.AF_INET
+    try:
+        with socket.socket(family, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(timeout)
+            sock.sendto(query, (server, 53))
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                reply, _ = sock.recvfrom(512)
+                if reply[:2] == query[:2]:
+                    return True
+    except OSError:
+        pass
+    return False
+
+
+class ConnectivityMonitor:
+    """Cheap pre-flight checks run before querying IP providers, with outage tracking"""
+    def __init__(self, db_file=database.DEFAULT_DB_FILE, timeout=1.0, probe_interval=2.0, max_false_negatives=3):
+        self.db_file = db_file
+        self.timeout = timeout
+        self.probe_interval = probe_interval
+        self.enabled = os.getenv('PREFLIGHT_ENABLED', 'true').lower() == 'true'
+        # Consecutive failed pre-flights contradicted by a provider before the pre-flight is switched off
+        self.max_false_negatives = max_false_negatives
+        self.false_negatives = 0
+        self.outage_started = None
+        self.outage_reason = None
+        self.on_recover = None  # Called once connectivity comes back
+        self._probe_thread = None
+        self._lock = threading.Lock()
+
+    def preflight(self):
+        """Return (online, reason); reason names the first failed check"""
+        if not self.enabled:
+            return True, None
+        with tracer.span('connectivity.preflight') as span:
+            try:
+                if not has_default_route():
+                    span.attrs['failed'] = 'route'
+                    return False, 'No default route'
+            except OSError as e:
+                logging.debug(f"Route check inconclusive: {e}")
+
+            gateway = default_gateway()
+            if gateway and not gateway_reachable(gateway, self.timeout):
+                span.attrs['failed'] = 'gateway'
+                return False, f"Gateway {gateway} unreachable"
+
+            resolvers = system_resolvers()
+            if resolvers and not any(resolver_responding(server, self.timeout) for server in resolvers[:2]):
+                span.attrs['failed'] = 'resolver'
+                return False, 'DNS resolver not responding'
+            return True, None
+
+    def check(self, confirm=None):
+        """Run the pre-flight and update outage state; returns (online, reason)
+
+        When the pre-flight fails, confirm() (if given) gets one chance to
+        reach the internet anyway, such as by asking a single provider. A
+        gateway that ignores ARP and TCP probes would otherwise keep every
+        check "offline" forever.
+        """
+        online, reason = self.preflight()
+        if not online and confirm is not None and confirm():
+            self.false_negatives += 1
+            logging.warning(f"Pre-flight reported '{reason}' but a provider answered")
+            if self.false_negatives >= self.max_false_negatives:
+                logging.warning("Pre-flight keeps contradicting the providers on this network; disabling it")
+                self.enabled = False
+            online, reason = True, None
+        elif online:
+            self.false_negatives = 0
+        with self._lock:
+            if not online and self.outage_started is None:
+                self.outage_started = datetime.now()
+                self.outage_reason = reason
+                logging.info(f"Network offline: {reason}")
+                self._start_probe()
+            elif online and self.outage_started is not None:
+                self._end_outage()
+        return online, reason
+
+    def _end_outage(self):
+        started, reason = self.outage_started, self.outage_reason
+        ended = datetime.now()
+        self.outage_started = None
+        self.outage_reason = None
+        logging.info(f"Network restored after {int((ended - started).total_seconds())}s offline")
+
+        conn = database.get_db_connection(self.db_file)
+        if conn is not None:
+            try:
+                database.create_outages_table(conn)
+                database.log_outage(conn, started, ended, reason)
+            except Exception as e:
+                logging.error(f"Error recording outage: {e}")
+            finally:
+                database.close_connection(conn)
+
+    def _start_probe(self):
+        """Poll connectivity quickly while offline so recovery is noticed within seconds"""
+        if self._probe_thread is not None and self._probe_thread.is_alive():
+            return
+        self._probe_thread = threading.Thread(target=self._probe, daemon=True)
+        self._probe_thread.start()
+
+    def _probe(self):
+        while self.outage_started is not None:
+            time.sleep(self.probe_interval)
+            online, _ = self.preflight()
+            if online:
+                with self._lock:
+                    if self.outage_started is None:
+                        return
+                    self._end_outage()
+                if self.on_recover:
+                    self.on_recover()
+                return
+
+    def get_outages(self, limit=50):
+        """Return recorded outages, newest first, including one still in progress"""
+        outages = []
+        if self.outage_started is not None:
+            outages.append({'start': self.outage_started.strftime('%Y-%m-%d %H:%M:%S'),
+                            'end': None, 'reason': self.outage_reason})
+        conn = database.get_db_connection(self.db_file)
+        if conn is not None:
+            try:
+                database.create_outages_table(conn)
+                outages += database.get_outages(conn, limit)
+            finally:
+                database.close_connection(conn)
+        return outages[:limit]
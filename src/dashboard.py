@@ -0,0 +1,93 @@
+"""Everything the dashboard shows on load, built from state the monitor and scheduler already hold
+
+The snapshot never contacts an IP provider. It is cached and only rebuilt
+when a check completes, the change log grows or the next run moves on, so
+serving it costs one stat() of the log file. Change lines are read
+incrementally: a rebuild only scans what was appended to the log since the
+last one, however many debug lines the scheduler writes in between.
+"""
+import bisect
+import os
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+
+from . import logreader
+
+RECENT_CHANGES = 10
+
+
+class Dashboard:
+    def __init__(self, monitor, scheduler, recent=RECENT_CHANGES):
+        self.monitor = monitor
+        self.scheduler = scheduler
+        self.recent = recent
+        self._key = None
+        self._snapshot = None
+        self._position = None  # Where the last read of the change log stopped
+        self._recent = deque(maxlen=recent)  # Newest last
+        self._times = []  # Timestamp of every change line, oldest first
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def _log_key(self):
+        try:
+            stat = os.stat(self.monitor.log_file)
+            return stat.st_size, stat.st_mtime_ns
+        except OSError:
+            return None
+
+    def snapshot(self):
+        """Current status, next run, recent changes and change counts"""
+        log_key = self._log_key()
+        schedule = self.scheduler.get_schedule()
+        key = (self.monitor.last_checked, log_key, schedule['next_run'], schedule['schedule'])
+        with self._lock:
+            if key != self._key:
+                self._snapshot = self._build(schedule)
+                self._key = key
+            return self._snapshot
+
+    def _build(self, schedule):
+        status = self.monitor.last_status
+        if status is None:
+            # Nothing checked since startup yet: show the last known IP rather than asking a provider
+            status = {'status': 'pending', 'message': 'Waiting for the first check', 'ip': self.monitor.current_ip}
+        elif not status.get('ip'):
+            # A failed check still leaves the last known IP worth showing
+            status = dict(status, ip=self.monitor.current_ip)
+        last_checked = self.monitor.last_checked
+        return {
+            'status': status,
+            'last_check': last_checked.isoformat(timespec='seconds') if last_checked else None,
+            'schedule': schedule,
+            **self._changes(),
+            'generated': datetime.now().isoformat(timespec='seconds')
+        }
+
+    def _changes(self):
+        """Recent change lines and counts, reading only the change lines appended since the last call"""
+        lines, self._position, restarted = logreader.lines_after(
+            self.monitor.log_file, logreader.CHANGE_MARKER, self._position)
+        if restarted:
+            self._recent.clear()
+            self._times = []
+            self._total = 0
+        for line in lines:
+            change = logreader.parse_change(line)
+            if change is None:
+                continue  # e.g. the scheduler's debug line quoting the change message
+            self._total += 1
+            self._recent.append(line)
+            self._times.append(change[0])
+        now = datetime.now()
+        week_start = now - timedelta(days=7)
+        month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        return {
+            'history': list(reversed(self._recent)),
+            'stats': {
+                'total_changes': self._total,
+                'month_changes': len(self._times) - bisect.bisect_left(self._times, month_start),
+                'week_changes': len(self._times) - bisect.bisect_left(self._times, week_start)
+            }
+        }
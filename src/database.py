@@ -1,10 +1,15 @@
-def get_db_connection():
-    import sqlite3
-    from sqlite3 import Error
+import json
+import sqlite3
+from sqlite3 import Error
+from datetime import datetime
 
+DEFAULT_DB_FILE = 'data/ip_log.db'
+
+
+def get_db_connection(db_file=DEFAULT_DB_FILE):
     conn = None
     try:
-        conn = sqlite3.connect('ip_log.db')
+        conn = sqlite3.connect(db_file)
         return conn
     except Error as e:
         print(e)
@@ -17,33 +22,191 @@ def create_table(conn):
         sql_create_ip_table = """ CREATE TABLE IF NOT EXISTS ip_log (
                                         id integer PRIMARY KEY,
                                         ip_address text NOT NULL,
-                                        timestamp text NOT NULL
+                                        timestamp text NOT NULL,
+                                        previous_ip text,
+                                        enrichment text
                                     ); """
         cursor = conn.cursor()
         cursor.execute(sql_create_ip_table)
+        _add_missing_columns(conn, 'ip_log', {'previous_ip': 'text', 'enrichment': 'text'})
     except Error as e:
         print(e)
 
 
-def log_ip(conn, ip_address):
-    from datetime import datetime
+def _add_missing_columns(conn, table, columns):
+    """Upgrade tables created by older versions"""
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    for name, column_type in columns.items():
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+
 
-    sql = ''' INSERT INTO ip_log(ip_address, timestamp)
-              VALUES(?,?) '''
+def log_ip(conn, ip_address, previous_ip=None, enrichment=None):
+    sql = ''' INSERT INTO ip_log(ip_address, timestamp, previous_ip, enrichment)
+              VALUES(?,?,?,?) '''
     cursor = conn.cursor()
-    cursor.execute(sql, (ip_address, datetime.now()))
+    cursor.execute(sql, (
+        ip_address,
+        datetime.now().isoformat(sep=' ', timespec='seconds'),
+        previous_ip,
+        json.dumps(enrichment) if enrichment else None
+    ))
     conn.commit()
     return cursor.lastrowid
 
 
-def get_ip_history(conn):
+def get_ip_history(conn, limit=None):
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM ip_log ORDER BY timestamp DESC")
+    sql = "SELECT id, ip_address, timestamp, previous_ip, enrichment FROM ip_log ORDER BY timestamp DESC"
+    if limit:
+        cursor.execute(sql + " LIMIT ?", (limit,))
+    else:
+        cursor.execute(sql)
 
     rows = cursor.fetchall()
-    return rows
+    return [
+        {
+            'id': row[0],
+            'ip_address': row[1],
+            'date': row[2],
+            'previous_ip': row[3],
+            'enrichment': json.loads(row[4]) if row[4] else None
+        }
+        for row in rows
+    ]
+
+
+def create_check_results_table(conn):
+    try:
+        conn.execute(""" CREATE TABLE IF NOT EXISTS check_results (
+                            id integer PRIMARY KEY,
+                            ts integer NOT NULL,
+                            status text NOT NULL,
+                            provider text,
+                            latency_ms real,
+                            success integer NOT NULL,
+                            ip text
+                        ); """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_check_results_ts ON check_results (ts)")
+    except Error as e:
+        print(e)
+
+
+def log_check_results(conn, rows):
+    """Insert many (ts, status, provider, latency_ms, success, ip) rows; the caller commits"""
+    conn.executemany(
+        "INSERT INTO check_results (ts, status, provider, latency_ms, success, ip) VALUES (?,?,?,?,?,?)",
+        rows
+    )
+
+
+def get_check_results(conn, since=None, limit=None, until=None):
+    sql = "SELECT ts, status, provider, latency_ms, success, ip FROM check_results"
+    conditions, params = [], []
+    if since is not None:
+        conditions.append("ts >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("ts < ?")
+        params.append(until)
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY ts DESC"
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return conn.execute(sql, params).fetchall()
+
+
+def create_rollups_table(conn):
+    try:
+        conn.execute(""" CREATE TABLE IF NOT EXISTS check_rollups (
+                            resolution integer NOT NULL,
+                            bucket integer NOT NULL,
+                            checks integer NOT NULL,
+                            successes integer NOT NULL,
+                            changes integer NOT NULL,
+                            latency_sum real NOT NULL,
+                            latency_count integer NOT NULL,
+                            latency_max real,
+                            latency_hist text NOT NULL,
+                            PRIMARY KEY (resolution, bucket)
+                        ) WITHOUT ROWID; """)
+    except Error as e:
+        print(e)
+
+
+def get_rollups(conn, resolution, start=None, end=None):
+    sql = """SELECT bucket, checks, successes, changes, latency_sum, latency_count, latency_max, latency_hist
+             FROM check_rollups WHERE resolution = ?"""
+    params = [resolution]
+    if start is not None:
+        sql += " AND bucket >= ?"
+        params.append(start)
+    if end is not None:
+        sql += " AND bucket < ?"
+        params.append(end)
+    return conn.execute(sql + " ORDER BY bucket", params).fetchall()
+
+
+def save_rollups(conn, rows):
+    """Insert or replace (resolution, bucket, checks, successes, changes, latency_sum,
+    latency_count, latency_max, latency_hist) rows"""
+    conn.executemany(
+        "INSERT OR REPLACE INTO check_rollups VALUES (?,?,?,?,?,?,?,?,?)",
+        rows
+    )
+
+
+def delete_check_results_before(conn, ts):
+    with conn:
+        return conn.execute("DELETE FROM check_results WHERE ts < ?", (ts,)).rowcount
+
+
+def delete_rollups_before(conn, resolution, bucket):
+    with conn:
+        return conn.execute(
+            "DELETE FROM check_rollups WHERE resolution = ? AND bucket < ?", (resolution, bucket)
+        ).rowcount
+
+
+def create_outages_table(conn):
+    try:
+        conn.execute(""" CREATE TABLE IF NOT EXISTS outages (
+                            id integer PRIMARY KEY,
+                            start text NOT NULL,
+                            end text NOT NULL,
+                            reason text
+                        ); """)
+    except Error as e:
+        print(e)
+
+
+def log_outage(conn, start, end, reason=None):
+    conn.execute(
+        "INSERT INTO outages (start, end, reason) VALUES (?,?,?)",
+        (start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S'), reason)
+    )
+    conn.commit()
+
+
+def get_outages(conn, limit=None):
+    sql = "SELECT start, end, reason FROM outages ORDER BY id DESC"
+    params = []
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return [
+        {'start': row[0], 'end': row[1], 'reason': row[2]}
+        for row in conn.execute(sql, params).fetchall()
+    ]
+
+
+def clear_ip_history(conn):
+    conn.execute("DELETE FROM ip_log")
+    conn.commit()
 
 
 def close_connection(conn):
     if conn:
-        conn.close()
\ No newline at end of file
+        conn.close()
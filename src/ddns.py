@@ -0,0 +1,447 @@
+import base64
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import random
+import socket
+import struct
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import requests
+
+from .tracing import tracer
+
+# Registry of DNS provider types, keyed by the 'type' used in ddns.json
+PROVIDER_TYPES = {}
+
+
+def register_provider(provider_type):
+    """Class decorator registering a dynamic DNS provider type"""
+    def decorator(cls):
+        if getattr(cls, '__abstractmethods__', None):
+            missing = ', '.join(sorted(cls.__abstractmethods__))
+            raise TypeError(f"Provider type {provider_type!r} does not implement {missing}")
+        PROVIDER_TYPES[provider_type] = cls
+        cls.provider_type = provider_type
+        return cls
+    return decorator
+
+
+class RateLimiter:
+    """Spaces out calls so at most `rate` start per second"""
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+# update_record()'s `existing` when the caller has not looked the record up
+UNKNOWN = object()
+
+
+class DNSProvider(ABC):
+    """Base class for a DNS provider able to read and update A/AAAA records"""
+    provider_type = None
+
+    def __init__(self, name, options=None, rate_limit=None, timeout=10):
+        self.name = name
+        self.options = options or {}
+        self.timeout = timeout
+        self.limiter = RateLimiter(rate_limit)
+
+    @abstractmethod
+    def get_record(self, hostname, record_type):
+        """Return the current record value, or None if unknown or missing"""
+
+    def lookup(self, hostname, record_type):
+        """(value, existing) where existing is whatever update_record needs to change that record"""
+        return self.get_record(hostname, record_type), None
+
+    @abstractmethod
+    def update_record(self, hostname, record_type, value, existing=UNKNOWN):
+        """Set the record to value, returning True on success"""
+
+
+@register_provider('cloudflare')
+class CloudflareProvider(DNSProvider):
+    API = "https://api.cloudflare.com/client/v4"
+
+    def _headers(self):
+        return {"Authorization": f"Bearer {self.options.get('api_token', '')}"}
+
+    def _find(self, hostname, record_type):
+        self.limiter.wait()
+        response = requests.get(
+            f"{self.options.get('api_url', self.API)}/zones/{self.options['zone_id']}/dns_records",
+            params={"type": record_type, "name": hostname},
+            headers=self._headers(),
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        results = response.json().get('result') or []
+        return results[0] if results else None
+
+    def get_record(self, hostname, record_type):
+        return self.lookup(hostname, record_type)[0]
+
+    def lookup(self, hostname, record_type):
+        record = self._find(hostname, record_type)
+        return (record.get('content') if record else None), record
+
+    def update_record(self, hostname, record_type, value, existing=UNKNOWN):
+        record = self._find(hostname, record_type) if existing is UNKNOWN else existing
+        base = f"{self.options.get('api_url', self.API)}/zones/{self.options['zone_id']}/dns_records"
+        payload = {"type": record_type, "name": hostname, "content": value,
+                   "ttl": self.options.get('ttl', 1), "proxied": self.options.get('proxied', False)}
+        self.limiter.wait()
+        if record:
+            response = requests.put(f"{base}/{record['id']}", json=payload, headers=self._headers(), timeout=self.timeout)
+        else:
+            response = requests.post(base, json=payload, headers=self._headers(), timeout=self.timeout)
+        return response.status_code == 200 and response.json().get('success', False)
+
+
+@register_provider('digitalocean')
+class DigitalOceanProvider(DNSProvider):
+    API = "https://api.digitalocean.com/v2"
+
+    def _headers(self):
+        return {"Authorization": f"Bearer {self.options.get('api_token', '')}"}
+
+    def _split(self, hostname):
+        domain = self.options['domain']
+        name = hostname[:-len(domain)].rstrip('.') if hostname.endswith(domain) else hostname
+        return domain, name or '@'
+
+    def _find(self, hostname, record_type):
+        domain, _ = self._split(hostname)
+        self.limiter.wait()
+        response = requests.get(
+            f"{self.options.get('api_url', self.API)}/domains/{domain}/records",
+            params={"type": record_type, "name": hostname},
+            headers=self._headers(),
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        records = response.json().get('domain_records') or []
+        return records[0] if records else None
+
+    def get_record(self, hostname, record_type):
+        return self.lookup(hostname, record_type)[0]
+
+    def lookup(self, hostname, record_type):
+        record = self._find(hostname, record_type)
+        return (record.get('data') if record else None), record
+
+    def update_record(self, hostname, record_type, value, existing=UNKNOWN):
+        domain, name = self._split(hostname)
+        record = self._find(hostname, record_type) if existing is UNKNOWN else existing
+        base = f"{self.options.get('api_url', self.API)}/domains/{domain}/records"
+        self.limiter.wait()
+        if record:
+            response = requests.put(f"{base}/{record['id']}", json={"data": value},
+                                    headers=self._headers(), timeout=self.timeout)
+        else:
+            response = requests.post(base, json={"type": record_type, "name": name, "data": value,
+                                                 "ttl": self.options.get('ttl', 300)},
+                                     headers=self._headers(), timeout=self.timeout)
+        return 200 <= response.status_code < 300
+
+
+@register_provider('duckdns')
+class DuckDNSProvider(DNSProvider):
+    """DuckDNS has no read API, so the record state cache is the only source for current values"""
+    API = "https://www.duckdns.org/update"
+
+    def get_record(self, hostname, record_type):
+        return None
+
+    def update_record(self, hostname, record_type, value, existing=UNKNOWN):
+        params = {"domains": hostname.split('.')[0], "token": self.options.get('token', '')}
+        params['ipv6' if record_type == 'AAAA' else 'ip'] = value
+        self.limiter.wait()
+        response = requests.get(self.options.get('api_url', self.API), params=params, timeout=self.timeout)
+        return response.status_code == 200 and response.text.strip().startswith('OK')
+
+
+@register_provider('rfc2136')
+class RFC2136Provider(DNSProvider):
+    """Dynamic updates (RFC 2136) sent over UDP to an authoritative server, optionally TSIG-signed"""
+    TYPES = {'A': 1, 'AAAA': 28}
+
+    def _server(self):
+        return self.options.get('server', '127.0.0.1'), int(self.options.get('port', 53))
+
+    def _exchange(self, message):
+        self.limiter.wait()
+        with socket.socket(socket.AF_INET6 if ':' in self._server()[0] else socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.sendto(message, self._server())
+            while True:
+                reply, _ = sock.recvfrom(65535)
+                if reply[:2] == message[:2]:
+                    return reply
+
+    def get_record(self, hostname, record_type):
+        msg_id = random.randint(0, 0xFFFF)
+        query = struct.pack('>HHHHHH', msg_id, 0x0100, 1, 0, 0, 0)
+        query += _encode_name(hostname) + struct.pack('>HH', self.TYPES[record_type], 1)
+        reply = self._exchange(query)
+        return _parse_answer(reply, self.TYPES[record_type])
+
+    def update_record(self, hostname, record_type, value, existing=UNKNOWN):
+        zone = self.options.get('zone') or hostname.split('.', 1)[1]
+        rtype = self.TYPES[record_type]
+        rdata = ipaddress.ip_address(value).packed
+        msg_id = random.randint(0, 0xFFFF)
+
+        message = struct.pack('>HHHHHH', msg_id, 5 << 11, 1, 0, 2, 0)
+        message += _encode_name(zone) + struct.pack('>HH', 6, 1)  # zone section: SOA IN
+        # Delete the existing RRset, then add the new record
+        message += _encode_name(hostname) + struct.pack('>HHIH', rtype, 255, 0, 0)
+        message += _encode_name(hostname) + struct.pack('>HHIH', rtype, 1, int(self.options.get('ttl', 300)), len(rdata)) + rdata
+
+        if self.options.get('tsig_key'):
+            message = _sign_tsig(message, msg_id, self.options['tsig_name'], self.options['tsig_key'],
+                                 self.options.get('tsig_algorithm', 'hmac-sha256'))
+
+        reply = self._exchange(message)
+        rcode = struct.unpack('>H', reply[2:4])[0] & 0x000F
+        return rcode == 0
+
+
+TSIG_ALGORITHMS = {
+    'hmac-sha256': hashlib.sha256,
+    'hmac-sha512': hashlib.sha512,
+    'hmac-sha1': hashlib.sha1,
+    'hmac-md5.sig-alg.reg.int': hashlib.md5,
+}
+
+
+def _encode_name(name):
+    encoded = b''
+    for label in name.rstrip('.').split('.'):
+        if label:
+            encoded += bytes([len(label)]) + label.encode('ascii')
+    return encoded + b'\x00'
+
+
+def _skip_name(data, pos):
+    while True:
+        length = data[pos]
+        if length == 0:
+            return pos + 1
+        if length & 0xC0 == 0xC0:
+            return pos + 2
+        pos += length + 1
+
+
+def _parse_answer(reply, rtype):
+    """Return the first answer of the requested type from a DNS response"""
+    qdcount, ancount = struct.unpack('>HH', reply[4:8])
+    pos = 12
+    for _ in range(qdcount):
+        pos = _skip_name(reply, pos) + 4
+    for _ in range(ancount):
+        pos = _skip_name(reply, pos)
+        atype, _, _, rdlength = struct.unpack('>HHIH', reply[pos:pos + 10])
+        pos += 10
+        if atype == rtype:
+            return str(ipaddress.ip_address(reply[pos:pos + rdlength]))
+        pos += rdlength
+    return None
+
+
+def _sign_tsig(message, msg_id, key_name, secret, algorithm):
+    """Append a TSIG record (RFC 8945) to a DNS message"""
+    digestmod = TSIG_ALGORITHMS[algorithm]
+    key_wire = _encode_name(key_name.lower())
+    alg_wire = _encode_name(algorithm)
+    time_signed = int(time.time())
+    fudge = 300
+    time_wire = struct.pack('>HIH', time_signed >> 32, time_signed & 0xFFFFFFFF, fudge)
+
+    variables = key_wire + struct.pack('>HI', 255, 0) + alg_wire + time_wire + struct.pack('>HH', 0, 0)
+    mac = hmac.new(base64.b64decode(secret), message + variables, digestmod).digest()
+
+    rdata = alg_wire + time_wire + struct.pack('>H', len(mac)) + mac + struct.pack('>HHH', msg_id, 0, 0)
+    record = key_wire + struct.pack('>HHIH', 250, 255, 0, len(rdata)) + rdata
+    arcount = struct.unpack('>H', message[10:12])[0] + 1
+    return message[:10] + struct.pack('>H', arcount) + message[12:] + record
+
+
+def create_provider(spec):
+    """Build a provider instance from its config dict"""
+    cls = PROVIDER_TYPES.get(spec.get('type'))
+    if cls is None:
+        raise ValueError(f"Unknown DDNS provider type: {spec.get('type')}")
+    return cls(
+        name=spec.get('name') or spec['type'],
+        options=spec.get('options', {}),
+        rate_limit=spec.get('rate_limit'),
+        timeout=spec.get('timeout', 10)
+    )
+
+
+class DDNSUpdater:
+    """Pushes a changed IP to every configured hostname, touching only records that differ"""
+    def __init__(self, config_dir="data"):
+        self.config_dir = Path(config_dir)
+        self.config_file = self.config_dir / 'ddns.json'
+        self.state_file = self.config_dir / 'ddns_state.json'
+        self.config = self._load_config()
+        self.state = self._load_state()
+        # Built once so each provider's rate limiter spans every sync
+        self.providers = self._providers()
+        self._lock = threading.Lock()
+        self.last_results = []
+
+    def _load_config(self):
+        """Load DDNS settings from config file"""
+        config = {}
+        if self.config_file.exists():
+            with open(self.config_file, 'r') as f:
+                config = json.load(f)
+        config.setdefault('enabled', False)
+        config.setdefault('providers', [])
+        config.setdefault('records', [])
+        config.setdefault('max_concurrency', 4)
+        config.setdefault('cache_ttl', 3600)
+        return config
+
+    def _load_state(self):
+        if not self.state_file.exists():
+            return {}
+        try:
+            with open(self.state_file, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            logging.error(f"Error loading DDNS state: {e}")
+            return {}
+
+    def _save_state(self):
+        self.config_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.state_file, 'w') as f:
+            json.dump(self.state, f, indent=2)
+
+    @property
+    def enabled(self):
+        return self.config['enabled'] and bool(self.config['records'])
+
+    def _providers(self):
+        providers = {}
+        for spec in self.config['providers']:
+            try:
+                provider = create_provider(spec)
+                providers[provider.name] = provider
+            except Exception as e:
+                logging.error(f"Skipping invalid DDNS provider {spec.get('name')}: {e}")
+        return providers
+
+    def _sync_record(self, provider, record, ip, cancel=None):
+        hostname = record['hostname']
+        record_type = record.get('type') or ('AAAA' if ':' in ip else 'A')
+        key = f"{provider.name}:{hostname}:{record_type}"
+        result = {'provider': provider.name, 'hostname': hostname, 'type': record_type, 'value': ip}
+
+        with tracer.span('ddns.record', key=key) as span:
+            try:
+                if cancel is not None and cancel.is_set():
+                    # Left pending, so the next check syncs it
+                    result['action'] = 'failed'
+                    result['error'] = 'Cancelled'
+                    return result
+                cached = self.state.get(key)
+                fresh = cached and time.time() - cached.get('checked_at', 0) < self.config['cache_ttl']
+                if fresh and cached.get('value') == ip:
+                    result['action'] = 'cached'
+                    return result
+
+                # The lookup result is handed to the update, so a record is read once per sync
+                current, existing = provider.lookup(hostname, record_type)
+                if current == ip:
+                    result['action'] = 'unchanged'
+                elif provider.update_record(hostname, record_type, ip, existing):
+                    result['action'] = 'updated'
+                else:
+                    result['action'] = 'failed'
+                    return result
+
+                with self._lock:
+                    self.state[key] = {'value': ip, 'checked_at': time.time()}
+                return result
+            except Exception as e:
+                logging.error(f"DDNS update for {hostname} via {provider.name} failed: {e}")
+                result['action'] = 'failed'
+                result['error'] = str(e)
+                return result
+            finally:
+                span.attrs['action'] = result.get('action')
+                if result.get('action') == 'failed':
+                    # Remembered so the next check retries it instead of waiting for another IP change
+                    with self._lock:
+                        self.state[key] = dict(self.state.get(key) or {}, pending=ip, failed_at=time.time())
+
+    @property
+    def pending(self):
+        """State keys of records whose last sync failed"""
+        return [key for key, entry in self.state.items() if entry.get('pending')]
+
+    def retry_pending(self, ip, cancel=None):
+        """Sync only the records that failed earlier; cheap no-op when none did"""
+        pending = set(self.pending)
+        if not self.enabled or not pending:
+            return []
+        return self.update_all(ip, only=pending, cancel=cancel)
+
+    def update_all(self, ip, force=False, only=None, cancel=None):
+        """Sync every configured record of the IP's family to ip (or just the state keys in only)
+
+        Records not yet started when `cancel` is set are marked pending instead of synced.
+        """
+        if not self.enabled:
+            return []
+        if force:
+            self.state = {}
+
+        version_type = 'AAAA' if ipaddress.ip_address(ip).version == 6 else 'A'
+        jobs = []
+        for record in self.config['records']:
+            provider = self.providers.get(record.get('provider'))
+            if provider is None:
+                logging.error(f"DDNS record {record.get('hostname')} references unknown provider {record.get('provider')}")
+                continue
+            if record.get('type', version_type) != version_type:
+                continue
+            if only is not None and f"{provider.name}:{record['hostname']}:{version_type}" not in only:
+                continue
+            jobs.append((provider, record))
+
+        with tracer.span('ddns.update_all', records=len(jobs)):
+            with ThreadPoolExecutor(max_workers=max(1, int(self.config['max_concurrency'])),
+                                    thread_name_prefix='ddns') as executor:
+                results = list(executor.map(lambda job: self._sync_record(job[0], job[1], ip, cancel), jobs))
+
+        self._save_state()
+        self.last_results = [dict(r, at=datetime.now().isoformat()) for r in results]
+        updated = sum(1 for r in results if r['action'] == 'updated')
+        failed = sum(1 for r in results if r['action'] == 'failed')
+        logging.info(f"DDNS sync for {ip}: {updated} updated, {failed} failed, {len(results) - updated - failed} already current")
+        return results
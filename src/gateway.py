@@ -0,0 +1,364 @@
+"""Ask the local NAT gateway for the WAN address via NAT-PMP/PCP or UPnP IGD
+
+Routers usually know their external address, so asking them is faster than
+the internet providers and sends nothing off the LAN.
+
+    python -m src.gateway
+"""
+import ipaddress
+import json
+import logging
+import os
+import re
+import secrets
+import socket
+import struct
+import threading
+import time
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from urllib.parse import urljoin
+
+import requests
+
+from .connectivity import default_gateway
+from .tracing import tracer
+
+NATPMP_PORT = 5351
+SSDP_ADDRESS = ('239.255.255.250', 1900)
+IGD_SEARCH_TARGETS = (
+    'urn:schemas-upnp-org:device:InternetGatewayDevice:2',
+    'urn:schemas-upnp-org:device:InternetGatewayDevice:1'
+)
+WAN_SERVICES = (
+    'urn:schemas-upnp-org:service:WANIPConnection:2',
+    'urn:schemas-upnp-org:service:WANIPConnection:1',
+    'urn:schemas-upnp-org:service:WANPPPConnection:1'
+)
+# Addresses a gateway may report that are not the public IP (it sits behind another NAT)
+NON_PUBLIC_NETWORKS = [ipaddress.ip_network(n) for n in (
+    '0.0.0.0/8', '10.0.0.0/8', '100.64.0.0/10', '127.0.0.0/8',
+    '169.254.0.0/16', '172.16.0.0/12', '192.168.0.0/16'
+)]
+# Seconds a protocol the gateway did not answer is left untried
+NEGATIVE_CACHE_TTL = 3600
+# Seconds before retrying a cross-check against the providers that none of them answered
+VALIDATION_RETRY = 300
+# Requested lifetime of the PCP mapping made to learn the address; the shortest non-zero one
+PCP_LIFETIME = 1
+
+SOAP_ENVELOPE = (
+    '<?xml version="1.0"?>'
+    '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" '
+    's:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">'
+    '<s:Body><u:{action} xmlns:u="{service}"/></s:Body></s:Envelope>'
+)
+
+
+class UnsupportedProtocol(Exception):
+    """The gateway answered, but with a different protocol version than the one asked for"""
+
+
+def is_public_address(ip):
+    """True for addresses that can be the site's public IP"""
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return address.version == 4 and not any(address in net for net in NON_PUBLIC_NETWORKS)
+
+
+def _local_address_towards(host):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.connect((host, 9))
+        return sock.getsockname()[0]
+
+
+def natpmp_external_address(gateway, port=NATPMP_PORT, timeout=0.25, attempts=2):
+    """NAT-PMP (RFC 6886) public address request; retries with doubling timeouts"""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for attempt in range(attempts):
+            sock.settimeout(timeout * (2 ** attempt))
+            sock.sendto(struct.pack('>BB', 0, 0), (gateway, port))
+            try:
+                reply, _ = sock.recvfrom(16)
+            except socket.timeout:
+                continue
+            if len(reply) >= 2 and reply[0] == 2:
+                # A PCP-only server answering our version 0 request
+                raise UnsupportedProtocol('Gateway only speaks PCP')
+            if len(reply) < 12:
+                raise ValueError('Short NAT-PMP reply')
+            version, opcode, result, _, address = struct.unpack('>BBHI4s', reply[:12])
+            if opcode != 128:
+                raise ValueError(f'Unexpected NAT-PMP opcode {opcode}')
+            if result != 0:
+                raise ValueError(f'NAT-PMP result code {result}')
+            return socket.inet_ntoa(address)
+    raise TimeoutError('No NAT-PMP reply')
+
+
+def _pcp_map(sock, gateway, port, client_ip, nonce, lifetime):
+    request = struct.pack('>BBHI16s', 2, 1, 0, lifetime, ipaddress.IPv6Address(f'::ffff:{client_ip}').packed)
+    request += nonce + struct.pack('>B3xHH16s', 17, 9, 0, bytes(16))
+    sock.sendto(request, (gateway, port))
+    reply, _ = sock.recvfrom(1100)
+    if len(reply) < 60 or reply[1] != 0x81:
+        raise ValueError('Malformed PCP reply')
+    if reply[3] != 0:
+        raise ValueError(f'PCP result code {reply[3]}')
+    if reply[24:36] != nonce:
+        raise ValueError('PCP nonce mismatch')
+    mapped = ipaddress.IPv6Address(reply[44:60])
+    return str(mapped.ipv4_mapped or mapped)
+
+
+def pcp_external_address(gateway, port=NATPMP_PORT, timeout=0.5):
+    """PCP (RFC 6887) has no address query, so map the discard port briefly and delete it again
+
+    The mapping asks for the shortest lifetime PCP allows and is deleted
+    straight after, so the discard port is open inbound for at most a second
+    (or the server's minimum lifetime, if it ignores the delete).
+    """
+    client_ip = _local_address_towards(gateway)
+    nonce = secrets.token_bytes(12)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        address = _pcp_map(sock, gateway, port, client_ip, nonce, lifetime=PCP_LIFETIME)
+        try:
+            _pcp_map(sock, gateway, port, client_ip, nonce, lifetime=0)
+        except (OSError, ValueError) as e:
+            logging.debug(f"PCP mapping cleanup failed: {e}")
+        return address
+
+
+def ssdp_search(address=SSDP_ADDRESS, timeout=2.0):
+    """Send an SSDP M-SEARCH for IGD devices and return the description URLs that answer"""
+    locations = []
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) as sock:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
+        sock.settimeout(timeout)
+        for target in IGD_SEARCH_TARGETS:
+            message = (
+                'M-SEARCH * HTTP/1.1\r\n'
+                f'HOST: {SSDP_ADDRESS[0]}:{SSDP_ADDRESS[1]}\r\n'
+                'MAN: "ssdp:discover"\r\n'
+                f'MX: {max(1, int(timeout))}\r\n'
+                f'ST: {target}\r\n\r\n'
+            )
+            sock.sendto(message.encode(), address)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            sock.settimeout(max(0.01, deadline - time.monotonic()))
+            try:
+                reply, _ = sock.recvfrom(2048)
+            except socket.timeout:
+                break
+            match = re.search(rb'^location:\s*(\S+)', reply, re.IGNORECASE | re.MULTILINE)
+            if match and match.group(1).decode() not in locations:
+                locations.append(match.group(1).decode())
+    return locations
+
+
+def find_wan_service(location, timeout=3):
+    """Read an IGD description and return (control_url, service_type) of its WAN connection service"""
+    response = requests.get(location, timeout=timeout)
+    response.raise_for_status()
+    root = ET.fromstring(response.content)
+    base = location
+    for element in root.iter():
+        if element.tag.endswith('URLBase') and element.text:
+            base = element.text.strip()
+    for service in root.iter():
+        if not service.tag.endswith('}service') and service.tag != 'service':
+            continue
+        fields = {child.tag.rsplit('}', 1)[-1]: (child.text or '').strip() for child in service}
+        if fields.get('serviceType') in WAN_SERVICES and fields.get('controlURL'):
+            return urljoin(base, fields['controlURL']), fields['serviceType']
+    return None
+
+
+def igd_external_address(control_url, service_type, timeout=3):
+    """Call GetExternalIPAddress on a WAN connection service"""
+    response = requests.post(
+        control_url,
+        data=SOAP_ENVELOPE.format(action='GetExternalIPAddress', service=service_type),
+        headers={
+            'Content-Type': 'text/xml; charset="utf-8"',
+            'SOAPAction': f'"{service_type}#GetExternalIPAddress"'
+        },
+        timeout=timeout
+    )
+    response.raise_for_status()
+    for element in ET.fromstring(response.content).iter():
+        if element.tag.endswith('NewExternalIPAddress'):
+            return (element.text or '').strip()
+    raise ValueError('No NewExternalIPAddress in SOAP response')
+
+
+class GatewayDiscovery:
+    """Queries the gateway for the WAN address, remembering what worked between checks
+
+    The UPnP control URL is cached in `data/gateway.json` so SSDP runs only
+    when the cache is empty or stale. Protocols the gateway does not answer are
+    skipped for an hour. Results are cross-checked against an internet
+    provider every `validate_interval` seconds by IPMonitor.
+    """
+    def __init__(self, data_dir="data", gateway=None, natpmp_port=NATPMP_PORT, ssdp_address=SSDP_ADDRESS,
+                 igd_location=None, validate_interval=3600, cache_ttl=86400, enabled=True):
+        self.cache_file = Path(data_dir) / 'gateway.json'
+        self.gateway = gateway
+        self.natpmp_port = natpmp_port
+        self.ssdp_address = ssdp_address
+        self.igd_location = igd_location
+        self.validate_interval = validate_interval
+        self.cache_ttl = cache_ttl
+        self.enabled = enabled
+        self.cache = self._load_cache()
+        self.last_validated = 0
+        self.distrust_until = 0
+        self._skip_until = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, data_dir="data"):
+        ssdp = os.getenv('SSDP_ADDRESS')
+        return cls(
+            data_dir,
+            gateway=os.getenv('GATEWAY_ADDRESS'),
+            natpmp_port=int(os.getenv('NATPMP_PORT', str(NATPMP_PORT))),
+            ssdp_address=(ssdp.rsplit(':', 1)[0], int(ssdp.rsplit(':', 1)[1])) if ssdp else SSDP_ADDRESS,
+            igd_location=os.getenv('IGD_LOCATION'),
+            validate_interval=int(os.getenv('GATEWAY_VALIDATE_INTERVAL', '3600')),
+            enabled=os.getenv('GATEWAY_DISCOVERY', 'true').lower() == 'true'
+        )
+
+    def _load_cache(self):
+        if not self.cache_file.exists():
+            return {}
+        try:
+            with open(self.cache_file, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            logging.error(f"Error loading gateway cache: {e}")
+            return {}
+
+    def _save_cache(self):
+        try:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.cache_file, 'w') as f:
+                json.dump(self.cache, f, indent=2)
+        except Exception as e:
+            logging.error(f"Error saving gateway cache: {e}")
+
+    def _skipped(self, method):
+        return time.time() < self._skip_until.get(method, 0)
+
+    def _fail(self, method, error):
+        logging.debug(f"Gateway {method} lookup failed: {error}")
+        self._skip_until[method] = time.time() + NEGATIVE_CACHE_TTL
+
+    def _natpmp(self, gateway):
+        try:
+            return natpmp_external_address(gateway, self.natpmp_port)
+        except UnsupportedProtocol:
+            return pcp_external_address(gateway, self.natpmp_port)
+
+    def _control_url(self, refresh=False):
+        """Cached (control_url, service_type), running SSDP only when needed"""
+        cached = self.cache.get('igd')
+        if cached and not refresh and time.time() - cached.get('discovered_at', 0) < self.cache_ttl:
+            return cached['control_url'], cached['service_type']
+
+        with tracer.span('gateway.discover'):
+            locations = [self.igd_location] if self.igd_location else ssdp_search(self.ssdp_address)
+            for location in locations:
+                try:
+                    found = find_wan_service(location)
+                except Exception as e:
+                    logging.debug(f"Skipping IGD description {location}: {e}")
+                    continue
+                if found:
+                    self.cache['igd'] = {'location': location, 'control_url': found[0],
+                                         'service_type': found[1], 'discovered_at': time.time()}
+                    self._save_cache()
+                    return found
+        return None
+
+    def _upnp(self):
+        found = self._control_url()
+        if found is None:
+            raise LookupError('No UPnP IGD found')
+        try:
+            return igd_external_address(*found)
+        except (requests.RequestException, ValueError, ET.ParseError):
+            # The router may have restarted on a new port; rediscover once
+            found = self._control_url(refresh=True)
+            if found is None:
+                raise
+            return igd_external_address(*found)
+
+    def get_external_ip(self, cancel=None):
+        """Return (ip, source) from the first protocol that answers, or None
+
+        A set `cancel` event stops the lookup before the next protocol is tried.
+        """
+        if not self.enabled or time.time() < self.distrust_until:
+            return None
+        with self._lock:
+            gateway = self.gateway or default_gateway()
+            methods = []
+            if gateway:
+                methods.append(('natpmp', lambda: self._natpmp(gateway), f"natpmp://{gateway}"))
+            methods.append(('upnp', self._upnp, None))
+            # Try whichever protocol answered last time first
+            methods.sort(key=lambda m: m[0] != self.cache.get('method'))
+
+            for name, lookup, source in methods:
+                if cancel is not None and cancel.is_set():
+                    return None
+                if self._skipped(name):
+                    continue
+                try:
+                    with tracer.span('gateway.lookup', method=name):
+                        ip = lookup()
+                except Exception as e:
+                    self._fail(name, e)
+                    continue
+                if not is_public_address(ip):
+                    # Behind another NAT (e.g. CGNAT): the gateway cannot know the public IP
+                    self._fail(name, f"reported non-public address {ip}")
+                    continue
+                if self.cache.get('method') != name:
+                    self.cache['method'] = name
+                    self._save_cache()
+                if source is None:
+                    source = f"upnp://{self.cache['igd']['control_url'].split('/')[2]}"
+                return ip, source
+        return None
+
+    def validation_due(self):
+        return time.time() - self.last_validated >= self.validate_interval
+
+    def record_validation(self, matched):
+        """Note the outcome of a cross-check against an internet provider
+
+        matched is None when no provider answered: the gateway stays trusted
+        and the cross-check is retried after VALIDATION_RETRY seconds rather
+        than on every check.
+        """
+        now = time.time()
+        if matched is None:
+            self.last_validated = now - self.validate_interval + min(VALIDATION_RETRY, self.validate_interval)
+            return
+        self.last_validated = now
+        if not matched:
+            self.distrust_until = self.last_validated + self.validate_interval
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Query the NAT gateway for the WAN address")
+    parser.parse_args()
+    print(GatewayDiscovery.from_env().get_external_ip())
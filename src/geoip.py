@@ -0,0 +1,226 @@
+import ipaddress
+import logging
+import mmap
+import os
+import struct
+from functools import lru_cache
+
+METADATA_MARKER = b'\xab\xcd\xefMaxMind.com'
+
+
+class InvalidDatabaseError(Exception):
+    """Raised when a file is not a readable MaxMind DB"""
+
+
+class MMDBReader:
+    """Reader for MaxMind DB (.mmdb) files over a read-only memory map
+
+    Only the search tree nodes and data records touched by a lookup are read,
+    so the database is never loaded into RAM as a whole.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        marker = self._buf.rfind(METADATA_MARKER, max(0, len(self._buf) - 128 * 1024))
+        if marker == -1:
+            self._buf.close()
+            raise InvalidDatabaseError(f"{path} is not a MaxMind DB file")
+        metadata_start = marker + len(METADATA_MARKER)
+        self.metadata, _ = _Decoder(self._buf, metadata_start).decode(0)
+
+        self.node_count = self.metadata['node_count']
+        self.record_size = self.metadata['record_size']
+        self.ip_version = self.metadata['ip_version']
+        if self.record_size not in (24, 28, 32):
+            raise InvalidDatabaseError(f"Unsupported record size: {self.record_size}")
+
+        self._node_bytes = self.record_size // 4
+        self._tree_size = self._node_bytes * self.node_count
+        self._data_start = self._tree_size + 16
+        self._decoder = _Decoder(self._buf, self._data_start)
+        self._ipv4_start = None
+
+    @property
+    def database_type(self):
+        return self.metadata.get('database_type', '')
+
+    def _read_node(self, node, index):
+        offset = node * self._node_bytes
+        buf = self._buf
+        if self.record_size == 24:
+            offset += index * 3
+            return (buf[offset] << 16) | (buf[offset + 1] << 8) | buf[offset + 2]
+        if self.record_size == 28:
+            if index:
+                return ((buf[offset + 3] & 0x0F) << 24) | (buf[offset + 4] << 16) | (buf[offset + 5] << 8) | buf[offset + 6]
+            return ((buf[offset + 3] & 0xF0) << 20) | (buf[offset] << 16) | (buf[offset + 1] << 8) | buf[offset + 2]
+        offset += index * 4
+        return struct.unpack_from('>I', buf, offset)[0]
+
+    def _start_node(self, bit_count):
+        # IPv4 addresses live under ::/96 in IPv6 databases
+        if self.ip_version != 6 or bit_count == 128:
+            return 0
+        if self._ipv4_start is None:
+            node = 0
+            for _ in range(96):
+                if node >= self.node_count:
+                    break
+                node = self._read_node(node, 0)
+            self._ipv4_start = node
+        return self._ipv4_start
+
+    def get(self, ip):
+        """Return the data record for an IP address, or None if it is not in the database"""
+        address = ipaddress.ip_address(ip)
+        if address.version == 6 and self.ip_version == 4:
+            raise ValueError(f"Cannot look up IPv6 address {ip} in an IPv4-only database")
+
+        packed = address.packed
+        bit_count = len(packed) * 8
+        node = self._start_node(bit_count)
+        for i in range(bit_count):
+            if node >= self.node_count:
+                break
+            bit = (packed[i >> 3] >> (7 - (i % 8))) & 1
+            node = self._read_node(node, bit)
+
+        if node <= self.node_count:
+            return None
+        offset = node - self.node_count - 16
+        return self._decoder.decode(offset)[0]
+
+    def close(self):
+        self._buf.close()
+
+
+class _Decoder:
+    """Decoder for the MaxMind DB data section format"""
+    def __init__(self, buf, pointer_base):
+        self._buf = buf
+        self._base = pointer_base
+
+    def decode(self, offset):
+        """Decode the value at offset (relative to the section start); returns (value, next_offset)"""
+        buf = self._buf
+        pos = self._base + offset
+        ctrl = buf[pos]
+        pos += 1
+        type_num = ctrl >> 5
+
+        if type_num == 1:  # pointer
+            size = (ctrl >> 3) & 0x3
+            value = ctrl & 0x7
+            if size == 0:
+                pointer = (value << 8) | buf[pos]
+            elif size == 1:
+                pointer = ((value << 16) | (buf[pos] << 8) | buf[pos + 1]) + 2048
+            elif size == 2:
+                pointer = ((value << 24) | (buf[pos] << 16) | (buf[pos + 1] << 8) | buf[pos + 2]) + 526336
+            else:
+                pointer = struct.unpack_from('>I', buf, pos)[0]
+            pos += size + 1
+            return self.decode(pointer)[0], pos - self._base
+
+        if type_num == 0:  # extended type
+            type_num = 7 + buf[pos]
+            pos += 1
+
+        size = ctrl & 0x1F
+        if size >= 29:
+            extra = size - 28
+            raw = int.from_bytes(buf[pos:pos + extra], 'big')
+            size = {1: 29, 2: 285, 3: 65821}[extra] + raw
+            pos += extra
+
+        if type_num == 2:  # utf8 string
+            return bytes(buf[pos:pos + size]).decode('utf-8'), pos + size - self._base
+        if type_num == 3:  # double
+            return struct.unpack_from('>d', buf, pos)[0], pos + 8 - self._base
+        if type_num == 4:  # bytes
+            return bytes(buf[pos:pos + size]), pos + size - self._base
+        if type_num in (5, 6, 9, 10):  # unsigned integers
+            return int.from_bytes(buf[pos:pos + size], 'big'), pos + size - self._base
+        if type_num == 8:  # int32
+            value = int.from_bytes(buf[pos:pos + size], 'big')
+            if size == 4 and value & 0x80000000:
+                value -= 1 << 32
+            return value, pos + size - self._base
+        if type_num == 7:  # map
+            result = {}
+            offset = pos - self._base
+            for _ in range(size):
+                key, offset = self.decode(offset)
+                result[key], offset = self.decode(offset)
+            return result, offset
+        if type_num == 11:  # array
+            result = []
+            offset = pos - self._base
+            for _ in range(size):
+                value, offset = self.decode(offset)
+                result.append(value)
+            return result, offset
+        if type_num == 14:  # boolean, stored in the size field
+            return bool(size), pos - self._base
+        if type_num == 15:  # float
+            return struct.unpack_from('>f', buf, pos)[0], pos + 4 - self._base
+        raise InvalidDatabaseError(f"Unexpected data type {type_num} at offset {offset}")
+
+
+class GeoIPEnricher:
+    """Looks up country, city, ASN and ISP for an IP from local .mmdb files with an LRU cache"""
+    def __init__(self, city_db=None, asn_db=None, cache_size=1024):
+        self.readers = []
+        for path in (city_db, asn_db):
+            if path and os.path.exists(path):
+                try:
+                    self.readers.append(MMDBReader(path))
+                except (OSError, InvalidDatabaseError) as e:
+                    logging.error(f"Error opening GeoIP database {path}: {e}")
+        self.lookup = lru_cache(maxsize=cache_size)(self._lookup)
+
+    @classmethod
+    def from_env(cls, data_dir="data"):
+        """Build an enricher from GEOIP_CITY_DB / GEOIP_ASN_DB (defaults to the GeoLite2 files in data/)"""
+        return cls(
+            city_db=os.getenv('GEOIP_CITY_DB', os.path.join(data_dir, 'GeoLite2-City.mmdb')),
+            asn_db=os.getenv('GEOIP_ASN_DB', os.path.join(data_dir, 'GeoLite2-ASN.mmdb')),
+            cache_size=int(os.getenv('GEOIP_CACHE_SIZE', '1024'))
+        )
+
+    @property
+    def enabled(self):
+        return bool(self.readers)
+
+    def _lookup(self, ip):
+        """Merge the records of every configured database into a flat summary"""
+        info = {}
+        for reader in self.readers:
+            try:
+                record = reader.get(ip)
+            except ValueError as e:
+                logging.debug(f"GeoIP lookup skipped for {ip}: {e}")
+                continue
+            if not record:
+                continue
+
+            country = record.get('country') or record.get('registered_country') or {}
+            if country:
+                info.setdefault('country', country.get('names', {}).get('en'))
+                info.setdefault('country_code', country.get('iso_code'))
+            city = record.get('city', {}).get('names', {}).get('en')
+            if city:
+                info.setdefault('city', city)
+            asn = record.get('autonomous_system_number') or record.get('asn')
+            if asn:
+                info.setdefault('asn', f"AS{asn}")
+            isp = record.get('isp') or record.get('autonomous_system_organization') or record.get('organization')
+            if isp:
+                info.setdefault('isp', isp)
+        return {k: v for k, v in info.items() if v} or None
+
+    def close(self):
+        for reader in self.readers:
+            reader.close()
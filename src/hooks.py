@@ -0,0 +1,210 @@
+import json
+import logging
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from .tracing import tracer
+
+# Only the last this many bytes of stdout/stderr are kept per stream
+MAX_OUTPUT_BYTES = 64 * 1024
+# Variables passed through from our own environment; everything else is dropped
+PASSTHROUGH_ENV = ('PATH', 'HOME', 'LANG', 'LC_ALL', 'TZ', 'PYTHONPATH')
+
+# Runs a "module:function" entry point in a child interpreter, handing it the payload from stdin
+_ENTRY_POINT_RUNNER = """
+import importlib, json, sys
+module, _, func = sys.argv[1].partition(':')
+result = getattr(importlib.import_module(module), func)(json.load(sys.stdin))
+if result is not None:
+    print(json.dumps(result, default=str))
+"""
+
+
+class Hook:
+    """A configured reaction to an event: an executable or a Python entry point"""
+    def __init__(self, spec, default_cwd):
+        self.name = spec['name']
+        if spec.get('command'):
+            command = spec['command']
+            self.argv = shlex.split(command) if isinstance(command, str) else list(command)
+        elif spec.get('python'):
+            self.argv = [sys.executable, '-c', _ENTRY_POINT_RUNNER, spec['python']]
+        else:
+            raise ValueError(f"Hook {self.name} needs a 'command' or 'python' entry point")
+        self.events = spec.get('events', ['ip_change'])
+        self.enabled = spec.get('enabled', True)
+        self.timeout = float(spec.get('timeout', 30))
+        self.cwd = spec.get('cwd', str(default_cwd))
+        self.env = {k: str(v) for k, v in spec.get('env', {}).items()}
+        self.running = False
+        self.pending = None  # Latest payload that arrived while the hook was running
+
+    def accepts(self, event):
+        return self.enabled and event in self.events
+
+    def _environment(self, payload):
+        env = {k: os.environ[k] for k in PASSTHROUGH_ENV if k in os.environ}
+        env.update(self.env)
+        env.update({
+            'IPSENTINEL_EVENT': payload['event'],
+            'IPSENTINEL_NEW_IP': payload.get('new_ip') or '',
+            'IPSENTINEL_OLD_IP': payload.get('old_ip') or ''
+        })
+        return env
+
+    def execute(self, payload):
+        """Run the hook once and return its result record"""
+        result = {
+            'hook': self.name,
+            'event': payload['event'],
+            'new_ip': payload.get('new_ip'),
+            'old_ip': payload.get('old_ip'),
+            'started': datetime.now().isoformat(timespec='seconds'),
+            'exit_code': None,
+            'stdout': '',
+            'stderr': ''
+        }
+        started = time.perf_counter()
+        try:
+            os.makedirs(self.cwd, exist_ok=True)
+            # Output goes to unlinked temporary files rather than pipes, so a chatty hook is never held in memory
+            with tempfile.TemporaryFile() as stdout, tempfile.TemporaryFile() as stderr:
+                # A new session lets a timeout kill the hook together with anything it spawned
+                process = subprocess.Popen(
+                    self.argv, cwd=self.cwd, env=self._environment(payload),
+                    stdin=subprocess.PIPE, stdout=stdout, stderr=stderr,
+                    start_new_session=True
+                )
+                try:
+                    process.communicate(json.dumps(payload).encode(), timeout=self.timeout)
+                    result['status'] = 'ok' if process.returncode == 0 else 'failed'
+                except subprocess.TimeoutExpired:
+                    os.killpg(process.pid, signal.SIGKILL)
+                    process.wait()
+                    result['status'] = 'timeout'
+                result['exit_code'] = process.returncode
+                result['stdout'] = _tail(stdout)
+                result['stderr'] = _tail(stderr)
+        except Exception as e:
+            result['status'] = 'error'
+            result['stderr'] = str(e)
+        result['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        return result
+
+
+def _tail(f, limit=MAX_OUTPUT_BYTES):
+    """Last `limit` bytes written to a file, decoded"""
+    size = f.seek(0, os.SEEK_END)
+    f.seek(max(0, size - limit))
+    return f.read().decode(errors='replace')
+
+
+class HookRunner:
+    """Runs on-change hooks in a bounded worker pool without blocking the caller"""
+    def __init__(self, config_dir="data"):
+        self.config_dir = Path(config_dir)
+        self.config_file = self.config_dir / 'hooks.json'
+        self.config = self._load_config()
+        self.history = deque(maxlen=self.config['history_size'])
+        self._lock = threading.Lock()
+        self._executor = None
+        self.hooks = self._build_hooks()
+
+    def _load_config(self):
+        """Load hook settings from config file"""
+        config = {}
+        if self.config_file.exists():
+            with open(self.config_file, 'r') as f:
+                config = json.load(f)
+        config.setdefault('enabled', False)
+        config.setdefault('hooks', [])
+        config.setdefault('max_concurrency', 4)
+        config.setdefault('history_size', 200)
+        return config
+
+    def _build_hooks(self):
+        hooks = {}
+        for spec in self.config['hooks']:
+            try:
+                hook = Hook(spec, self.config_dir / 'hooks')
+                hooks[hook.name] = hook
+            except Exception as e:
+                logging.error(f"Skipping invalid hook {spec.get('name')}: {e}")
+        return hooks
+
+    @property
+    def enabled(self):
+        return self.config['enabled'] and bool(self.hooks)
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=max(1, int(self.config['max_concurrency'])),
+                thread_name_prefix='hook'
+            )
+        return self._executor
+
+    def run(self, event, new_ip=None, old_ip=None, names=None):
+        """Queue every hook that accepts the event and return the names queued
+
+        Each hook runs at most once at a time. A payload that arrives while the
+        hook is busy replaces any earlier waiting one, so the hook always runs
+        next with the latest IP.
+        """
+        if not self.config['enabled'] and names is None:
+            return []
+        payload = {'event': event, 'new_ip': new_ip, 'old_ip': old_ip,
+                   'timestamp': datetime.now().isoformat(timespec='seconds')}
+        queued = []
+        for hook in self.hooks.values():
+            if names is not None:
+                if hook.name not in names:
+                    continue
+            elif not hook.accepts(event):
+                continue
+            with self._lock:
+                if hook.running:
+                    hook.pending = payload
+                else:
+                    hook.running = True
+                    self._get_executor().submit(self._worker, hook, payload)
+            queued.append(hook.name)
+        return queued
+
+    def _worker(self, hook, payload):
+        while payload is not None:
+            with tracer.span('hooks.run', hook=hook.name) as span:
+                result = hook.execute(payload)
+                span.attrs['status'] = result['status']
+            if result['status'] != 'ok':
+                logging.error(f"Hook {hook.name} {result['status']} (exit {result['exit_code']}): "
+                              f"{result['stderr'].strip()[:200]}")
+            with self._lock:
+                self.history.append(result)
+                payload, hook.pending = hook.pending, None
+                if payload is None:
+                    hook.running = False
+
+    def get_history(self, limit=50, hook=None):
+        """Recent hook results, newest first"""
+        with self._lock:
+            results = [r for r in reversed(self.history) if hook is None or r['hook'] == hook]
+        return results[:limit]
+
+    def get_status(self):
+        with self._lock:
+            return [
+                {'name': h.name, 'events': h.events, 'enabled': h.enabled, 'timeout': h.timeout,
+                 'running': h.running, 'pending': h.pending is not None}
+                for h in self.hooks.values()
+            ]
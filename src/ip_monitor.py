@@ -2,15 +2,35 @@ import requests
 import logging
 import os
 import json
+import time
 from datetime import datetime
 from pathlib import Path
 from typing import Optional, Dict
+from .tracing import tracer
+from .geoip import GeoIPEnricher
+from .connectivity import ConnectivityMonitor
+from .gateway import GatewayDiscovery
+from .blocklist import Blocklist
+from . import database, logreader
 
 class IPMonitor:
-    def __init__(self, log_file: str = "logs/ip_changes.log", data_dir: str = "data"):
+    def __init__(self, log_file: str = "logs/ip_changes.log", data_dir: str = "data",
+                 enricher: Optional[GeoIPEnricher] = None, recorder=None,
+                 connectivity: Optional[ConnectivityMonitor] = None, http=None,
+                 gateway: Optional[GatewayDiscovery] = None, blocklist: Optional[Blocklist] = None):
         self.log_file = log_file
         self.data_dir = Path(data_dir)
         self.data_dir.mkdir(parents=True, exist_ok=True)
+        self.db_file = str(self.data_dir / 'ip_log.db')
+        self.enricher = enricher if enricher is not None else GeoIPEnricher.from_env(data_dir)
+        self.blocklist = blocklist if blocklist is not None else Blocklist.from_env(data_dir)
+        self.recorder = recorder  # Optional CheckRecorder storing every check result
+        self.last_provider = None
+        self.last_status = None  # Result of the most recent completed check, served to the dashboard
+        self.last_checked = None
+        self.http = http or requests  # Anything with a requests-style get(); swapped out by the simulator
+        self.gateway = gateway if gateway is not None else GatewayDiscovery.from_env(data_dir)
+        self.connectivity = connectivity if connectivity is not None else ConnectivityMonitor(self.db_file)
         
         # Setup logging with custom datetime format
         logging.basicConfig(
@@ -44,64 +64,197 @@ class IPMonitor:
             'last_updated': datetime.now().isoformat()
         }
         try:
-            with open(ip_file, 'w') as f:
-                json.dump(data, f)
+            with tracer.span('monitor.save_ip'):
+                with open(ip_file, 'w') as f:
+                    json.dump(data, f)
         except Exception as e:
             logging.error(f"Error saving IP: {e}")
     
-    def get_public_ip(self) -> Optional[str]:
-        """Get public IP with fallback providers"""
-        providers = [
+    def _enrich(self, ip: str) -> Optional[Dict[str, str]]:
+        """Look up GeoIP/ASN details for an IP from the local databases"""
+        if not self.enricher.enabled:
+            return None
+        try:
+            with tracer.span('monitor.enrich'):
+                return self.enricher.lookup(ip)
+        except Exception as e:
+            logging.error(f"Error enriching IP {ip}: {e}")
+            return None
+
+    def _check_blocklists(self, ip: str) -> list:
+        """Names of the local blocklists that contain the IP"""
+        if not self.blocklist.enabled:
+            return []
+        try:
+            with tracer.span('monitor.blocklist'):
+                return self.blocklist.check(ip)
+        except Exception as e:
+            logging.error(f"Error checking blocklists for {ip}: {e}")
+            return []
+
+    def _record_change(self, ip: str, previous_ip: Optional[str], enrichment: Optional[Dict[str, str]]) -> None:
+        """Store a change event with its enrichment in the history database"""
+        conn = database.get_db_connection(self.db_file)
+        if conn is None:
+            return
+        try:
+            database.create_table(conn)
+            database.log_ip(conn, ip, previous_ip=previous_ip, enrichment=enrichment)
+        except Exception as e:
+            logging.error(f"Error recording IP change: {e}")
+        finally:
+            database.close_connection(conn)
+
+    def get_history(self, limit: Optional[int] = None):
+        """Return recorded change events, newest first"""
+        conn = database.get_db_connection(self.db_file)
+        if conn is None:
+            return []
+        try:
+            database.create_table(conn)
+            return database.get_ip_history(conn, limit)
+        finally:
+            database.close_connection(conn)
+
+    def clear_history(self) -> None:
+        """Remove all recorded change events"""
+        conn = database.get_db_connection(self.db_file)
+        if conn is None:
+            return
+        try:
+            database.create_table(conn)
+            database.clear_ip_history(conn)
+        finally:
+            database.close_connection(conn)
+
+    def _get_providers(self):
+        """Provider URLs and response parsers, overridable with IP_PROVIDER_URLS"""
+        custom = os.getenv('IP_PROVIDER_URLS')
+        if custom:
+            # JSON responses are expected to carry an 'ip' key, anything else is plain text
+            parse = lambda r: r.json()['ip'] if r.text.lstrip().startswith('{') else r.text.strip()
+            return [(url.strip(), parse) for url in custom.split(',') if url.strip()]
+        return [
             ('https://api.ipify.org?format=json', lambda r: r.json()['ip']),
             ('https://ifconfig.me/ip', lambda r: r.text.strip()),
             ('https://api.ipapi.com/api/check?access_key=free', lambda r: r.json()['ip'])
         ]
-        
-        for url, parser in providers:
+
+    def get_public_ip(self, cancel=None) -> Optional[str]:
+        """Get public IP from the local gateway, falling back to internet providers"""
+        self.last_provider = None
+        with tracer.span('monitor.get_public_ip'):
+            ip = self._get_gateway_ip(cancel)
+            if ip:
+                return ip
+            ip = self._query_providers(cancel)
+            if ip is None:
+                logging.error("All IP providers failed")
+            return ip
+
+    def _get_gateway_ip(self, cancel=None) -> Optional[str]:
+        """WAN address reported by the router, periodically cross-checked against a provider"""
+        if not self.gateway.enabled:
+            return None
+        found = self.gateway.get_external_ip(cancel)
+        if found is None:
+            return None
+        ip, source = found
+        if self.gateway.validation_due():
+            external = self._query_providers(cancel)
+            if external is None:
+                # No provider answered: keep trusting the gateway, but do not ask them all again every check
+                if cancel is None or not cancel.is_set():
+                    self.gateway.record_validation(None)
+            else:
+                self.gateway.record_validation(external == ip)
+                if external != ip:
+                    logging.warning(f"Gateway reported {ip} but {self.last_provider} reported {external}; "
+                                    f"ignoring the gateway for {self.gateway.validate_interval}s")
+                    return external
+        self.last_provider = source
+        return ip
+
+    def _query_providers(self, cancel=None, limit=None) -> Optional[str]:
+        """Ask the internet providers in turn (at most limit of them), giving up once cancel is set"""
+        for url, parser in self._get_providers()[:limit]:
+            if cancel is not None and cancel.is_set():
+                return None
             try:
-                response = requests.get(url, timeout=5)
-                if response.status_code == 200:
-                    return parser(response)
+                with tracer.span('provider', url=url) as span:
+                    response = self.http.get(url, timeout=5)
+                    # Time from sending the request to parsing the headers (DNS, TCP, TLS and server time)
+                    span.attrs['status_code'] = response.status_code
+                    span.attrs['response_ms'] = round(response.elapsed.total_seconds() * 1000, 3)
+                    if response.status_code == 200:
+                        ip = parser(response)
+                        self.last_provider = url
+                        return ip
             except Exception as e:
                 logging.debug(f"Provider {url} failed: {e}")
                 continue
-        
-        logging.error("All IP providers failed")
         return None
     
+    @tracer.traced('monitor.last_change_lookup')
     def _get_last_change_time(self) -> Optional[datetime]:
         """Get the timestamp of the last IP change from logs"""
         try:
-            if not os.path.exists(self.log_file):
-                return None
-                
-            with open(self.log_file, 'r') as f:
-                lines = f.readlines()
-                
-            # Look for the most recent "IP changed to" entry
-            for line in reversed(lines):
-                if "IP changed to" in line:
-                    # Extract timestamp from log line (format: "YYYY-MM-DD HH:MM:SS - IP changed to: ...")
-                    timestamp_str = line.split(' - ')[0]
-                    return datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
-            
-            return None
+            # Scans backwards from the end of the log, so the cost does not grow with its size
+            line = next(logreader.change_lines(self.log_file), None)
+            return logreader.parse_timestamp(line) if line else None
         except Exception as e:
             logging.error(f"Error getting last change time: {e}")
             return None
 
-    def check_ip_change(self) -> Dict[str, str]:
-        """Check for IP changes and return status"""
-        new_ip = self.get_public_ip()
+    @tracer.traced('monitor.check_ip_change')
+    def check_ip_change(self, cancel=None) -> Dict[str, str]:
+        """Check for IP changes and return status; cancel is an Event set when the caller gives up"""
+        started = time.perf_counter()
+        confirmed = {}
+
+        def confirm():
+            # One provider, so a real outage still costs at most a single timeout
+            confirmed['ip'] = self._query_providers(cancel, limit=1)
+            return confirmed['ip'] is not None
+
+        online, reason = self.connectivity.check(confirm)
+        if not online:
+            # Skip the providers entirely; they would only time out one after another
+            since = (self.connectivity.outage_started or datetime.now()).strftime('%Y-%m-%d %H:%M:%S')
+            status = {'status': 'offline', 'message': f"Network offline since {since}: {reason}", 'ip': self.current_ip}
+            self.last_provider = None
+            if self.recorder:
+                self.recorder.record(status, None, (time.perf_counter() - started) * 1000)
+            self.last_status, self.last_checked = status, datetime.now()
+            return status
+
+        new_ip = confirmed.get('ip') or self.get_public_ip(cancel)
+        latency_ms = (time.perf_counter() - started) * 1000
+        if cancel is not None and cancel.is_set():
+            # The scheduler has already moved on; recording a late result could race the next check
+            return {'status': 'cancelled', 'message': 'Check cancelled after exceeding its deadline'}
         status = {'status': 'error', 'message': 'Failed to get IP'}
         
         if new_ip:
             if self.current_ip != new_ip:
+                previous_ip = self.current_ip
                 self.current_ip = new_ip
                 self._save_ip(new_ip)
                 msg = f"IP changed to: {new_ip}"
                 logging.info(msg)
-                status = {'status': 'changed', 'message': msg, 'ip': new_ip}
+                geo = self._enrich(new_ip)
+                listed = self._check_blocklists(new_ip)
+                if listed:
+                    logging.warning(f"New IP {new_ip} is on blocklists: {', '.join(listed)}")
+                enrichment = dict(geo or {})
+                if listed:
+                    enrichment['blocklists'] = listed
+                self._record_change(new_ip, previous_ip, enrichment or None)
+                status = {'status': 'changed', 'message': msg, 'ip': new_ip, 'previous_ip': previous_ip}
+                if geo:
+                    status['geo'] = geo
+                if listed:
+                    status['blocklists'] = listed
             else:
                 # Generate a more informative status message based on last change
                 last_change = self._get_last_change_time()
@@ -132,4 +285,7 @@ class IPMonitor:
                 
                 status = {'status': status_type, 'message': status_msg, 'ip': new_ip}
         
+        if self.recorder:
+            self.recorder.record(status, self.last_provider, latency_ms)
+        self.last_status, self.last_checked = status, datetime.now()
         return status
\ No newline at end of file
@@ -0,0 +1,119 @@
+import bisect
+from datetime import datetime
+from typing import Iterable, Iterator, Optional
+
+from . import database, logreader
+
+
+def parse_timestamp(value) -> Optional[float]:
+    """Epoch seconds for an epoch number (s or ms) or ISO 8601 string; naive times are local"""
+    if isinstance(value, (int, float)):
+        number = float(value)
+    else:
+        text = str(value).strip()
+        if not text:
+            return None
+        if not text.replace('.', '', 1).isdigit():
+            try:
+                return datetime.fromisoformat(text.replace('Z', '+00:00')).timestamp()
+            except ValueError:
+                return None
+        number = float(text)
+    return number / 1000 if number > 1e12 else number
+
+
+class LeaseIndex:
+    """Change history as sorted [start, end) leases, answering point-in-time lookups by bisection"""
+    def __init__(self, changes):
+        changes = sorted(changes)
+        # Collapse repeated records of the same IP so each lease spans the whole period
+        self.starts = []
+        self.ips = []
+        for ts, ip in changes:
+            if self.ips and self.ips[-1] == ip:
+                continue
+            self.starts.append(ts)
+            self.ips.append(ip)
+        self._labels = [_format(ts) for ts in self.starts] + [None]
+
+    @classmethod
+    def from_database(cls, db_file):
+        return cls(_database_changes(db_file))
+
+    @classmethod
+    def from_log(cls, log_file):
+        return cls(_log_changes(log_file))
+
+    @classmethod
+    def load(cls, db_file, log_file):
+        """Both the history database and the plain-text change log, a change recorded in each counted once
+
+        Either source can hold changes the other lacks: the database only
+        exists once it has been enabled, and a failed database write still
+        leaves the log line. Where both record a change at the same instant,
+        the database row wins.
+        """
+        changes = dict(_log_changes(log_file))
+        changes.update(_database_changes(db_file))
+        return cls(changes.items())
+
+    def __len__(self):
+        return len(self.starts)
+
+    def lookup(self, ts: float):
+        """(ip, start, end) of the lease covering ts; end is None for the current lease"""
+        i = bisect.bisect_right(self.starts, ts) - 1
+        if i < 0:
+            return None
+        end = self.starts[i + 1] if i + 1 < len(self.starts) else None
+        return self.ips[i], self.starts[i], end
+
+    def resolve(self, value) -> dict:
+        """Lookup result for one raw timestamp value"""
+        ts = parse_timestamp(value)
+        i = bisect.bisect_right(self.starts, ts) - 1 if ts is not None else -1
+        result = {
+            'timestamp': value,
+            'ip': self.ips[i] if i >= 0 else None,
+            'since': self._labels[i] if i >= 0 else None,
+            'until': self._labels[i + 1] if i >= 0 else None
+        }
+        if ts is None:
+            result['error'] = 'Unparseable timestamp'
+        return result
+
+    def lookup_many(self, values: Iterable) -> Iterator[dict]:
+        """Answer a stream of timestamps one at a time, never holding the input in memory"""
+        return map(self.resolve, values)
+
+    def leases(self):
+        return [
+            {'ip': ip, 'since': self._labels[i], 'until': self._labels[i + 1]}
+            for i, ip in enumerate(self.ips)
+        ]
+
+
+def _database_changes(db_file):
+    """(timestamp, ip) of every change in the history database"""
+    conn = database.get_db_connection(db_file)
+    if conn is None:
+        return []
+    try:
+        database.create_table(conn)
+        rows = database.get_ip_history(conn)
+    finally:
+        database.close_connection(conn)
+    return [(datetime.fromisoformat(row['date']).timestamp(), row['ip_address']) for row in rows]
+
+
+def _log_changes(log_file):
+    """(timestamp, ip) of every change line in the change log"""
+    changes = []
+    for line in logreader.change_lines(log_file):
+        when, ip = logreader.parse_change(line)
+        changes.append((when.timestamp(), ip))
+    return changes
+
+
+def _format(ts):
+    return datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S') if ts is not None else None
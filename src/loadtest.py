@@ -0,0 +1,335 @@
+"""End-to-end HTTP load generator for the IP Sentinel web server
+
+Simulates dashboard clients polling the API at the rates used by index.html,
+optionally starting run.py against a local IP provider stub, and reports
+throughput, latency percentiles, error rates and server RSS/CPU over time.
+
+    python -m src.loadtest loadtest/baseline.json --output results.json
+    python -m src.loadtest loadtest/baseline.json --compare previous.json
+"""
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import requests
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+class ProviderStub:
+    """Local stand-in for the public IP providers"""
+    def __init__(self, ip='203.0.113.10', latency_ms=20):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                time.sleep(stub.latency_ms / 1000.0)
+                body = json.dumps({'ip': stub.ip}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.ip = ip
+        self.latency_ms = latency_ms
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+
+
+class ServerProcess:
+    """Runs run.py in a scratch working directory"""
+    def __init__(self, port, provider_url):
+        self.port = port
+        self._tmp = tempfile.TemporaryDirectory(prefix='ipsentinel-load-')
+        self.workdir = self._tmp.name
+        os.makedirs(os.path.join(self.workdir, 'logs'), exist_ok=True)
+        # Only the stub provider may be contacted: no gateway probes or connectivity preflight
+        env = dict(os.environ, PORT=str(port), IP_PROVIDER_URLS=provider_url,
+                   PYTHONPATH=str(REPO_ROOT), GATEWAY_DISCOVERY='false', PREFLIGHT_ENABLED='false')
+        self.process = subprocess.Popen(
+            [sys.executable, str(REPO_ROOT / 'run.py')],
+            cwd=self.workdir, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        self.pid = self.process.pid
+
+    def wait_ready(self, timeout=30):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                if requests.get(f"http://127.0.0.1:{self.port}/health", timeout=1).status_code == 200:
+                    return True
+            except requests.RequestException:
+                time.sleep(0.2)
+        return False
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self._tmp.cleanup()
+
+
+class ResourceSampler:
+    """Samples RSS and CPU of a process from /proc once per interval"""
+    def __init__(self, pid, interval=1.0):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+        self._page = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _read(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / self._ticks
+        with open(f"/proc/{self.pid}/statm") as f:
+            rss_bytes = int(f.read().split()[1]) * self._page
+        return cpu_seconds, rss_bytes
+
+    def _run(self):
+        start = time.time()
+        try:
+            last_cpu, _ = self._read()
+        except OSError:
+            return
+        last_time = time.time()
+        while not self._stop.wait(self.interval):
+            try:
+                cpu, rss = self._read()
+            except OSError:
+                return
+            now = time.time()
+            self.samples.append({
+                't': round(now - start, 1),
+                'rss_mb': round(rss / 1048576, 1),
+                'cpu_pct': round(100 * (cpu - last_cpu) / (now - last_time), 1)
+            })
+            last_cpu, last_time = cpu, now
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class LoadTest:
+    """Runs a scenario of simulated dashboard clients against a base URL"""
+    def __init__(self, scenario, base_url):
+        self.scenario = scenario
+        self.base_url = base_url.rstrip('/')
+        self.speedup = float(scenario.get('speedup', 1))
+        self.results = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _record(self, name, latency_ms, ok):
+        with self._lock:
+            entry = self.results.setdefault(name, {'latencies': [], 'errors': 0})
+            entry['latencies'].append(latency_ms)
+            if not ok:
+                entry['errors'] += 1
+
+    def _request(self, session, spec):
+        name = f"{spec.get('method', 'GET')} {spec['path']}"
+        start = time.perf_counter()
+        try:
+            response = session.request(spec.get('method', 'GET'), self.base_url + spec['path'],
+                                        timeout=self.scenario.get('timeout', 30))
+            ok = response.status_code < 400
+        except requests.RequestException:
+            ok = False
+        self._record(name, (time.perf_counter() - start) * 1000, ok)
+
+    def _client(self, profile):
+        session = requests.Session()
+        # Stagger page loads so clients do not fire in lockstep
+        if self._stop.wait(random.uniform(0, self.scenario.get('ramp_up', 5))):
+            return
+        for spec in profile.get('on_load', []):
+            self._request(session, spec)
+
+        now = time.monotonic()
+        schedule = [(now + random.uniform(0, spec['interval'] / self.speedup), spec)
+                    for spec in profile.get('poll', [])]
+        while schedule and not self._stop.is_set():
+            schedule.sort(key=lambda item: item[0])
+            due, spec = schedule[0]
+            if self._stop.wait(max(0, due - time.monotonic())):
+                break
+            self._request(session, spec)
+            schedule[0] = (due + spec['interval'] / self.speedup, spec)
+
+    def run(self):
+        threads = []
+        for profile in self.scenario['clients']:
+            for _ in range(int(profile.get('count', 1))):
+                thread = threading.Thread(target=self._client, args=(profile,), daemon=True)
+                threads.append(thread)
+                thread.start()
+
+        started = time.time()
+        self._stop.wait(float(self.scenario.get('duration', 60)))
+        self._stop.set()
+        for thread in threads:
+            thread.join(timeout=self.scenario.get('timeout', 30))
+        return time.time() - started
+
+    def summary(self, elapsed):
+        endpoints = {}
+        all_latencies = []
+        total_errors = 0
+        for name, entry in sorted(self.results.items()):
+            latencies = sorted(entry['latencies'])
+            all_latencies.extend(latencies)
+            total_errors += entry['errors']
+            endpoints[name] = _stats(latencies, entry['errors'], elapsed)
+        all_latencies.sort()
+        return {
+            'duration_s': round(elapsed, 1),
+            'overall': _stats(all_latencies, total_errors, elapsed),
+            'endpoints': endpoints
+        }
+
+
+def _stats(latencies, errors, elapsed):
+    count = len(latencies)
+    return {
+        'requests': count,
+        'throughput_rps': round(count / elapsed, 2) if elapsed else 0,
+        'error_rate': round(errors / count, 4) if count else 0,
+        'p50_ms': _round(percentile(latencies, 50)),
+        'p95_ms': _round(percentile(latencies, 95)),
+        'p99_ms': _round(percentile(latencies, 99)),
+        'max_ms': _round(latencies[-1] if latencies else None)
+    }
+
+
+def _round(value):
+    return round(value, 2) if value is not None else None
+
+
+def compare(current, previous):
+    """Print the change in key metrics against a previous results file"""
+    print("\nComparison with previous run:")
+    names = ['overall'] + sorted(current['endpoints'])
+    for name in names:
+        now = current['overall'] if name == 'overall' else current['endpoints'].get(name)
+        before = previous['overall'] if name == 'overall' else previous.get('endpoints', {}).get(name)
+        if not now or not before:
+            continue
+        parts = []
+        for key in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms', 'error_rate'):
+            if now.get(key) is None or not before.get(key):
+                continue
+            delta = 100.0 * (now[key] - before[key]) / before[key]
+            parts.append(f"{key} {before[key]} -> {now[key]} ({delta:+.1f}%)")
+        print(f"  {name}: " + ", ".join(parts))
+
+
+def print_report(report):
+    overall = report['overall']
+    print(f"\nDuration: {report['duration_s']}s  Requests: {overall['requests']}  "
+          f"Throughput: {overall['throughput_rps']} req/s  Errors: {overall['error_rate'] * 100:.2f}%")
+    print(f"{'endpoint':<24}{'reqs':>8}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'err%':>8}")
+    for name, stats in report['endpoints'].items():
+        print(f"{name:<24}{stats['requests']:>8}{stats['throughput_rps']:>9}"
+              f"{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}{stats['error_rate'] * 100:>8.2f}")
+    if report.get('server'):
+        samples = report['server']
+        print(f"Server RSS peak: {max(s['rss_mb'] for s in samples)} MB  "
+              f"CPU avg: {sum(s['cpu_pct'] for s in samples) / len(samples):.1f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the IP Sentinel web server")
+    parser.add_argument('scenario', help="Scenario JSON file (see loadtest/baseline.json)")
+    parser.add_argument('--url', help="Target an already running server instead of starting run.py")
+    parser.add_argument('--pid', type=int, help="PID of the target server for RSS/CPU sampling when using --url")
+    parser.add_argument('--port', type=int, default=17450, help="Port for the spawned server")
+    parser.add_argument('--duration', type=float, help="Override the scenario duration in seconds")
+    parser.add_argument('--output', help="Write the JSON report to this file")
+    parser.add_argument('--compare', help="Previous JSON report to compare against")
+    args = parser.parse_args(argv)
+
+    with open(args.scenario) as f:
+        scenario = json.load(f)
+    if args.duration:
+        scenario['duration'] = args.duration
+
+    stub = server = None
+    pid = args.pid
+    try:
+        if args.url:
+            base_url = args.url
+        else:
+            provider = scenario.get('provider', {})
+            stub = ProviderStub(ip=provider.get('ip', '203.0.113.10'), latency_ms=provider.get('latency_ms', 20))
+            server = ServerProcess(args.port, stub.url)
+            if not server.wait_ready():
+                print("Server did not become ready", file=sys.stderr)
+                return 1
+            base_url = f"http://127.0.0.1:{args.port}"
+            pid = server.pid
+
+        sampler = ResourceSampler(pid) if pid and os.path.exists(f"/proc/{pid}") else None
+        if sampler:
+            sampler.start()
+
+        test = LoadTest(scenario, base_url)
+        elapsed = test.run()
+        report = test.summary(elapsed)
+        report['scenario'] = scenario.get('name', Path(args.scenario).stem)
+        if sampler:
+            sampler.stop()
+            report['server'] = sampler.samples
+    finally:
+        if server:
+            server.stop()
+        if stub:
+            stub.stop()
+
+    print_report(report)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 1 if report['overall']['error_rate'] > scenario.get('max_error_rate', 0.01) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
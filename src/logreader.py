@@ -0,0 +1,113 @@
+import ipaddress
+import mmap
+import os
+import re
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+
+# Timestamp prefix written by the logging config in IPMonitor
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+CHANGE_MARKER = 'IP changed to'
+# The line IPMonitor logs for a change; other lines quoting the marker (e.g. repr'd check results) do not match
+CHANGE_LINE = re.compile(r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) - ' + CHANGE_MARKER + r': (\S+)$')
+
+
+def reverse_lines(path: str, contains: Optional[str] = None) -> Iterator[str]:
+    """Yield the lines of a text file newest first without reading the whole file
+
+    The file is memory-mapped and scanned backwards from the end, so only the
+    pages holding the lines actually consumed are read from disk. With
+    `contains`, the scan jumps straight to the previous occurrence of that text
+    instead of visiting every line in between.
+    """
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return
+        with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+            needle = contains.encode() if contains else None
+            end = size - 1 if mm[size - 1:size] == b'\n' else size
+            while end > 0:
+                if needle is not None:
+                    hit = mm.rfind(needle, 0, end)
+                    if hit < 0:
+                        return
+                    start = mm.rfind(b'\n', 0, hit) + 1
+                    line_end = mm.find(b'\n', hit, end)
+                    line = mm[start:line_end if line_end >= 0 else end]
+                else:
+                    start = mm.rfind(b'\n', 0, end) + 1
+                    line = mm[start:end]
+                yield line.decode(errors='replace').rstrip('\r')
+                end = start - 1
+
+
+def lines_after(path: str, contains: str, position: Optional[Tuple[int, int]] = None) -> Tuple[List[str], Tuple[int, int], bool]:
+    """Complete lines containing the text written since `position`, oldest first
+
+    Returns (lines, position, restarted): pass the position back in to read
+    only what was appended since this call. A line still being written is
+    left for the next call. If the file was replaced or truncated it is read
+    again from the start, and restarted is True so the caller can drop what
+    it collected from the old file.
+    """
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return [], None, position is not None
+    with f:
+        stat = os.fstat(f.fileno())
+        size = stat.st_size
+        inode, offset = position or (stat.st_ino, 0)
+        restarted = inode != stat.st_ino or size < offset
+        if restarted:
+            offset = 0
+        if size == offset:
+            return [], (stat.st_ino, offset), restarted
+        with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+            end = mm.rfind(b'\n', offset, size) + 1
+            if end <= offset:
+                return [], (stat.st_ino, offset), restarted
+            needle = contains.encode()
+            lines = []
+            hit = mm.find(needle, offset, end)
+            while hit >= 0:
+                start = max(mm.rfind(b'\n', offset, hit) + 1, offset)
+                line_end = mm.find(b'\n', hit, end)
+                lines.append(mm[start:line_end].decode(errors='replace').rstrip('\r'))
+                hit = mm.find(needle, line_end + 1, end)
+            return lines, (stat.st_ino, end), restarted
+
+
+def parse_change(line: str) -> Optional[Tuple[datetime, str]]:
+    """(timestamp, ip) of a change line written by IPMonitor, or None for any other line"""
+    match = CHANGE_LINE.match(line.rstrip('\r\n'))
+    if not match:
+        return None
+    try:
+        ipaddress.ip_address(match.group(2))
+    except ValueError:
+        return None
+    return datetime.strptime(match.group(1), TIMESTAMP_FORMAT), match.group(2)
+
+
+def change_lines(path: str) -> Iterator[str]:
+    """Change lines of the log, newest first"""
+    return (line for line in reverse_lines(path, CHANGE_MARKER) if parse_change(line))
+
+
+def last_line(path: str, contains: str) -> Optional[str]:
+    """Most recent line containing the given text, or None"""
+    return next(reverse_lines(path, contains), None)
+
+
+def parse_timestamp(line: str) -> Optional[datetime]:
+    """Timestamp at the start of a log line ("YYYY-MM-DD HH:MM:SS - message")"""
+    try:
+        return datetime.strptime(line[:19], TIMESTAMP_FORMAT)
+    except ValueError:
+        return None
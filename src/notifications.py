@@ -1,13 +1,169 @@
 import requests
 import json
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait
 import os
+import threading
+from abc import ABC, abstractmethod
+from .tracing import tracer, Span
+
+# Registry of channel types, keyed by the 'type' used in notifications.json
+CHANNEL_TYPES = {}
+
+
+def register_channel(channel_type):
+    """Class decorator registering a notification channel type"""
+    def decorator(cls):
+        if getattr(cls, '__abstractmethods__', None):
+            missing = ', '.join(sorted(cls.__abstractmethods__))
+            raise TypeError(f"Channel type {channel_type!r} does not implement {missing}")
+        CHANNEL_TYPES[channel_type] = cls
+        cls.channel_type = channel_type
+        return cls
+    return decorator
+
+
+class NotificationChannel(ABC):
+    """Base class for a single notification endpoint"""
+    channel_type = None
+
+    def __init__(self, name, options=None, events=None, enabled=True, timeout=5):
+        self.name = name
+        self.options = options or {}
+        self.events = events or []
+        self.enabled = enabled
+        self.timeout = timeout
+
+    def accepts(self, event):
+        """Check whether this channel wants notifications for the given event"""
+        return self.enabled and event in self.events
+
+    @abstractmethod
+    def send(self, title, message, fields=None):
+        """Deliver a notification, returning True on success"""
+
+    @staticmethod
+    def format_fields(message, fields):
+        """Append name/value detail lines to a plain-text message"""
+        if not fields:
+            return message
+        lines = [f"{name}: {value}" for name, value in fields.items()]
+        return message + "\n" + "\n".join(lines)
+
+
+@register_channel('discord')
+class DiscordChannel(NotificationChannel):
+    def send(self, title, message, fields=None):
+        webhook_url = self.options.get('webhook_url')
+        if not webhook_url:
+            return False
+        embed = {
+            "title": title,
+            "description": message,
+            "color": 3447003  # Discord Blue
+        }
+        if fields:
+            embed["fields"] = [{"name": name, "value": str(value), "inline": True} for name, value in fields.items()]
+        payload = {"embeds": [embed]}
+        response = requests.post(webhook_url, json=payload, timeout=self.timeout)
+        return response.status_code == 204
+
+
+@register_channel('pushover')
+class PushoverChannel(NotificationChannel):
+    def send(self, title, message, fields=None):
+        user_key = self.options.get('user_key')
+        api_token = self.options.get('api_token')
+        if not all([user_key, api_token]):
+            return False
+        payload = {
+            "token": api_token,
+            "user": user_key,
+            "title": title,
+            "message": self.format_fields(message, fields),
+            "priority": 0
+        }
+        response = requests.post(
+            "https://api.pushover.net/1/messages.json",
+            data=payload,
+            timeout=self.timeout
+        )
+        return response.status_code == 200
+
+
+@register_channel('slack')
+class SlackChannel(NotificationChannel):
+    """Slack-compatible incoming webhook (also Mattermost, Rocket.Chat)"""
+    def send(self, title, message, fields=None):
+        webhook_url = self.options.get('webhook_url')
+        if not webhook_url:
+            return False
+        text = self.format_fields(message, fields).replace('**', '*')
+        payload = {"text": f"*{title}*\n{text}"}
+        response = requests.post(webhook_url, json=payload, timeout=self.timeout)
+        return 200 <= response.status_code < 300
+
+
+@register_channel('webhook')
+class JsonWebhookChannel(NotificationChannel):
+    """Generic JSON POST to an arbitrary URL"""
+    def send(self, title, message, fields=None):
+        url = self.options.get('url')
+        if not url:
+            return False
+        payload = {"title": title, "message": message, "fields": fields or {}}
+        response = requests.post(
+            url,
+            json=payload,
+            headers=self.options.get('headers') or {},
+            timeout=self.timeout
+        )
+        return 200 <= response.status_code < 300
+
+
+@register_channel('ntfy')
+class NtfyChannel(NotificationChannel):
+    """ntfy-style topic publishing (plain text body, title in header)"""
+    def send(self, title, message, fields=None):
+        server = self.options.get('server', 'https://ntfy.sh').rstrip('/')
+        topic = self.options.get('topic')
+        if not topic:
+            return False
+        headers = {"Title": title.encode('utf-8')}
+        if self.options.get('token'):
+            headers["Authorization"] = f"Bearer {self.options['token']}"
+        response = requests.post(
+            f"{server}/{topic}",
+            data=self.format_fields(message, fields).replace('**', '').encode('utf-8'),
+            headers=headers,
+            timeout=self.timeout
+        )
+        return 200 <= response.status_code < 300
+
+
+def create_channel(spec):
+    """Build a channel instance from its config dict"""
+    cls = CHANNEL_TYPES.get(spec.get('type'))
+    if cls is None:
+        raise ValueError(f"Unknown notification channel type: {spec.get('type')}")
+    return cls(
+        name=spec.get('name') or spec['type'],
+        options=spec.get('options', {}),
+        events=spec.get('events', ['ip_change']),
+        enabled=spec.get('enabled', True),
+        timeout=spec.get('timeout', 5)
+    )
+
 
 class NotificationManager:
     def __init__(self, config_dir="data"):
         self.config_dir = Path(config_dir)
         self.config_file = self.config_dir / 'notifications.json'
         self.config = self._load_config()
+        self._executor = None
+        self._executor_size = None
+        # Dispatches come from the scheduler and from request threads; the pool is created and swapped under this
+        self._executor_lock = threading.Lock()
 
     def _load_config(self):
         """Load notification settings from config file"""
@@ -15,7 +171,10 @@ class NotificationManager:
             return {
                 'debug': False,
                 'discord': {'enabled': False, 'webhook_url': '', 'events': []},
-                'pushover': {'enabled': False, 'user_key': '', 'api_token': '', 'events': []}
+                'pushover': {'enabled': False, 'user_key': '', 'api_token': '', 'events': []},
+                'channels': [],
+                'max_concurrency': 8,
+                'deadline': 10
             }
         
         config = {}
@@ -25,6 +184,9 @@ class NotificationManager:
         # Add debug setting if it doesn't exist
         if 'debug' not in config:
             config['debug'] = False
+        config.setdefault('channels', [])
+        config.setdefault('max_concurrency', 8)
+        config.setdefault('deadline', 10)
             
         return config
 
@@ -68,35 +230,169 @@ class NotificationManager:
         }
         self._save_config()
 
-    def send_ip_change_notification(self, new_ip):
+    def send_ip_change_notification(self, new_ip, geo=None, blocklists=None):
         """Send notification when IP address changes"""
         title = "🌐 IP Address Changed"
         message = f"Your public IP address has changed to: **{new_ip}**"
+        fields = self._geo_fields(geo)
+        if blocklists:
+            title = "⚠️ IP Address Changed (blocklisted)"
+            fields = dict(fields or {}, Blocklisted=', '.join(blocklists))
         self._debug_log(f"Sending IP change notification for IP: {new_ip}")
-        self.send_notification('ip_change', title, message)
+        self.send_notification('ip_change', title, message, fields=fields)
 
-    def send_notification(self, event, title, message):
-        """Send notification to all enabled services for the given event"""
-        self._debug_log(f"send_notification called with event={event}")
-        self._debug_log(f"Discord enabled: {self.config['discord']['enabled']}")
-        self._debug_log(f"Discord events: {self.config['discord']['events']}")
-        
-        sent_count = 0
-        
-        if self.config['discord']['enabled'] and event in self.config['discord']['events']:
-            self._debug_log("Sending Discord notification...")
-            if self._send_discord(title, message):
-                sent_count += 1
-        else:
-            self._debug_log(f"Discord notification skipped - enabled: {self.config['discord']['enabled']}, event in events: {event in self.config['discord']['events']}")
-        
-        if self.config['pushover']['enabled'] and event in self.config['pushover']['events']:
-            self._debug_log("Sending Pushover notification...")
-            if self._send_pushover(title, message):
-                sent_count += 1
+    @staticmethod
+    def _geo_fields(geo):
+        """Turn GeoIP enrichment into notification detail fields"""
+        if not geo:
+            return None
+        location = ', '.join(part for part in (geo.get('city'), geo.get('country')) if part)
+        fields = {}
+        if location:
+            fields['Location'] = location
+        if geo.get('asn'):
+            fields['ASN'] = geo['asn']
+        if geo.get('isp'):
+            fields['ISP'] = geo['isp']
+        return fields or None
+
+    def send_site_change_notification(self, site, new_ip, wait=True):
+        """Send notification when a remote agent reports an IP change; wait=False returns once queued"""
+        title = f"🌐 IP Address Changed at {site}"
+        message = f"The public IP address of site **{site}** has changed to: **{new_ip}**"
+        self._debug_log(f"Sending site IP change notification for {site}: {new_ip}")
+        if wait:
+            self.send_notification('ip_change', title, message)
         else:
-            self._debug_log(f"Pushover notification skipped - enabled: {self.config['pushover']['enabled']}, event in events: {event in self.config['pushover']['events']}")
-        
+            self.dispatch_nowait('ip_change', title, message)
+
+    def get_channels(self):
+        """Build channel instances for the legacy Discord/Pushover blocks and all configured channels"""
+        channels = []
+        discord = self.config.get('discord', {})
+        if discord.get('enabled'):
+            channels.append(DiscordChannel(
+                'discord',
+                options={'webhook_url': discord.get('webhook_url', '')},
+                events=discord.get('events', [])
+            ))
+        pushover = self.config.get('pushover', {})
+        if pushover.get('enabled'):
+            channels.append(PushoverChannel(
+                'pushover',
+                options={'user_key': pushover.get('user_key', ''), 'api_token': pushover.get('api_token', '')},
+                events=pushover.get('events', [])
+            ))
+        for spec in self.config.get('channels', []):
+            try:
+                channels.append(create_channel(spec))
+            except Exception as e:
+                self._debug_log(f"Skipping invalid channel {spec.get('name')}: {e}")
+        return channels
+
+    def add_channel(self, spec):
+        """Add or replace a channel instance in the configuration"""
+        channel = create_channel(spec)  # Validate before saving
+        channels = [c for c in self.config['channels'] if c.get('name') != channel.name]
+        channels.append({
+            'name': channel.name,
+            'type': channel.channel_type,
+            'enabled': channel.enabled,
+            'events': channel.events,
+            'options': channel.options,
+            'timeout': channel.timeout
+        })
+        self.config['channels'] = channels
+        self._save_config()
+        return channel
+
+    def remove_channel(self, name):
+        """Remove a channel instance by name"""
+        before = len(self.config['channels'])
+        self.config['channels'] = [c for c in self.config['channels'] if c.get('name') != name]
+        if len(self.config['channels']) != before:
+            self._save_config()
+            return True
+        return False
+
+    def _submit(self, calls):
+        """Submit each (fn, *args) to the fan-out pool and return the futures
+
+        Getting the pool and submitting happen under one lock, so a concurrent
+        resize can neither leak a second pool nor shut this one down first.
+        """
+        with self._executor_lock:
+            executor = self._get_executor()
+            return [executor.submit(*call) for call in calls]
+
+    def _get_executor(self):
+        """Lazily create the fan-out thread pool, replacing it when max_concurrency changes
+
+        Callers hold _executor_lock.
+        """
+        size = max(1, int(self.config.get('max_concurrency', 8)))
+        if self._executor is None or size != self._executor_size:
+            previous = self._executor
+            self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='notify')
+            self._executor_size = size
+            if previous is not None:
+                # Deliveries already queued on the old pool still finish
+                previous.shutdown(wait=False)
+        return self._executor
+
+    def _deliver(self, channel, title, message, parent=None, fields=None):
+        """Send through one channel, swallowing errors"""
+        span = Span(f'notify.{channel.name}', {'type': channel.channel_type})
+        try:
+            success = channel.send(title, message, fields)
+            self._debug_log(f"Channel {channel.name} ({channel.channel_type}) {'succeeded' if success else 'failed'}")
+            span.attrs['success'] = success
+            return success
+        except Exception as e:
+            self._debug_log(f"Channel {channel.name} error: {e}")
+            print(f"Failed to send {channel.name} notification: {e}")
+            span.error = str(e)
+            return False
+        finally:
+            span.finish()
+            # Attached only when complete; sends finishing after the deadline are left out of the trace
+            if parent is not None:
+                parent.add_child(span)
+
+    def dispatch(self, event, title, message, fields=None):
+        """Fan out to every matching channel concurrently and return per-channel results"""
+        channels = [c for c in self.get_channels() if c.accepts(event)]
+        self._debug_log(f"Dispatching {event} to {len(channels)} channel(s): {[c.name for c in channels]}")
+        if not channels:
+            return {}
+
+        with tracer.span('notifications.dispatch', event=event, channels=len(channels)) as parent:
+            submitted = self._submit([(self._deliver, c, title, message, parent, fields) for c in channels])
+            futures = {future: c.name for future, c in zip(submitted, channels)}
+            done, pending = wait(futures, timeout=float(self.config.get('deadline', 10)))
+
+            results = {}
+            for future in done:
+                results[futures[future]] = future.result()
+            for future in pending:
+                # Queued sends are dropped; in-flight ones finish in the background
+                future.cancel()
+                results[futures[future]] = False
+                self._debug_log(f"Channel {futures[future]} missed the {self.config.get('deadline', 10)}s deadline")
+            parent.attrs['sent'] = sum(1 for ok in results.values() if ok)
+        return results
+
+    def dispatch_nowait(self, event, title, message, fields=None):
+        """Queue a delivery per matching channel on the fan-out pool without waiting for any"""
+        channels = [c for c in self.get_channels() if c.accepts(event)]
+        self._submit([(self._deliver, c, title, message, None, fields) for c in channels])
+        return len(channels)
+
+    def send_notification(self, event, title, message, fields=None):
+        """Send notification to all enabled channels for the given event"""
+        self._debug_log(f"send_notification called with event={event}")
+        results = self.dispatch(event, title, message, fields)
+        sent_count = sum(1 for ok in results.values() if ok)
         self._debug_log(f"Notification sent to {sent_count} service(s)")
         return sent_count > 0
 
@@ -106,62 +402,22 @@ class NotificationManager:
         if not webhook_url:
             self._debug_log("No Discord webhook URL configured")
             return False
-
-        payload = {
-            "embeds": [{
-                "title": title,
-                "description": message,
-                "color": 3447003  # Discord Blue
-            }]
-        }
-
-        try:
-            self._debug_log(f"Sending to Discord webhook: {webhook_url[:50]}...")
-            response = requests.post(webhook_url, json=payload)
-            if response.status_code == 204:
-                self._debug_log("Discord notification sent successfully")
-                return True
-            else:
-                self._debug_log(f"Discord notification failed: {response.status_code} - {response.text}")
-                return False
-        except Exception as e:
-            self._debug_log(f"Discord notification error: {e}")
-            print(f"Failed to send Discord notification: {e}")
-            return False
+        channel = DiscordChannel('discord', options={'webhook_url': webhook_url})
+        return self._deliver(channel, title, message)
 
     def _send_pushover(self, title, message):
         """Send notification to Pushover"""
         if not all([self.config['pushover']['user_key'], self.config['pushover']['api_token']]):
             self._debug_log("No Pushover credentials configured")
             return False
-
-        payload = {
-            "token": self.config['pushover']['api_token'],
-            "user": self.config['pushover']['user_key'],
-            "title": title,
-            "message": message,
-            "priority": 0
-        }
-
-        try:
-            self._debug_log(f"Sending to Pushover with user key: {self.config['pushover']['user_key'][:10]}...")
-            response = requests.post(
-                "https://api.pushover.net/1/messages.json",
-                data=payload
-            )
-            if response.status_code == 200:
-                self._debug_log("Pushover notification sent successfully")
-                return True
-            else:
-                self._debug_log(f"Pushover notification failed: {response.status_code} - {response.text}")
-                return False
-        except Exception as e:
-            self._debug_log(f"Pushover notification error: {e}")
-            print(f"Failed to send Pushover notification: {e}")
-            return False
+        channel = PushoverChannel('pushover', options={
+            'user_key': self.config['pushover']['user_key'],
+            'api_token': self.config['pushover']['api_token']
+        })
+        return self._deliver(channel, title, message)
 
     def test_notification(self, service):
-        """Test notification for a specific service"""
+        """Test notification for a specific service or named channel"""
         self._debug_log(f"Testing {service} notification")
         title = "🧪 Test Notification"
         message = f"This is a test notification from IP Sentinel for {service.title()}."
@@ -171,6 +427,10 @@ class NotificationManager:
         elif service == 'pushover':
             return self._send_pushover(title, message)
         
+        for spec in self.config.get('channels', []):
+            if spec.get('name') == service:
+                return self._deliver(create_channel(spec), title, message)
+        
         return False
 
     def test_discord_webhook(self, webhook_url):
@@ -186,7 +446,7 @@ class NotificationManager:
         }
 
         try:
-            response = requests.post(webhook_url, json=payload)
+            response = requests.post(webhook_url, json=payload, timeout=10)
             success = response.status_code == 204
             self._debug_log(f"Discord webhook test {'successful' if success else 'failed'}: {response.status_code}")
             return success
@@ -209,7 +469,8 @@ class NotificationManager:
         try:
             response = requests.post(
                 "https://api.pushover.net/1/messages.json",
-                data=payload
+                data=payload,
+                timeout=10
             )
             success = response.status_code == 200
             self._debug_log(f"Pushover test {'successful' if success else 'failed'}: {response.status_code}")
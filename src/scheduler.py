@@ -4,30 +4,71 @@ import time
 import json
 import logging
 from datetime import datetime
-from threading import Thread
+from threading import Thread, Event, RLock
+from .tracing import tracer, profiler
+
+OVERRUN_POLICIES = ('skip', 'coalesce', 'queue')
+# Further deadlines an abandoned check may hold up new ones before it is given up on as hung
+ABANDON_GRACE_DEADLINES = 2
+
 
 class Scheduler:
-    def __init__(self, monitor, notifications=None):
+    def __init__(self, monitor, notifications=None, uploader=None, ddns=None, hooks=None):
         self.monitor = monitor
         self.notifications = notifications
+        self.uploader = uploader
+        self.ddns = ddns
+        self.hooks = hooks
         self.config_file = os.path.join('data', 'schedule_config.json')
         self.schedule = self._load_schedule()
+        config = self._load_config()
+        # What to do when a slot fires while the previous check is still running
+        self.overrun_policy = config.get('overrun_policy', 'coalesce')
+        if self.overrun_policy not in OVERRUN_POLICIES:
+            logging.warning(f"Unknown overrun policy {self.overrun_policy!r} in {self.config_file}; using 'coalesce'")
+            self.overrun_policy = 'coalesce'
+        # Seconds a check may run before it is cancelled and abandoned
+        self.run_deadline = float(config.get('run_deadline', 60))
+        self.max_queue = int(config.get('max_queue', 10))
         self.running = False
         self._thread = None
+        self._watchdog = None
+        self._generation = 0
+        self._heartbeat = time.monotonic()
+        self._started_at = None
         self._next_run_time = None
+        self._wake = Event()
+        self._stopped = Event()
+        self._check_requested = False
+        self._current = None  # The check in flight: thread, cancel event, deadline
+        self._abandoned = []  # Checks past their deadline whose threads have not exited yet
+        self._pending = 0  # Overrun fires waiting to run
+        self._waiters = []  # check_now() callers waiting for the next check to start and finish
+        # Held while the loop reaps and fires, so a loop thread replaced by the watchdog cannot act
+        self._lock = RLock()
+        self.stats = {'runs': 0, 'failures': 0, 'timeouts': 0, 'overruns': 0, 'skipped': 0,
+                      'restarts': 0, 'hung': 0, 'consecutive_failures': 0}
+        self.last_run = None
+        self.last_success = None
+        self.last_error = None
+        # Check again as soon as the network comes back instead of waiting for the next slot
+        connectivity = getattr(monitor, 'connectivity', None)
+        if connectivity is not None:
+            connectivity.on_recover = self.request_check
     
-    def _load_schedule(self):
-        """Load schedule from config file"""
+    def _load_config(self):
         try:
             if os.path.exists(self.config_file):
                 with open(self.config_file, 'r') as f:
-                    config = json.load(f)
-                    return config.get('schedule', '*/5 * * * *')  # Default: every 5 minutes
+                    return json.load(f)
         except Exception as e:
             print(f"Error loading schedule config: {e}")
-        
-        # Default schedule if no config exists
-        return '*/5 * * * *'
+        return {}
+
+    def _load_schedule(self):
+        """Load schedule from config file"""
+        # Default: every 5 minutes
+        return self._load_config().get('schedule', '*/5 * * * *')
     
     def _save_schedule(self):
         """Save schedule to config file"""
@@ -35,6 +76,9 @@ class Scheduler:
             os.makedirs(os.path.dirname(self.config_file), exist_ok=True)
             config = {
                 'schedule': self.schedule,
+                'overrun_policy': self.overrun_policy,
+                'run_deadline': self.run_deadline,
+                'max_queue': self.max_queue,
                 'last_updated': datetime.now().isoformat()
             }
             with open(self.config_file, 'w') as f:
@@ -44,7 +88,7 @@ class Scheduler:
             print(f"Error saving schedule config: {e}")
     
     def start(self):
-        """Start the scheduler in a background thread"""
+        """Start the scheduler and its watchdog in background threads"""
         if self._thread is not None:
             return
         
@@ -56,50 +100,282 @@ class Scheduler:
             self._next_run_time = None
         
         self.running = True
-        self._thread = Thread(target=self._run, daemon=True)
-        self._thread.start()
+        self._started_at = self._started_at or time.time()
+        self._stopped.clear()
+        self._spawn()
+        self._watchdog = Thread(target=self._watch, daemon=True)
+        self._watchdog.start()
     
     def stop(self):
         """Stop the scheduler"""
         self.running = False
+        self._stopped.set()
+        self._wake.set()
         if self._thread:
-            self._thread.join()
+            self._thread.join(timeout=15)
             self._thread = None
+        if self._watchdog:
+            self._watchdog.join(timeout=15)
+            self._watchdog = None
+
+    def _spawn(self):
+        """Start a fresh loop thread; any older one exits when it next wakes"""
+        with self._lock:
+            self._generation += 1
+            self._heartbeat = time.monotonic()
+            self._thread = Thread(target=self._run, args=(self._generation,), daemon=True)
+            self._thread.start()
+
+    def _watch(self, interval=15, stall_after=60):
+        """Restart the loop thread if it dies or stops making progress"""
+        while not self._stopped.wait(interval):
+            thread = self._thread
+            stalled = time.monotonic() - self._heartbeat > stall_after
+            if thread is None or not thread.is_alive() or stalled:
+                logging.error(f"Scheduler {'stalled' if stalled else 'thread died'}; restarting it")
+                self.stats['restarts'] += 1
+                self._spawn()
     
-    def _run(self):
-        """Main scheduler loop"""
+    def _run(self, generation):
+        """Main scheduler loop: fires slots on time and never runs a check inline"""
+        cron = croniter(self.schedule, datetime.now())
+        next_run = cron.get_next()
+        self._next_run_time = datetime.fromtimestamp(next_run)
         while self.running:
-            try:
-                cron = croniter(self.schedule)
-                next_run = cron.get_next()
-                self._next_run_time = datetime.fromtimestamp(next_run)
-                
-                while self.running:
-                    now = time.time()
-                    if now >= next_run:
-                        # Check for IP changes
-                        result = self.monitor.check_ip_change()
-                        logging.info(f"SCHEDULER DEBUG: IP check result: {result}")
-                        
-                        # Send notification if IP changed
-                        if result.get('status') == 'changed' and self.notifications:
-                            ip = result.get('ip', 'Unknown')
-                            logging.info(f"SCHEDULER DEBUG: Sending notification for IP change to {ip}")
-                            self.notifications.send_ip_change_notification(ip)
-                            logging.info(f"SCHEDULER DEBUG: Notification sent")
-                        elif result.get('status') == 'changed' and not self.notifications:
-                            logging.error(f"SCHEDULER DEBUG: IP changed but no notifications object available")
+            with self._lock:
+                if generation != self._generation:
+                    return
+                self._heartbeat = time.monotonic()
+                try:
+                    self._reap()
+                    if self._check_requested:
+                        # A requested check always runs, after the current one if need be
+                        self._check_requested = False
+                        if self._busy():
+                            self._pending = max(self._pending, 1)
                         else:
-                            logging.debug(f"SCHEDULER DEBUG: No IP change detected, status: {result.get('status')}")
-                        
-                        # Get the next run time after executing
-                        cron = croniter(self.schedule)
+                            self._start_run()
+                    # Every slot that has passed counts, so overruns are seen by the policy
+                    while time.time() >= next_run:
+                        self._fire()
                         next_run = cron.get_next()
                         self._next_run_time = datetime.fromtimestamp(next_run)
-                    time.sleep(10)  # Check every 10 seconds for better responsiveness
-            except Exception as e:
-                print(f"Scheduler error: {e}")
-                time.sleep(60)  # Wait a minute before retrying
+                except Exception as e:
+                    logging.error(f"Scheduler error: {e}")
+                    self.last_error = str(e)
+                deadlines = [run['release'] for run in self._blocking()]
+                if self._current is not None:
+                    deadlines.append(self._current['deadline'])
+            
+            # Sleep until the next slot, the running check's deadline or an abandoned one's release,
+            # but wake at least every 10s
+            wait = next_run - time.time()
+            if deadlines:
+                wait = min(wait, min(deadlines) - time.monotonic())
+            self._wake.wait(max(0.05, min(10, wait)))
+            self._wake.clear()
+
+    def _blocking(self):
+        """Abandoned checks still inside their grace period"""
+        return [run for run in self._abandoned if not run['hung']]
+
+    def _busy(self):
+        """A check is running, or an abandoned one has not exited yet and may still save state"""
+        return self._current is not None or bool(self._blocking())
+
+    def _fire(self):
+        """A slot is due: start a check, or apply the overrun policy if one is still running"""
+        if not self._busy():
+            self._start_run()
+            return
+        self.stats['overruns'] += 1
+        if self.overrun_policy == 'queue':
+            if self._pending < self.max_queue:
+                self._pending += 1
+            else:
+                self.stats['skipped'] += 1
+        elif self.overrun_policy == 'coalesce':
+            if self._pending:
+                self.stats['skipped'] += 1
+            self._pending = 1
+        else:
+            self.stats['skipped'] += 1
+            logging.warning("Skipping scheduled check: previous check still running")
+
+    def _start_run(self):
+        run = {
+            'started': time.time(),
+            'deadline': time.monotonic() + self.run_deadline,
+            'cancel': Event(),
+            'done': Event(),
+            'result': None,
+            'error': None,
+            'hung': False,
+            'waiters': self._waiters
+        }
+        self._waiters = []
+        run['thread'] = Thread(target=self._execute, args=(run,), daemon=True)
+        self._current = run
+        run['thread'].start()
+
+    def _execute(self, run):
+        try:
+            run['result'] = profiler.run(self._run_check, run['cancel'])
+        except Exception as e:
+            run['error'] = str(e)
+        finally:
+            run['done'].set()
+            self._wake.set()
+
+    def _reap(self):
+        """Collect the finished check, or cancel it once past its deadline, then start queued fires
+
+        An abandoned check keeps the scheduler busy until its thread exits, so
+        two checks never overlap; fires in the meantime go through the overrun
+        policy as if it were still running. One that has not exited after
+        ABANDON_GRACE_DEADLINES more deadlines is taken to be hung and no
+        longer holds up new checks; it is counted in health() until it exits.
+        """
+        self._abandoned = [run for run in self._abandoned if not run['done'].is_set()]
+        for run in self._blocking():
+            if time.monotonic() >= run['release']:
+                run['hung'] = True
+                self.stats['hung'] += 1
+                logging.error("Abandoned check has not exited; no longer waiting for it before the next check")
+        run = self._current
+        if run is not None:
+            if run['done'].is_set():
+                self._finish(run, 'error' if run['error'] else (run['result'] or {}).get('status'), run['error'])
+            elif time.monotonic() >= run['deadline']:
+                # Threads cannot be killed: signal cancellation and stop waiting for it
+                run['cancel'].set()
+                self.stats['timeouts'] += 1
+                logging.error(f"Scheduled check exceeded its {self.run_deadline:.0f}s deadline; abandoned")
+                self._finish(run, 'timeout', f"Exceeded {self.run_deadline:.0f}s deadline")
+                run['release'] = time.monotonic() + ABANDON_GRACE_DEADLINES * self.run_deadline
+                self._abandoned.append(run)
+        if not self._busy() and self._pending:
+            self._pending -= 1
+            self._start_run()
+
+    def _finish(self, run, status, error=None):
+        self._current = None
+        self.stats['runs'] += 1
+        failed = status in ('error', 'timeout', 'cancelled', None)
+        self.last_run = {
+            'started': datetime.fromtimestamp(run['started']).isoformat(timespec='seconds'),
+            'duration_s': round(time.time() - run['started'], 2),
+            'status': status,
+            'error': error
+        }
+        if failed:
+            self.stats['failures'] += 1
+            self.stats['consecutive_failures'] += 1
+            self.last_error = error or self.last_error
+        else:
+            self.stats['consecutive_failures'] = 0
+            self.last_success = run['started']
+        result = run['result'] if run['done'].is_set() and run['result'] else {'status': status, 'message': error}
+        for waiter in run['waiters']:
+            waiter['result'] = result
+            waiter['done'].set()
+
+    def health(self):
+        """Liveness of the loop thread and outcome of recent checks"""
+        heartbeat_age = time.monotonic() - self._heartbeat
+        alive = bool(self.running and self._thread is not None and self._thread.is_alive() and heartbeat_age < 60)
+        current = self._current
+        # A check should complete at least once every two intervals plus the run deadline
+        try:
+            cron = croniter(self.schedule)
+            interval = cron.get_next() - cron.get_prev()
+        except Exception:
+            interval = 300
+        last_completed = self.last_success or self._started_at or time.time()
+        if not alive:
+            status = 'error'
+        elif time.time() - last_completed > 2 * interval + self.run_deadline:
+            status = 'stalled'
+        elif self.stats['consecutive_failures']:
+            status = 'degraded'
+        else:
+            status = 'ok'
+        return {
+            'status': status,
+            'alive': alive,
+            'heartbeat_age_s': round(heartbeat_age, 1),
+            'running_check_s': round(time.time() - current['started'], 1) if current else None,
+            'pending': self._pending,
+            'abandoned': len(self._abandoned),
+            'abandoned_hung': len(self._abandoned) - len(self._blocking()),
+            'last_run': self.last_run,
+            'last_success': datetime.fromtimestamp(self.last_success).isoformat(timespec='seconds')
+                            if self.last_success else None,
+            'last_error': self.last_error,
+            'overrun_policy': self.overrun_policy,
+            'run_deadline': self.run_deadline,
+            **self.stats
+        }
+    
+    def _run_check(self, cancel=None):
+        """Run one scheduled IP check and send notifications on change"""
+        with tracer.span('scheduler.run', schedule=self.schedule):
+            # Check for IP changes
+            result = self.monitor.check_ip_change(cancel=cancel)
+            logging.info(f"SCHEDULER DEBUG: IP check result: {result}")
+            if result.get('status') == 'cancelled':
+                return result
+            
+            # Queue the result for the central aggregator when running as an agent
+            if self.uploader:
+                self.uploader.record(result)
+            
+            # Send notification if IP changed
+            if result.get('status') == 'changed' and self.notifications:
+                ip = result.get('ip', 'Unknown')
+                logging.info(f"SCHEDULER DEBUG: Sending notification for IP change to {ip}")
+                self.notifications.send_ip_change_notification(ip, result.get('geo'), result.get('blocklists'))
+                logging.info(f"SCHEDULER DEBUG: Notification sent")
+            elif result.get('status') == 'changed' and not self.notifications:
+                logging.error(f"SCHEDULER DEBUG: IP changed but no notifications object available")
+            else:
+                logging.debug(f"SCHEDULER DEBUG: No IP change detected, status: {result.get('status')}")
+            
+            # Point DNS records at the new IP; records skipped once the check is cancelled stay pending
+            if result.get('status') == 'changed' and self.ddns:
+                self.ddns.update_all(result['ip'], cancel=cancel)
+            elif result.get('ip') and result.get('status') != 'offline' and self.ddns:
+                # Records that failed to update are retried on every check until they succeed
+                self.ddns.retry_pending(result['ip'], cancel=cancel)
+            
+            # Hooks run on their own pool so a slow one cannot hold up the next check
+            if result.get('status') == 'changed' and self.hooks:
+                self.hooks.run('ip_change', result['ip'], result.get('previous_ip'))
+            return result
+    
+    def request_check(self):
+        """Run a check on the scheduler thread right away"""
+        self._check_requested = True
+        self._wake.set()
+
+    def check_now(self, timeout=None):
+        """Run a check through the scheduler, so it never overlaps a scheduled one, and return its result
+
+        Returns None if the check has not finished within timeout (default:
+        twice the run deadline); it still runs later.
+        """
+        if not self.running:
+            return self._run_check()
+        waiter = {'done': Event(), 'result': None}
+        with self._lock:
+            self._waiters.append(waiter)
+        self.request_check()
+        if waiter['done'].wait(timeout if timeout is not None else 2 * self.run_deadline):
+            return waiter['result']
+        with self._lock:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        return None
     
     @property
     def next_run(self):
@@ -119,8 +395,22 @@ class Scheduler:
         return {
             'schedule': self.schedule,
             'next_run': self.next_run.isoformat() if self.next_run else None,
-            'running': self.running
+            'running': self.running,
+            'overrun_policy': self.overrun_policy,
+            'run_deadline': self.run_deadline
         }
+
+    def update_run_policy(self, overrun_policy=None, run_deadline=None):
+        """Change the overrun policy and per-check deadline"""
+        if overrun_policy is not None:
+            if overrun_policy not in OVERRUN_POLICIES:
+                raise ValueError(f"Overrun policy must be one of {', '.join(OVERRUN_POLICIES)}")
+            self.overrun_policy = overrun_policy
+        if run_deadline is not None:
+            if float(run_deadline) <= 0:
+                raise ValueError("Run deadline must be positive")
+            self.run_deadline = float(run_deadline)
+        self._save_schedule()
     
     def update_cron_schedule(self, cron_expression):
         """Update schedule with custom CRON expression"""
@@ -0,0 +1,367 @@
+"""Virtual-time simulation of the scheduling and notification pipeline
+
+Replays a recorded or synthetic IP timeline through the real Scheduler,
+IPMonitor and NotificationManager under a virtual clock, using in-process
+fake providers and channels. A month of one-minute checks takes seconds, and
+the report shows the checks, provider calls and notifications each schedule
+policy would produce, plus how quickly it notices changes.
+
+    python -m src.simulate simulation/baseline.json
+    python -m src.simulate simulation/baseline.json --history data/ip_log.db --output report.json
+"""
+import argparse
+import bisect
+import heapq
+import json
+import logging
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from urllib.parse import urlparse
+
+from croniter import croniter
+
+from . import database
+from .gateway import GatewayDiscovery
+from .ip_monitor import IPMonitor
+from .notifications import NotificationChannel, NotificationManager, register_channel
+from .scheduler import Scheduler
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class VirtualClock:
+    """Simulated wall clock advanced by the event loop"""
+    def __init__(self, start):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def datetime(self):
+        return datetime.fromtimestamp(self.now)
+
+
+class Timeline:
+    """Which IP is current, and whether the network is up, at any virtual time"""
+    def __init__(self, changes, outages):
+        self.changes = sorted(changes)  # [(ts, ip)]
+        self.outages = sorted(outages)  # [(start, end)]
+        self._times = [ts for ts, _ in self.changes]
+
+    def ip_at(self, ts):
+        i = bisect.bisect_right(self._times, ts) - 1
+        return self.changes[max(i, 0)][1]
+
+    def change_for(self, ip, ts):
+        """Time of the latest switch to `ip` at or before ts"""
+        i = bisect.bisect_right(self._times, ts) - 1
+        while i >= 0:
+            if self.changes[i][1] == ip:
+                return self.changes[i][0]
+            i -= 1
+        return None
+
+    def outage_at(self, ts):
+        for start, end in self.outages:
+            if start <= ts < end:
+                return start, end
+            if start > ts:
+                break
+        return None
+
+    @classmethod
+    def from_events(cls, events):
+        """Build from [{"at": "...", "ip": "..."} | {"at": "...", "offline_for": seconds}]"""
+        changes, outages = [], []
+        for event in events:
+            ts = _parse_time(event['at'])
+            if 'ip' in event:
+                changes.append((ts, event['ip']))
+            if event.get('offline_for'):
+                outages.append((ts, ts + float(event['offline_for'])))
+        return cls(changes, outages)
+
+    @classmethod
+    def synthetic(cls, start, end, spec):
+        """Random changes and outages as Poisson processes"""
+        rng = random.Random(spec.get('seed', 1))
+        changes = [(start, _random_ip(rng))]
+        rate = float(spec.get('changes_per_day', 1)) / 86400
+        ts = start
+        while rate:
+            ts += rng.expovariate(rate)
+            if ts >= end:
+                break
+            changes.append((ts, _random_ip(rng)))
+
+        outages = []
+        rate = float(spec.get('outages_per_day', 0)) / 86400
+        mean = float(spec.get('outage_minutes', 10)) * 60
+        ts = start
+        while rate:
+            ts += rng.expovariate(rate)
+            if ts >= end:
+                break
+            length = rng.expovariate(1 / mean)
+            outages.append((ts, ts + length))
+            ts += length
+        return cls(changes, outages)
+
+    @classmethod
+    def from_history(cls, db_file):
+        """Recorded changes from the ip_log table"""
+        conn = database.get_db_connection(db_file)
+        try:
+            database.create_table(conn)
+            rows = database.get_ip_history(conn)
+        finally:
+            database.close_connection(conn)
+        return cls([(_parse_time(row['date']), row['ip_address']) for row in rows], [])
+
+
+def _random_ip(rng):
+    return f"203.0.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+
+
+def _parse_time(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(value).timestamp()
+
+
+# Deliveries run on the notification pool's threads, so shared counters are bumped under a lock
+_stats_lock = threading.Lock()
+
+
+def _count(stats, key, breakdown=None, name=None):
+    """Add one to stats[key], and to stats[breakdown][name] when given"""
+    with _stats_lock:
+        stats[key] += 1
+        if breakdown is not None:
+            stats[breakdown][name] = stats[breakdown].get(name, 0) + 1
+
+
+class FakeResponse:
+    def __init__(self, status_code, ip):
+        self.status_code = status_code
+        self.text = ip or ''
+        self.elapsed = timedelta(milliseconds=1)
+
+    def json(self):
+        return {'ip': self.text}
+
+
+class FakeProviders:
+    """requests-style client answering every provider URL from the timeline"""
+    def __init__(self, clock, timeline, stats, failure_rate=0.0, seed=1):
+        self.clock = clock
+        self.timeline = timeline
+        self.stats = stats
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+
+    def get(self, url, timeout=None):
+        host = urlparse(url).hostname
+        _count(self.stats, 'provider_calls', 'calls_by_provider', host)
+        if self.timeline.outage_at(self.clock.now) or self.rng.random() < self.failure_rate:
+            _count(self.stats, 'provider_failures')
+            raise ConnectionError(f"Simulated failure for {host}")
+        return FakeResponse(200, self.timeline.ip_at(self.clock.now))
+
+
+class FakeConnectivity:
+    """Pre-flight answered from the timeline's outages"""
+    def __init__(self, clock, timeline):
+        self.clock = clock
+        self.timeline = timeline
+        self.outage_started = None
+        self.on_recover = None
+
+    def check(self, confirm=None):
+        # Simulated outages are real ones, so there is nothing for confirm() to contradict
+        outage = self.timeline.outage_at(self.clock.now)
+        if outage:
+            self.outage_started = datetime.fromtimestamp(outage[0])
+            return False, 'Simulated outage'
+        self.outage_started = None
+        return True, None
+
+
+@register_channel('simulated')
+class SimulatedChannel(NotificationChannel):
+    """Counts deliveries instead of sending them"""
+    def send(self, title, message, fields=None):
+        stats = self.options['stats']
+        rng = self.options['rng']
+        if rng.random() < self.options.get('failure_rate', 0):
+            _count(stats, 'notification_failures')
+            return False
+        _count(stats, 'notifications', 'notifications_by_channel', self.name)
+        return True
+
+
+def run_policy(policy, scenario, timeline, start, end):
+    """Simulate one schedule policy over [start, end) and return its statistics"""
+    with tempfile.TemporaryDirectory(prefix='ipsentinel-sim-') as workdir:
+        return _run_policy(policy, scenario, timeline, start, end, Path(workdir))
+
+
+def _run_policy(policy, scenario, timeline, start, end, workdir):
+    stats = {
+        'checks': 0, 'scheduled_checks': 0, 'reconnect_checks': 0, 'offline_checks': 0, 'failed_checks': 0,
+        'provider_calls': 0, 'provider_failures': 0, 'calls_by_provider': {},
+        'changes': 0, 'changes_detected': 0, 'changes_missed': 0,
+        'notifications': 0, 'notification_failures': 0, 'notifications_by_channel': {}
+    }
+    clock = VirtualClock(start)
+    providers = scenario.get('providers', {})
+    data_dir = workdir / 'data'
+    data_dir.mkdir()
+    # Start from the IP in effect at the beginning so the first check is not counted as a change
+    with open(data_dir / 'last_ip.json', 'w') as f:
+        json.dump({'ip': timeline.ip_at(start), 'last_updated': clock.datetime().isoformat()}, f)
+
+    monitor = IPMonitor(
+        log_file=str(workdir / 'ip_changes.log'), data_dir=str(data_dir),
+        connectivity=FakeConnectivity(clock, timeline),
+        gateway=GatewayDiscovery(str(data_dir), enabled=False),
+        http=FakeProviders(clock, timeline, stats, providers.get('failure_rate', 0), scenario.get('seed', 1))
+    )
+    notifications = NotificationManager(config_dir=str(data_dir))
+    rng = random.Random(scenario.get('seed', 1))
+    notifications.config['channels'] = [
+        {'name': spec.get('name', f"channel{i}"), 'type': 'simulated', 'events': spec.get('events', ['ip_change']),
+         'options': {'failure_rate': spec.get('failure_rate', 0), 'stats': stats, 'rng': rng}}
+        for i, spec in enumerate(scenario.get('channels', [{'name': 'default'}]))
+    ]
+    scheduler = Scheduler(monitor, notifications)
+    scheduler.schedule = policy['schedule']
+
+    # Event queue of (time, kind); cron slots come from croniter anchored to the virtual start
+    cron = croniter(policy['schedule'], datetime.fromtimestamp(start))
+    events = [(cron.get_next(float), 'scheduled')]
+    probe_interval = float(scenario.get('probe_interval', 2))
+    seen_ips = {timeline.ip_at(start)}
+    delays = []
+    was_offline = False
+
+    while events:
+        ts, kind = heapq.heappop(events)
+        if ts >= end:
+            break
+        clock.now = ts
+        if kind == 'scheduled':
+            heapq.heappush(events, (cron.get_next(float), 'scheduled'))
+
+        result = scheduler._run_check()
+        stats['checks'] += 1
+        stats[f'{kind}_checks'] += 1
+        status = result.get('status')
+        if status == 'offline':
+            stats['offline_checks'] += 1
+            if not was_offline:
+                # The reconnect probe triggers a check shortly after the outage ends
+                _, outage_end = timeline.outage_at(ts)
+                heapq.heappush(events, (outage_end + probe_interval, 'reconnect'))
+            was_offline = True
+            continue
+        was_offline = False
+        if status == 'error':
+            stats['failed_checks'] += 1
+        elif status == 'changed':
+            stats['changes_detected'] += 1
+            seen_ips.add(result['ip'])
+            changed_at = timeline.change_for(result['ip'], ts)
+            if changed_at is not None:
+                delays.append(ts - changed_at)
+
+    actual = [(ts, ip) for ts, ip in timeline.changes if start < ts < end]
+    stats['changes'] = len(actual)
+    stats['changes_missed'] = sum(1 for _, ip in actual if ip not in seen_ips)
+    delays.sort()
+    stats['detection_delay_s'] = {
+        'avg': round(sum(delays) / len(delays), 1) if delays else None,
+        'p95': round(delays[min(len(delays) - 1, int(len(delays) * 0.95))], 1) if delays else None,
+        'max': round(delays[-1], 1) if delays else None
+    }
+    return stats
+
+
+def print_report(report):
+    print(f"Simulated {report['start']} to {report['end']} "
+          f"({report['changes']} IP changes, {report['outages']} outages)")
+    print(f"{'policy':<20}{'checks':>9}{'provider':>10}{'notify':>8}{'detected':>10}{'missed':>8}"
+          f"{'avg delay':>11}{'max delay':>11}{'wall':>8}")
+    for name, stats in report['policies'].items():
+        delay = stats['detection_delay_s']
+        print(f"{name:<20}{stats['checks']:>9}{stats['provider_calls']:>10}{stats['notifications']:>8}"
+              f"{stats['changes_detected']:>10}{stats['changes_missed']:>8}"
+              f"{_fmt(delay['avg']):>11}{_fmt(delay['max']):>11}{stats['wall_time_s']:>7}s")
+    for note in report.get('notes', []):
+        print(f"Note: {note}")
+
+
+def _fmt(seconds):
+    return '-' if seconds is None else f"{seconds:.0f}s"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate IP Sentinel schedules under a virtual clock")
+    parser.add_argument('scenario', help="Scenario JSON file (see simulation/baseline.json)")
+    parser.add_argument('--history', help="Replay recorded changes from this ip_log.db instead of the scenario timeline")
+    parser.add_argument('--days', type=float, help="Override the simulated duration in days")
+    parser.add_argument('--output', help="Write the JSON report to this file")
+    parser.add_argument('--verbose', action='store_true', help="Show pipeline log output")
+    args = parser.parse_args(argv)
+
+    # Configure logging before IPMonitor does, so its file handler is not installed
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+
+    with open(args.scenario) as f:
+        scenario = json.load(f)
+    days = args.days or float(scenario.get('days', 30))
+
+    if args.history:
+        timeline = Timeline.from_history(args.history)
+        if not timeline.changes:
+            print("No recorded changes to replay", file=sys.stderr)
+            return 1
+        start = timeline.changes[0][0]
+        end = timeline.changes[-1][0] + 86400 if not args.days else start + days * 86400
+    else:
+        start = _parse_time(scenario.get('start', '2024-01-01 00:00:00'))
+        end = start + days * 86400
+        if 'timeline' in scenario:
+            timeline = Timeline.from_events(scenario['timeline'])
+        else:
+            timeline = Timeline.synthetic(start, end, scenario.get('synthetic', {}))
+
+    report = {
+        'start': datetime.fromtimestamp(start).strftime(TIME_FORMAT),
+        'end': datetime.fromtimestamp(end).strftime(TIME_FORMAT),
+        'changes': sum(1 for ts, _ in timeline.changes if start < ts < end),
+        'outages': sum(1 for s, _ in timeline.outages if start <= s < end),
+        # Checks are run directly and take no virtual time, so slots never overlap
+        'notes': ["Checks take no virtual time: the run deadline and overrun policy are not exercised"],
+        'policies': {}
+    }
+    for policy in scenario.get('policies', [{'name': 'default', 'schedule': '*/5 * * * *'}]):
+        started = time.perf_counter()
+        stats = run_policy(policy, scenario, timeline, start, end)
+        stats['wall_time_s'] = round(time.perf_counter() - started, 1)
+        report['policies'][policy.get('name', policy['schedule'])] = stats
+
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
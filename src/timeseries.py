@@ -0,0 +1,316 @@
+import atexit
+import bisect
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+
+from . import database
+
+# Rollup resolutions in seconds, finest first
+RESOLUTIONS = (300, 3600, 86400)
+RESOLUTION_NAMES = {60: 'raw', 300: '5m', 3600: '1h', 86400: '1d'}
+# Upper bounds (ms) of the latency histogram buckets; one extra open-ended bucket follows
+LATENCY_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# Days of data kept per resolution (0 = raw rows, None = forever)
+DEFAULT_RETENTION = {0: 30, 300: 180, 3600: 730, 86400: None}
+
+
+def estimate_percentile(hist, pct):
+    """Estimate a latency percentile by interpolating within histogram buckets"""
+    total = sum(hist)
+    if not total:
+        return None
+    target = pct / 100.0 * total
+    seen = 0
+    for i, count in enumerate(hist):
+        if count and seen + count >= target:
+            lower = LATENCY_BUCKETS[i - 1] if i > 0 else 0
+            upper = LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else LATENCY_BUCKETS[-1] * 2
+            return round(lower + (upper - lower) * (target - seen) / count, 1)
+        seen += count
+    return None
+
+
+class _Aggregate:
+    """Mergeable summary of the checks falling in one time bucket"""
+    __slots__ = ('checks', 'successes', 'changes', 'latency_sum', 'latency_count', 'latency_max', 'hist')
+
+    def __init__(self, row=None):
+        if row:
+            (self.checks, self.successes, self.changes, self.latency_sum,
+             self.latency_count, self.latency_max, hist) = row
+            self.hist = [int(x) for x in hist.split(',')]
+        else:
+            self.checks = self.successes = self.changes = self.latency_count = 0
+            self.latency_sum = 0.0
+            self.latency_max = None
+            self.hist = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, status, latency_ms, success):
+        self.checks += 1
+        self.successes += success
+        if status == 'changed':
+            self.changes += 1
+        if latency_ms is not None:
+            self.latency_sum += latency_ms
+            self.latency_count += 1
+            self.latency_max = latency_ms if self.latency_max is None else max(self.latency_max, latency_ms)
+            self.hist[bisect.bisect_left(LATENCY_BUCKETS, latency_ms)] += 1
+
+    def merge(self, other):
+        self.checks += other.checks
+        self.successes += other.successes
+        self.changes += other.changes
+        self.latency_sum += other.latency_sum
+        self.latency_count += other.latency_count
+        if other.latency_max is not None:
+            self.latency_max = other.latency_max if self.latency_max is None else max(self.latency_max, other.latency_max)
+        self.hist = [a + b for a, b in zip(self.hist, other.hist)]
+
+    def to_row(self, resolution, bucket):
+        return (resolution, bucket, self.checks, self.successes, self.changes, self.latency_sum,
+                self.latency_count, self.latency_max, ','.join(map(str, self.hist)))
+
+    def to_point(self, bucket):
+        return {
+            't': bucket,
+            'checks': self.checks,
+            'success_rate': round(self.successes / self.checks, 4) if self.checks else None,
+            'changes': self.changes,
+            'latency_avg': round(self.latency_sum / self.latency_count, 1) if self.latency_count else None,
+            'latency_p50': estimate_percentile(self.hist, 50),
+            'latency_p95': estimate_percentile(self.hist, 95),
+            'latency_p99': estimate_percentile(self.hist, 99),
+            'latency_max': self.latency_max
+        }
+
+
+def _aggregate(rows, resolution):
+    """Group (ts, status, provider, latency_ms, success, ip) rows into buckets"""
+    buckets = {}
+    for ts, status, _, latency_ms, success, _ in rows:
+        bucket = ts - ts % resolution
+        agg = buckets.get(bucket)
+        if agg is None:
+            agg = buckets[bucket] = _Aggregate()
+        agg.add(status, latency_ms, success)
+    return buckets
+
+
+def merge_rollups(conn, rows):
+    """Fold new raw rows into every rollup resolution (inside the caller's transaction)"""
+    for resolution in RESOLUTIONS:
+        fresh = _aggregate(rows, resolution)
+        if not fresh:
+            continue
+        existing = {
+            row[0]: _Aggregate(row[1:])
+            for row in database.get_rollups(conn, resolution, min(fresh), max(fresh) + 1)
+        }
+        updates = []
+        for bucket, agg in fresh.items():
+            if bucket in existing:
+                existing[bucket].merge(agg)
+                agg = existing[bucket]
+            updates.append(agg.to_row(resolution, bucket))
+        database.save_rollups(conn, updates)
+
+
+class CheckRecorder:
+    """Buffers check results in memory and writes them to check_results in batched transactions
+
+    A batch is flushed once `batch_size` rows are buffered or the oldest row is
+    `flush_interval` seconds old, so at most that much data is lost on a crash.
+    """
+    def __init__(self, db_file=database.DEFAULT_DB_FILE, batch_size=100, flush_interval=60, retention=None):
+        self.db_file = db_file
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention = {**DEFAULT_RETENTION, **(retention or {})}
+        self._last_prune = 0
+        self._buffer = []
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+
+        conn = database.get_db_connection(db_file)
+        if conn is not None:
+            # WAL keeps dashboard reads from blocking on batch writes
+            conn.execute('PRAGMA journal_mode=WAL')
+            database.create_check_results_table(conn)
+            database.create_rollups_table(conn)
+            self._backfill_rollups(conn)
+            database.close_connection(conn)
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def record(self, status, provider=None, latency_ms=None):
+        """Buffer one check result"""
+        row = (
+            int(time.time()),
+            status.get('status', 'error'),
+            urlparse(provider).hostname if provider else None,
+            round(latency_ms, 1) if latency_ms is not None else None,
+            0 if status.get('status') in ('error', 'offline') else 1,
+            status.get('ip')
+        )
+        with self._lock:
+            self._buffer.append(row)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def pending(self):
+        """Rows not yet written, newest first"""
+        with self._lock:
+            return list(reversed(self._buffer))
+
+    def flush(self):
+        """Write all buffered rows in a single transaction"""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._buffer = self._buffer, []
+                self._oldest = None
+            if not rows:
+                return 0
+
+            conn = database.get_db_connection(self.db_file)
+            try:
+                conn.execute('PRAGMA synchronous=NORMAL')
+                with conn:
+                    database.log_check_results(conn, rows)
+                    merge_rollups(conn, rows)
+            except Exception as e:
+                logging.error(f"Error writing {len(rows)} check results: {e}")
+                with self._lock:
+                    # Keep the rows for the next attempt
+                    self._buffer = rows + self._buffer
+                    self._oldest = self._oldest or time.monotonic()
+                return 0
+            finally:
+                database.close_connection(conn)
+            return len(rows)
+
+    def _due(self):
+        with self._lock:
+            if len(self._buffer) >= self.batch_size:
+                return True
+            return self._oldest is not None and time.monotonic() - self._oldest >= self.flush_interval
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(timeout=min(5, self.flush_interval))
+            self._wake.clear()
+            if self._due():
+                self.flush()
+            if time.time() - self._last_prune >= 3600:
+                self.apply_retention()
+
+    def _backfill_rollups(self, conn):
+        """Build rollups for raw rows recorded before rollups existed"""
+        if conn.execute("SELECT 1 FROM check_rollups LIMIT 1").fetchone():
+            return
+        cursor = conn.execute("SELECT ts, status, provider, latency_ms, success, ip FROM check_results ORDER BY ts")
+        while True:
+            rows = cursor.fetchmany(10000)
+            if not rows:
+                break
+            with conn:
+                merge_rollups(conn, rows)
+
+    def apply_retention(self, now=None):
+        """Prune raw rows and rollups older than their configured retention"""
+        now = now or time.time()
+        self._last_prune = now
+        conn = database.get_db_connection(self.db_file)
+        try:
+            removed = 0
+            for resolution, days in self.retention.items():
+                if not days:
+                    continue
+                cutoff = int(now - days * 86400)
+                if resolution == 0:
+                    removed += database.delete_check_results_before(conn, cutoff)
+                else:
+                    removed += database.delete_rollups_before(conn, resolution, cutoff - cutoff % resolution)
+            if removed:
+                logging.info(f"Pruned {removed} expired check result rows")
+            return removed
+        except Exception as e:
+            logging.error(f"Error applying check result retention: {e}")
+            return 0
+        finally:
+            database.close_connection(conn)
+
+    def _pick_resolution(self, start, end, max_points, now):
+        """Finest resolution that fits max_points over the range and still has data for its start"""
+        for resolution in (60,) + RESOLUTIONS:
+            if (end - start) / resolution > max_points:
+                continue
+            days = self.retention.get(0 if resolution == 60 else resolution)
+            if days and start < now - days * 86400:
+                continue
+            return resolution
+        return RESOLUTIONS[-1]
+
+    def series(self, start, end=None, max_points=500):
+        """Chart points between start and end, read from the coarsest table that keeps it under max_points"""
+        now = time.time()
+        end = int(end or now)
+        start = int(start)
+        resolution = self._pick_resolution(start, end, max_points, now)
+
+        conn = database.get_db_connection(self.db_file)
+        try:
+            if resolution == 60:
+                rows = database.get_check_results(conn, since=start, until=end)
+                rows += [r for r in self.pending() if start <= r[0] < end]
+                buckets = _aggregate(rows, 60)
+            else:
+                aligned = start - start % resolution
+                buckets = {
+                    row[0]: _Aggregate(row[1:])
+                    for row in database.get_rollups(conn, resolution, aligned, end)
+                }
+                # Fold in rows that are still waiting to be flushed
+                for bucket, agg in _aggregate([r for r in self.pending() if start <= r[0] < end], resolution).items():
+                    if bucket in buckets:
+                        buckets[bucket].merge(agg)
+                    else:
+                        buckets[bucket] = agg
+        finally:
+            database.close_connection(conn)
+
+        return {
+            'resolution': RESOLUTION_NAMES[resolution],
+            'resolution_seconds': resolution,
+            'start': start,
+            'end': end,
+            'points': [buckets[bucket].to_point(bucket) for bucket in sorted(buckets)]
+        }
+
+    def recent(self, since=None, limit=100):
+        """Return recorded results, including ones still buffered, newest first"""
+        rows = [r for r in self.pending() if since is None or r[0] >= since]
+        conn = database.get_db_connection(self.db_file)
+        try:
+            rows += database.get_check_results(conn, since=since, limit=limit)
+        finally:
+            database.close_connection(conn)
+        keys = ('ts', 'status', 'provider', 'latency_ms', 'success', 'ip')
+        return [dict(zip(keys, row)) for row in rows[:limit]]
+
+    def close(self):
+        """Flush remaining rows and stop the background flusher"""
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self.flush()
@@ -0,0 +1,180 @@
+import cProfile
+import io
+import pstats
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+
+class Span:
+    """A timed section of work, possibly containing child spans"""
+    def __init__(self, name, attrs=None):
+        self.name = name
+        self.attrs = attrs or {}
+        self.children = []
+        self.started_at = datetime.now()
+        self._start = time.perf_counter()
+        self.duration_ms = None
+        self.error = None
+        self._lock = threading.Lock()
+
+    def finish(self):
+        with self._lock:
+            self.duration_ms = round((time.perf_counter() - self._start) * 1000, 3)
+
+    def add_child(self, child):
+        """Attach a finished span from another thread; dropped once this span has finished
+
+        A finished span may already be stored as (part of) a trace, so late
+        children would change a trace after it was recorded.
+        """
+        with self._lock:
+            if self.duration_ms is not None:
+                return False
+            self.children.append(child)
+            return True
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'started_at': self.started_at.isoformat(),
+            'duration_ms': self.duration_ms,
+            'attrs': self.attrs,
+            'error': self.error,
+            'children': [child.to_dict() for child in list(self.children)]
+        }
+
+
+class Tracer:
+    """Collects nested span timings per thread and keeps finished traces in a ring buffer"""
+    def __init__(self, capacity=200):
+        self.traces = deque(maxlen=capacity)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """Time a block; spans opened inside it become its children"""
+        stack = self._stack()
+        current = Span(name, attrs)
+        if stack:
+            stack[-1].children.append(current)
+        stack.append(current)
+        try:
+            yield current
+        except Exception as e:
+            current.error = str(e)
+            raise
+        finally:
+            current.finish()
+            stack.pop()
+            if not stack:
+                with self._lock:
+                    self.traces.append(current)
+
+    def traced(self, name=None):
+        """Decorator form of span()"""
+        def decorator(func):
+            span_name = name or func.__qualname__
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def recent(self, limit=50, name=None):
+        """Return the most recent finished traces, newest first"""
+        with self._lock:
+            traces = list(self.traces)
+        if name:
+            traces = [t for t in traces if t.name == name]
+        return [t.to_dict() for t in reversed(traces[-limit:])]
+
+    def clear(self):
+        with self._lock:
+            self.traces.clear()
+
+
+class Profiler:
+    """Opt-in cProfile wrapper; stats accumulate across every profiled call"""
+    def __init__(self):
+        self.enabled = False
+        self._stats = None
+        self._runs = 0
+        self._lock = threading.Lock()
+
+    def set_enabled(self, enabled):
+        self.enabled = enabled
+
+    def reset(self):
+        with self._lock:
+            self._stats = None
+            self._runs = 0
+
+    def run(self, func, *args, **kwargs):
+        """Call func, profiling it on the current thread when enabled
+
+        cProfile only sees the calling thread: work func hands to other threads
+        (such as notification deliveries on the fan-out pool) is not included.
+        """
+        if not self.enabled:
+            return func(*args, **kwargs)
+
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            with self._lock:
+                if self._stats is None:
+                    self._stats = pstats.Stats(profile, stream=io.StringIO())
+                else:
+                    self._stats.add(profile)
+                self._runs += 1
+
+    def top(self, limit=20, sort='cumulative'):
+        """Return the top-N hot functions from the accumulated stats"""
+        with self._lock:
+            if self._stats is None:
+                return {'enabled': self.enabled, 'runs': 0, 'functions': []}
+            stats = self._stats
+            runs = self._runs
+
+            rows = [
+                (func, filename, line, nc, tt, ct)
+                for (filename, line, func), (cc, nc, tt, ct, _) in stats.stats.items()
+            ]
+        sort_key = {'calls': 3, 'tottime': 4, 'cumulative': 5}.get(sort, 5)
+        rows.sort(key=lambda r: r[sort_key], reverse=True)
+
+        return {
+            'enabled': self.enabled,
+            'runs': runs,
+            'functions': [
+                {
+                    'function': func,
+                    'file': filename,
+                    'line': line,
+                    'calls': nc,
+                    'tottime_ms': round(tt * 1000, 3),
+                    'cumtime_ms': round(ct * 1000, 3)
+                }
+                for func, filename, line, nc, tt, ct in rows[:limit]
+            ]
+        }
+
+
+# Process-wide instances shared by the monitor, scheduler and notifications
+tracer = Tracer()
+profiler = Profiler()
@@ -1,24 +1,74 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, jsonify, request, Response, stream_with_context
 from ..ip_monitor import IPMonitor
 from ..scheduler import Scheduler as IPScheduler
-from ..notifications import NotificationManager
+from ..notifications import NotificationManager, CHANNEL_TYPES
+from ..tracing import tracer, profiler
+from ..aggregator import AggregatorStore, AgentUploader, IngestRejected, MAX_BODY_BYTES
+from ..ddns import DDNSUpdater
+from ..timeseries import CheckRecorder
+from ..hooks import HookRunner
+from ..leases import LeaseIndex
+from ..dashboard import Dashboard
+from .. import logreader
+import hmac
+import json
 import os
 from datetime import datetime
 
 def create_app():
     app = Flask(__name__)
     monitor = IPMonitor()
+    monitor.recorder = CheckRecorder(
+        monitor.db_file,
+        batch_size=int(os.getenv('CHECK_FLUSH_BATCH', '100')),
+        flush_interval=int(os.getenv('CHECK_FLUSH_INTERVAL', '60')),
+        retention={
+            0: int(os.getenv('RAW_RETENTION_DAYS', '30')),
+            300: int(os.getenv('ROLLUP_5M_RETENTION_DAYS', '180')),
+            3600: int(os.getenv('ROLLUP_1H_RETENTION_DAYS', '730'))
+        }
+    )
     notifications = NotificationManager()
-    scheduler = IPScheduler(monitor, notifications)  # Pass notifications to scheduler
+    uploader = AgentUploader.from_env()
+    ddns = DDNSUpdater()
+    hooks = HookRunner()
+    scheduler = IPScheduler(monitor, notifications, uploader, ddns, hooks)  # Pass notifications to scheduler
+    dashboard = Dashboard(monitor, scheduler)
+    
+    # Aggregator role: accept batched reports from remote agents
+    aggregator_mode = os.getenv('ENABLE_AGGREGATOR', 'false').lower() == 'true'
+    aggregator_token = os.getenv('AGGREGATOR_TOKEN')
+    # Running hooks on demand executes configured commands, so it is off unless a token is set
+    hooks_token = os.getenv('HOOKS_TOKEN')
+    store = AggregatorStore(os.path.join('data', 'aggregator.db')) if aggregator_mode else None
+    if store:
+        store.prune_keys()
     
     # Start IP monitoring
     scheduler.start()
+    # The dashboard renders from the last check, so take one now rather than at the first slot
+    scheduler.request_check()
+    if uploader:
+        uploader.start()
+
+    def _authorized(token):
+        """Whether the request carries `Bearer <token>`, compared in constant time"""
+        return hmac.compare_digest(request.headers.get('Authorization', '').encode(), f"Bearer {token}".encode())
 
     # Register routes
     @app.route('/')
     def index():
-        status = monitor.check_ip_change()
-        return render_template('index.html', ip_status=status)
+        # Rendered from cached state; the scheduler keeps it fresh, so no provider call here
+        snapshot = dashboard.snapshot()
+        return render_template('index.html', ip_status=snapshot['status'], dashboard=snapshot)
+
+    @app.route('/api/dashboard')
+    def api_dashboard():
+        return jsonify({'status': 'success', 'data': dashboard.snapshot()})
+
+    @app.route('/history')
+    def history_page():
+        return render_template('history.html', ip_history=monitor.get_history(limit=500))
 
     @app.route('/notifications')
     def notifications_page():
@@ -65,6 +115,28 @@ def create_app():
         )
         return jsonify({'status': 'success'})
 
+    @app.route('/api/notifications/channels', methods=['GET'])
+    def get_channels():
+        return jsonify({
+            'status': 'success',
+            'types': sorted(CHANNEL_TYPES),
+            'channels': notifications.get_config().get('channels', [])
+        })
+
+    @app.route('/api/notifications/channels', methods=['POST'])
+    def add_channel():
+        try:
+            channel = notifications.add_channel(request.json or {})
+            return jsonify({'status': 'success', 'name': channel.name})
+        except (KeyError, ValueError) as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    @app.route('/api/notifications/channels/<name>', methods=['DELETE'])
+    def remove_channel(name):
+        if notifications.remove_channel(name):
+            return jsonify({'status': 'success'})
+        return jsonify({'status': 'error', 'message': f'No channel named {name}'}), 404
+
     @app.route('/api/notifications/test', methods=['POST'])
     def test_notification():
         data = request.json
@@ -83,6 +155,8 @@ def create_app():
                 success = notifications.test_pushover_credentials(user_key, api_token)
             else:
                 success = notifications.test_notification(service)
+        elif service:
+            success = notifications.test_notification(service)
         else:
             success = False
             
@@ -100,18 +174,23 @@ def create_app():
     def health_check():
         """Health check endpoint for Docker and monitoring"""
         try:
-            # Basic health checks
+            liveness = scheduler.health()
+            scheduler_status = liveness['status']
+            # Failing checks (providers down) still leave the service up; a dead or stuck loop does not
+            healthy = scheduler_status in ('ok', 'degraded')
             status = {
-                'status': 'healthy',
+                'status': 'healthy' if healthy else 'unhealthy',
                 'timestamp': datetime.now().isoformat(),
                 'version': '1.0.0',
                 'services': {
                     'web': 'ok',
-                    'scheduler': 'ok' if scheduler else 'error',
-                    'monitor': 'ok' if monitor else 'error'
-                }
+                    'scheduler': scheduler_status,
+                    'monitor': 'ok' if monitor else 'error',
+                    'network': 'offline' if monitor.connectivity.outage_started else 'ok'
+                },
+                'scheduler': liveness
             }
-            return jsonify(status), 200
+            return jsonify(status), 200 if healthy else 503
         except Exception as e:
             return jsonify({
                 'status': 'unhealthy',
@@ -135,6 +214,35 @@ def create_app():
             'debug': enabled
         })
 
+    @app.route('/api/debug/traces', methods=['GET'])
+    def get_traces():
+        limit = request.args.get('limit', 50, type=int)
+        name = request.args.get('name')
+        return jsonify({
+            'status': 'success',
+            'traces': tracer.recent(limit=limit, name=name)
+        })
+
+    @app.route('/api/debug/profile', methods=['GET'])
+    def get_profile():
+        limit = request.args.get('limit', 20, type=int)
+        sort = request.args.get('sort', 'cumulative')
+        return jsonify({
+            'status': 'success',
+            'data': profiler.top(limit=limit, sort=sort)
+        })
+
+    @app.route('/api/debug/profile', methods=['POST'])
+    def set_profile():
+        data = request.json or {}
+        if data.get('reset'):
+            profiler.reset()
+        profiler.set_enabled(data.get('enabled', False))
+        return jsonify({
+            'status': 'success',
+            'enabled': profiler.enabled
+        })
+
     @app.route('/api/schedule', methods=['GET'])
     def get_schedule():
         try:
@@ -150,6 +258,10 @@ def create_app():
     def update_schedule():
         data = request.json
         try:
+            if 'overrun_policy' in data or 'run_deadline' in data:
+                scheduler.update_run_policy(data.get('overrun_policy'), data.get('run_deadline'))
+                if 'cron' not in data and 'interval' not in data:
+                    return jsonify({'status': 'success', 'message': 'Run policy updated successfully'})
             if 'cron' in data:
                 # Custom CRON expression
                 scheduler.update_cron_schedule(data['cron'])
@@ -163,18 +275,19 @@ def create_app():
 
     @app.route('/api/status')
     def api_status():
-        return jsonify(monitor.check_ip_change())
+        # Runs on the scheduler, so it never overlaps a scheduled check
+        result = scheduler.check_now()
+        if result is None:
+            return jsonify({'status': 'error', 'message': 'Check did not finish in time'}), 503
+        return jsonify(result)
 
     @app.route('/api/status', methods=['POST'])
     def force_check():
         try:
-            result = monitor.check_ip_change()
-            
-            # Send notification if IP changed
-            if result.get('status') == 'changed':
-                ip = result.get('ip', 'Unknown')
-                notifications.send_ip_change_notification(ip)
-            
+            # The scheduler also records, notifies, updates DNS and runs hooks for the result
+            result = scheduler.check_now()
+            if result is None:
+                return jsonify({'status': 'error', 'message': 'Check did not finish in time'}), 503
             return jsonify({
                 'status': 'success',
                 'message': 'IP check completed',
@@ -190,7 +303,7 @@ def create_app():
     def api_history():
         try:
             with open(monitor.log_file, 'r') as f:
-                logs = [line.strip() for line in f if "IP changed to" in line]
+                logs = [line.strip() for line in f if logreader.parse_change(line)]
             return jsonify({
                 'status': 'success',
                 'logs': logs,
@@ -202,12 +315,173 @@ def create_app():
                 'message': str(e)
             }), 500
 
+    @app.route('/api/outages')
+    def api_outages():
+        limit = request.args.get('limit', 50, type=int)
+        return jsonify({
+            'status': 'success',
+            'offline': monitor.connectivity.outage_started is not None,
+            'outages': monitor.connectivity.get_outages(limit)
+        })
+
+    @app.route('/api/blocklist')
+    def api_blocklist():
+        if not monitor.blocklist.enabled:
+            return jsonify({'status': 'error', 'message': 'No blocklists found'}), 404
+        ip = request.args.get('ip') or monitor.current_ip
+        return jsonify({
+            'status': 'success',
+            'ip': ip,
+            'listed_on': monitor.blocklist.check(ip) if ip else [],
+            **monitor.blocklist.stats()
+        })
+
+    @app.route('/api/leases')
+    def api_leases():
+        index = LeaseIndex.load(monitor.db_file, monitor.log_file)
+        if request.args.get('at'):
+            return jsonify({'status': 'success', **index.resolve(request.args['at'])})
+        return jsonify({'status': 'success', 'leases': index.leases(), 'count': len(index)})
+
+    @app.route('/api/leases/lookup', methods=['POST'])
+    def api_leases_lookup():
+        """Map many timestamps to the IP held at each one
+
+        Accepts {"timestamps": [...]} or a plain-text body with one timestamp
+        per line; the text form is read and answered as a stream, so inputs of
+        millions of lines never sit in memory. Replies with one JSON object per line.
+        """
+        index = LeaseIndex.load(monitor.db_file, monitor.log_file)
+        if request.is_json:
+            values = (request.get_json(silent=True) or {}).get('timestamps', [])
+        else:
+            values = (line.decode(errors='replace').strip() for line in request.stream if line.strip())
+
+        def generate():
+            for result in index.lookup_many(values):
+                yield json.dumps(result) + '\n'
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    @app.route('/api/ddns', methods=['GET'])
+    def get_ddns():
+        return jsonify({
+            'status': 'success',
+            'enabled': ddns.enabled,
+            'records': ddns.config['records'],
+            'state': ddns.state,
+            'last_results': ddns.last_results
+        })
+
+    @app.route('/api/ddns/sync', methods=['POST'])
+    def sync_ddns():
+        if not ddns.enabled:
+            return jsonify({'status': 'error', 'message': 'DDNS is not configured'}), 400
+        ip = monitor.current_ip or monitor.get_public_ip()
+        if not ip:
+            return jsonify({'status': 'error', 'message': 'Current IP is unknown'}), 503
+        force = bool((request.json or {}).get('force', False)) if request.is_json else False
+        return jsonify({'status': 'success', 'ip': ip, 'results': ddns.update_all(ip, force=force)})
+
+    @app.route('/api/hooks', methods=['GET'])
+    def get_hooks():
+        limit = request.args.get('limit', 50, type=int)
+        return jsonify({
+            'status': 'success',
+            'enabled': hooks.enabled,
+            'hooks': hooks.get_status(),
+            'history': hooks.get_history(limit, request.args.get('hook'))
+        })
+
+    @app.route('/api/hooks/<name>/run', methods=['POST'])
+    def run_hook(name):
+        if not hooks_token:
+            return jsonify({'status': 'error', 'message': 'Set HOOKS_TOKEN to run hooks through the API'}), 403
+        if not _authorized(hooks_token):
+            return jsonify({'status': 'error', 'message': 'Unauthorized'}), 401
+        if name not in hooks.hooks:
+            return jsonify({'status': 'error', 'message': f'No hook named {name}'}), 404
+        data = request.get_json(silent=True) or {}
+        queued = hooks.run(data.get('event', 'test'), data.get('new_ip', monitor.current_ip),
+                           data.get('old_ip'), names=[name])
+        return jsonify({'status': 'success', 'queued': queued}), 202
+
+    @app.route('/api/ingest', methods=['POST'])
+    def ingest():
+        if store is None:
+            return jsonify({'status': 'error', 'message': 'Aggregator mode is not enabled'}), 404
+        if aggregator_token and not _authorized(aggregator_token):
+            return jsonify({'status': 'error', 'message': 'Unauthorized'}), 401
+        if (request.content_length or 0) > MAX_BODY_BYTES:
+            return jsonify({'status': 'error', 'message': 'Batch too large'}), 413
+        try:
+            # Bounded read, so a chunked body without a length cannot be buffered whole either
+            body = request.stream.read(MAX_BODY_BYTES + 1)
+            batch = store.decode_batch(body, request.headers.get('Content-Encoding'))
+            rows, duplicate = store.ingest(batch, request.headers.get('Idempotency-Key'))
+        except IngestRejected as e:
+            response = jsonify({'status': 'error', 'message': str(e)})
+            if e.retry_after:
+                response.headers['Retry-After'] = str(e.retry_after)
+            return response, e.status_code
+
+        # Notify centrally for the newest change in the batch, off the request thread
+        changes = [row for row in rows if row[2] == 'changed']
+        if changes:
+            site, ip = changes[-1][0], changes[-1][3]
+            notifications.send_site_change_notification(site, ip, wait=False)
+
+        return jsonify({'status': 'success', 'accepted': len(rows), 'duplicate': duplicate})
+
+    @app.route('/api/sites')
+    def api_sites():
+        if store is None:
+            return jsonify({'status': 'error', 'message': 'Aggregator mode is not enabled'}), 404
+        sites = store.get_sites()
+        return jsonify({'status': 'success', 'sites': sites, 'count': len(sites)})
+
+    @app.route('/api/sites/<site>/history')
+    def api_site_history(site):
+        if store is None:
+            return jsonify({'status': 'error', 'message': 'Aggregator mode is not enabled'}), 404
+        limit = request.args.get('limit', 100, type=int)
+        changes_only = request.args.get('all', 'false').lower() != 'true'
+        return jsonify({
+            'status': 'success',
+            'site': site,
+            'logs': store.get_site_history(site, limit=limit, changes_only=changes_only)
+        })
+
+    @app.route('/sites')
+    def sites_page():
+        if store is None:
+            return render_template('sites.html', sites=[], enabled=False)
+        return render_template('sites.html', sites=store.get_sites(), enabled=True)
+
+    @app.route('/api/checks')
+    def api_checks():
+        since = request.args.get('since', type=int)
+        limit = min(request.args.get('limit', 100, type=int), 10000)
+        checks = monitor.recorder.recent(since=since, limit=limit)
+        return jsonify({'status': 'success', 'checks': checks, 'count': len(checks)})
+
+    @app.route('/api/checks/series')
+    def api_checks_series():
+        ranges = {'6h': 6 * 3600, '24h': 86400, '7d': 7 * 86400, '30d': 30 * 86400, '1y': 365 * 86400}
+        end = request.args.get('end', type=int) or int(datetime.now().timestamp())
+        start = request.args.get('start', type=int)
+        if start is None:
+            start = end - ranges.get(request.args.get('range', '24h'), 86400)
+        max_points = min(request.args.get('points', 500, type=int), 5000)
+        return jsonify({'status': 'success', 'data': monitor.recorder.series(start, end, max_points)})
+
     @app.route('/api/logs/clear', methods=['POST'])
     def clear_logs():
         try:
             # Clear the log file completely
             with open(monitor.log_file, 'w') as f:
                 f.write("")  # Ensure file is completely empty
+            monitor.clear_history()
             
             # Get the current IP and reset monitor state properly
             current_ip = monitor.get_public_ip()
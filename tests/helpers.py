@@ -0,0 +1,18 @@
+"""Log lines exactly as IPMonitor and the scheduler write them"""
+
+
+def change_log_lines(changes, previous_ip=None):
+    """The change line and the scheduler's result line for each (timestamp string, ip)"""
+    lines = []
+    for when, ip in changes:
+        result = {'status': 'changed', 'message': f'IP changed to: {ip}', 'ip': ip, 'previous_ip': previous_ip}
+        lines.append(f'{when} - IP changed to: {ip}\n')
+        lines.append(f'{when} - SCHEDULER DEBUG: IP check result: {result}\n')
+        lines.append(f'{when} - SCHEDULER DEBUG: Sending notification for IP change to {ip}\n')
+        previous_ip = ip
+    return lines
+
+
+def unchanged_log_line(when, ip):
+    result = {'status': 'unchanged', 'message': 'IP unchanged for 5 minutes', 'ip': ip}
+    return f'{when} - SCHEDULER DEBUG: IP check result: {result}\n'
@@ -0,0 +1,111 @@
+"""Authoritative DNS stub answering queries and TSIG-signed RFC 2136 updates, for the DDNS tests"""
+import base64
+import hmac
+import ipaddress
+import socket
+import struct
+import threading
+import time
+
+from src.ddns import TSIG_ALGORITHMS, _encode_name
+
+
+def _read_name(data, pos):
+    """(name, position after it) for a possibly compressed name"""
+    labels, end = [], None
+    while True:
+        length = data[pos]
+        if length & 0xC0 == 0xC0:
+            end = end or pos + 2
+            pos = struct.unpack('>H', data[pos:pos + 2])[0] & 0x3FFF
+            continue
+        if length == 0:
+            return '.'.join(labels).lower(), end or pos + 1
+        labels.append(data[pos + 1:pos + 1 + length].decode('ascii'))
+        pos += length + 1
+
+
+class StubDNSServer:
+    """Local UDP server answering A/AAAA queries and applying RFC 2136 updates, for testing
+
+    With a TSIG key, updates must be signed with it (and within the fudge
+    window); anything else is refused with NOTAUTH.
+    """
+    def __init__(self, tsig_name=None, tsig_key=None, host='127.0.0.1'):
+        self.tsig_name = tsig_name.lower() if tsig_name else None
+        self.tsig_key = base64.b64decode(tsig_key) if tsig_key else None
+        self.records = {}  # (name, rtype) -> [value, ...]
+        self.requests = {'query': 0, 'update': 0, 'refused': 0}
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, 0))
+        self.address = self.sock.getsockname()
+        self._stop = False
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while not self._stop:
+            try:
+                data, peer = self.sock.recvfrom(65535)
+                reply = self._handle(data)
+            except OSError:
+                return
+            except (IndexError, struct.error, UnicodeDecodeError, ValueError):
+                continue
+            self.sock.sendto(reply, peer)
+
+    def _handle(self, data):
+        msg_id, flags, qdcount, ancount, nscount, arcount = struct.unpack('>HHHHHH', data[:12])
+        opcode = flags >> 11 & 0xF
+        name, pos = _read_name(data, 12)
+        if opcode == 0:
+            self.requests['query'] += 1
+            rtype = struct.unpack('>H', data[pos:pos + 2])[0]
+            question = data[12:pos + 4]
+            answers = b''
+            values = self.records.get((name, rtype), [])
+            for value in values:
+                rdata = ipaddress.ip_address(value).packed
+                answers += b'\xc0\x0c' + struct.pack('>HHIH', rtype, 1, 300, len(rdata)) + rdata
+            return struct.pack('>HHHHHH', msg_id, 0x8180, 1, len(values), 0, 0) + question + answers
+
+        pos += 4
+        updates = []
+        for _ in range(nscount):
+            rname, pos = _read_name(data, pos)
+            rtype, rclass, _, rdlength = struct.unpack('>HHIH', data[pos:pos + 10])
+            pos += 10
+            updates.append((rname, rtype, rclass, data[pos:pos + rdlength]))
+            pos += rdlength
+        if self.tsig_key and not (arcount and self._verify_tsig(data, pos)):
+            self.requests['refused'] += 1
+            return struct.pack('>HHHHHH', msg_id, 0xA800 | 9, 0, 0, 0, 0)
+        self.requests['update'] += 1
+        for rname, rtype, rclass, rdata in updates:
+            if rclass == 255:
+                self.records.pop((rname, rtype), None)
+            elif rclass == 1:
+                self.records.setdefault((rname, rtype), []).append(str(ipaddress.ip_address(rdata)))
+        return struct.pack('>HHHHHH', msg_id, 0xA800, 0, 0, 0, 0)
+
+    def _verify_tsig(self, data, tsig_start):
+        key_name, pos = _read_name(data, tsig_start)
+        rtype, _, _, _ = struct.unpack('>HHIH', data[pos:pos + 10])
+        pos += 10
+        if rtype != 250 or key_name != self.tsig_name:
+            return False
+        algorithm, pos = _read_name(data, pos)
+        time_wire = data[pos:pos + 8]
+        high, low, fudge, mac_size = struct.unpack('>HIHH', data[pos:pos + 10])
+        mac = data[pos + 10:pos + 10 + mac_size]
+        if abs(time.time() - (high << 32 | low)) > fudge or algorithm not in TSIG_ALGORITHMS:
+            return False
+        arcount = struct.unpack('>H', data[10:12])[0] - 1
+        unsigned = data[:10] + struct.pack('>H', arcount) + data[12:tsig_start]
+        variables = (_encode_name(key_name) + struct.pack('>HI', 255, 0) + _encode_name(algorithm)
+                     + time_wire + struct.pack('>HH', 0, 0))
+        expected = hmac.new(self.tsig_key, unsigned + variables, TSIG_ALGORITHMS[algorithm]).digest()
+        return hmac.compare_digest(mac, expected)
+
+    def stop(self):
+        self._stop = True
+        self.sock.close()
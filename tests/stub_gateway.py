@@ -0,0 +1,113 @@
+"""Local NAT-PMP/PCP, SSDP and UPnP IGD responder the gateway tests run against"""
+import ipaddress
+import socket
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubGateway:
+    """Local NAT-PMP/PCP, SSDP and UPnP IGD responder for testing
+
+    With pcp_only, NAT-PMP requests are refused with a PCP UNSUPP_VERSION
+    reply, as a PCP-only router would.
+    """
+    def __init__(self, external_ip='198.51.100.7', host='127.0.0.1', pcp_only=False):
+        self.external_ip = external_ip
+        self.pcp_only = pcp_only
+        self.requests = {'natpmp': 0, 'pcp': 0, 'ssdp': 0, 'soap': 0}
+        self.pcp_lifetimes = []  # Lifetime of every PCP MAP request, 0 being a delete
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = (
+                    '<?xml version="1.0"?><root xmlns="urn:schemas-upnp-org:device-1-0"><device>'
+                    '<deviceType>urn:schemas-upnp-org:device:InternetGatewayDevice:1</deviceType>'
+                    '<deviceList><device><deviceList><device><serviceList><service>'
+                    '<serviceType>urn:schemas-upnp-org:service:WANIPConnection:1</serviceType>'
+                    '<controlURL>/ctl/IPConn</controlURL>'
+                    '</service></serviceList></device></deviceList></device></deviceList>'
+                    '</device></root>'
+                ).encode()
+                self._reply(body)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                stub.requests['soap'] += 1
+                body = (
+                    '<?xml version="1.0"?><s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"><s:Body>'
+                    '<u:GetExternalIPAddressResponse xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1">'
+                    f'<NewExternalIPAddress>{stub.external_ip}</NewExternalIPAddress>'
+                    '</u:GetExternalIPAddressResponse></s:Body></s:Envelope>'
+                ).encode()
+                self._reply(body)
+
+            def _reply(self, body):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/xml')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.http = ThreadingHTTPServer((host, 0), Handler)
+        self.location = f"http://{host}:{self.http.server_port}/rootDesc.xml"
+        self.natpmp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.natpmp.bind((host, 0))
+        self.natpmp_port = self.natpmp.getsockname()[1]
+        self.ssdp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.ssdp.bind((host, 0))
+        self.ssdp_address = (host, self.ssdp.getsockname()[1])
+        self.started = time.time()
+        self._stop = False
+        for target in (self.http.serve_forever, self._serve_natpmp, self._serve_ssdp):
+            threading.Thread(target=target, daemon=True).start()
+
+    def _serve_natpmp(self):
+        while not self._stop:
+            try:
+                data, peer = self.natpmp.recvfrom(1100)
+            except OSError:
+                return
+            epoch = int(time.time() - self.started)
+            if data[:2] == b'\x00\x00':
+                self.requests['natpmp'] += 1
+                if self.pcp_only:
+                    reply = struct.pack('>BBBBII12x', 2, 0x80, 0, 1, 0, epoch)
+                else:
+                    reply = struct.pack('>BBHI4s', 0, 128, 0, epoch, socket.inet_aton(self.external_ip))
+            elif len(data) >= 60 and data[0] == 2 and data[1] == 1:
+                self.requests['pcp'] += 1
+                lifetime = struct.unpack('>I', data[4:8])[0]
+                self.pcp_lifetimes.append(lifetime)
+                reply = struct.pack('>BBBBII12x', 2, 0x81, 0, 0, lifetime, epoch)
+                reply += data[24:42] + struct.pack('>H', 9 if lifetime else 0)
+                reply += ipaddress.IPv6Address(f'::ffff:{self.external_ip}').packed
+            else:
+                continue
+            self.natpmp.sendto(reply, peer)
+
+    def _serve_ssdp(self):
+        while not self._stop:
+            try:
+                data, peer = self.ssdp.recvfrom(2048)
+            except OSError:
+                return
+            if data.startswith(b'M-SEARCH'):
+                self.requests['ssdp'] += 1
+                reply = (
+                    'HTTP/1.1 200 OK\r\nCACHE-CONTROL: max-age=120\r\n'
+                    f'LOCATION: {self.location}\r\n'
+                    'ST: urn:schemas-upnp-org:device:InternetGatewayDevice:1\r\n\r\n'
+                )
+                self.ssdp.sendto(reply.encode(), peer)
+
+    def stop(self):
+        self._stop = True
+        self.http.shutdown()
+        self.natpmp.close()
+        self.ssdp.close()
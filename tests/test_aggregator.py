@@ -0,0 +1,138 @@
+import gzip
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+import requests
+
+from src.aggregator import AggregatorStore, IngestRejected, MAX_BODY_BYTES
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def _batch(site, *reports):
+    return {'site': site, 'reports': [dict(zip(('timestamp', 'status', 'ip'), r)) for r in reports]}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = AggregatorStore(str(tmp_path / 'aggregator.db'))
+    yield store
+    store.close()
+
+
+def test_ingest_stores_reports_and_summarises_site(store):
+    rows, duplicate = store.ingest(_batch('branch-1',
+                                          ('2024-01-01T10:00:00', 'unchanged', '1.1.1.1'),
+                                          ('2024-01-01T11:00:00', 'changed', '2.2.2.2')), 'key-1')
+    assert len(rows) == 2 and not duplicate
+    site, = store.get_sites()
+    assert site['last_ip'] == '2.2.2.2'
+    assert site['last_change'] == '2024-01-01T11:00:00'
+    assert site['change_count'] == 1
+
+
+def test_retried_batch_is_deduplicated_by_key(store):
+    batch = _batch('branch-1', ('2024-01-01T11:00:00', 'changed', '2.2.2.2'))
+    store.ingest(batch, 'key-1')
+    rows, duplicate = store.ingest(batch, 'key-1')
+    assert rows == [] and duplicate
+    assert store.get_sites()[0]['change_count'] == 1
+    assert len(store.get_site_history('branch-1')) == 1
+
+
+def test_late_batch_only_extends_history(store):
+    store.ingest(_batch('branch-1', ('2024-01-02T00:00:00', 'changed', '3.3.3.3')), 'new')
+    store.ingest(_batch('branch-1', ('2024-01-01T00:00:00', 'changed', '2.2.2.2')), 'old')
+    site, = store.get_sites()
+    assert site['last_ip'] == '3.3.3.3'
+    assert site['change_count'] == 2
+
+
+def test_mixed_timestamp_types_are_normalised(store):
+    epoch = datetime(2024, 1, 1, 12, 0).timestamp()
+    rows, _ = store.ingest(_batch('branch-1',
+                                  ('2024-01-01T10:00:00', 'changed', '1.1.1.1'),
+                                  (epoch, 'changed', '2.2.2.2'),
+                                  (int(epoch * 1000) + 3600 * 1000, 'changed', '3.3.3.3'),
+                                  (None, 'unchanged', '3.3.3.3'),
+                                  ('yesterday', 'changed', '9.9.9.9'),
+                                  ([1], 'changed', '9.9.9.9')), 'key-1')
+    assert [r[1] for r in rows[:3]] == ['2024-01-01T10:00:00', '2024-01-01T12:00:00', '2024-01-01T13:00:00']
+    assert len(rows) == 4
+    assert [h['ip'] for h in store.get_site_history('branch-1')] == ['3.3.3.3', '2.2.2.2', '1.1.1.1']
+
+
+def test_decode_batch_rejects_oversized_and_malformed_bodies(store):
+    with pytest.raises(IngestRejected) as e:
+        store.decode_batch(b'x' * (MAX_BODY_BYTES + 1))
+    assert e.value.status_code == 413
+    with pytest.raises(IngestRejected):
+        store.decode_batch(gzip.compress(b'{"reports": []}'), 'gzip')
+    batch = store.decode_batch(gzip.compress(json.dumps(_batch('a')).encode()), 'gzip')
+    assert batch['site'] == 'a'
+
+
+def test_ingest_without_key_is_rejected(store):
+    with pytest.raises(IngestRejected):
+        store.ingest(_batch('a'), None)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def test_agents_buffer_while_unreachable_and_deliver_once(tmp_path):
+    """An aggregator process fed by several agent processes, started after they have buffered"""
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}"
+    agent_script = (
+        "import sys\n"
+        "from src.aggregator import AgentUploader\n"
+        "uploader = AgentUploader(sys.argv[1], site=sys.argv[2], data_dir=sys.argv[3], batch_size=40)\n"
+        "for i in range(100):\n"
+        "    uploader.record({'status': 'changed' if i == 99 else 'unchanged', 'ip': f'10.0.0.{i}'})\n"
+        "assert uploader.flush() == 0\n"  # Aggregator not up yet: reports stay in the spool
+        "uploader._backoff_until = 0\n"
+        "import time\n"
+        "deadline = time.time() + 30\n"
+        "while uploader.flush() == 0 and time.time() < deadline:\n"
+        "    uploader._backoff_until = 0\n"
+        "    time.sleep(0.2)\n"
+        "assert not uploader._read_spool()\n"
+    )
+    env = dict(os.environ, PYTHONPATH=str(REPO_ROOT))
+    agents = [
+        subprocess.Popen([sys.executable, '-c', agent_script, url, f'site-{n}', str(tmp_path / f'agent-{n}')],
+                         cwd=str(REPO_ROOT), env=env)
+        for n in range(3)
+    ]
+    time.sleep(1)
+
+    workdir = tmp_path / 'aggregator'
+    (workdir / 'logs').mkdir(parents=True)
+    server = subprocess.Popen(
+        [sys.executable, str(REPO_ROOT / 'run.py')], cwd=str(workdir),
+        env=dict(env, PORT=str(port), ENABLE_AGGREGATOR='true', GATEWAY_DISCOVERY='false',
+                 PREFLIGHT_ENABLED='false', IP_PROVIDER_URLS='http://127.0.0.1:9/'),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        for agent in agents:
+            assert agent.wait(timeout=60) == 0
+        sites = {s['site']: s for s in requests.get(f"{url}/api/sites", timeout=5).json()['sites']}
+        assert sorted(sites) == ['site-0', 'site-1', 'site-2']
+        for site in sites.values():
+            assert site['last_ip'] == '10.0.0.99'
+            assert site['change_count'] == 1
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
@@ -0,0 +1,64 @@
+import os
+
+from src.blocklist import Blocklist, _flatten, _parse_v4, read_list
+
+
+def _ip(text):
+    return _parse_v4(text)[0]
+
+
+def test_parse_v4_masks_host_bits():
+    assert _parse_v4('192.0.2.77/24') == (_ip('192.0.2.0'), _ip('192.0.2.255'))
+    assert _parse_v4('198.51.100.9') == (_ip('198.51.100.9'), _ip('198.51.100.9'))
+    assert _parse_v4('10.0.0.0/33') is None
+    assert _parse_v4('10.0/8') is None
+
+
+def test_flatten_overlapping_ranges():
+    # List 0 covers 10-29, list 1 covers 20-39, list 0 again covers 25-26 inside its own range
+    boundaries, masks = _flatten([(10, 29, 0), (20, 39, 1), (25, 26, 0)])
+    assert list(zip(boundaries, masks)) == [(10, 0b01), (20, 0b11), (30, 0b10), (40, 0)]
+
+
+def test_flatten_adjacent_ranges_of_one_list_merge():
+    boundaries, masks = _flatten([(0, 9, 2), (10, 19, 2)])
+    assert list(zip(boundaries, masks)) == [(0, 0b100), (20, 0)]
+
+
+def test_read_list_skips_comments_and_junk(tmp_path):
+    path = tmp_path / 'drop.txt'
+    path.write_text('; Spamhaus DROP\n192.0.2.0/24 ; SBL1\nnot-an-ip\n2001:db8::/32 # doc\n\n')
+    assert list(read_list(path)) == [
+        (4, _ip('192.0.2.0'), _ip('192.0.2.255')),
+        (6, 0x20010db8 << 96, (0x20010db8 << 96) | (1 << 96) - 1)
+    ]
+
+
+def test_check_reports_every_matching_list(tmp_path):
+    (tmp_path / 'firehol.netset').write_text('192.0.2.0/24\n2001:db8::/32\n')
+    (tmp_path / 'drop.txt').write_text('192.0.2.128/25\n')
+    blocklist = Blocklist(tmp_path)
+    assert blocklist.check('192.0.2.200') == ['drop', 'firehol']
+    assert blocklist.check('192.0.2.1') == ['firehol']
+    assert blocklist.check('2001:db8::1') == ['firehol']
+    assert blocklist.check('198.51.100.1') == []
+    assert blocklist.check('bogus') == []
+    assert (tmp_path / '.snapshot').exists()
+
+    # A second instance loads the snapshot and answers the same
+    assert Blocklist(tmp_path).check('192.0.2.200') == ['drop', 'firehol']
+
+
+def test_changed_list_is_reloaded_on_check(tmp_path):
+    path = tmp_path / 'drop.txt'
+    path.write_text('192.0.2.0/24\n')
+    blocklist = Blocklist(tmp_path)
+    assert blocklist.check('198.51.100.1') == []
+
+    path.write_text('192.0.2.0/24\n198.51.100.0/24\n')
+    os.utime(path, ns=(0, 1))  # Make sure the fingerprint moves even on coarse clocks
+    assert blocklist.check('198.51.100.1') == ['drop']
+
+    (tmp_path / 'extra.list').write_text('203.0.113.5\n')
+    assert blocklist.check('203.0.113.5') == ['extra']
+    assert blocklist.stats()['lists'] == ['drop', 'extra']
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+
+from src import logreader
+from src.dashboard import Dashboard
+
+from .helpers import change_log_lines, unchanged_log_line
+
+
+class FakeMonitor:
+    def __init__(self, log_file):
+        self.log_file = str(log_file)
+        self.current_ip = '203.0.113.1'
+        self.last_status = None
+        self.last_checked = None
+
+
+class FakeScheduler:
+    def get_schedule(self):
+        return {'schedule': '*/5 * * * *', 'next_run': None, 'running': True}
+
+
+def _at(when):
+    return when.strftime(logreader.TIMESTAMP_FORMAT)
+
+
+def test_lines_after_reads_only_appended_complete_lines(tmp_path):
+    path = tmp_path / 'ip_changes.log'
+    path.write_text('2024-01-01 00:00:00 - IP changed to: 203.0.113.1\nnoise\n')
+    lines, position, restarted = logreader.lines_after(str(path), logreader.CHANGE_MARKER)
+    assert lines == ['2024-01-01 00:00:00 - IP changed to: 203.0.113.1'] and not restarted
+
+    with open(path, 'a') as f:
+        f.write('2024-01-02 00:00:00 - IP changed to: 203.0.113.2\n2024-01-03 00:00:00 - IP chan')
+    lines, position, _ = logreader.lines_after(str(path), logreader.CHANGE_MARKER, position)
+    assert lines == ['2024-01-02 00:00:00 - IP changed to: 203.0.113.2']
+
+    # The partial line is picked up once it is complete
+    with open(path, 'a') as f:
+        f.write('ged to: 203.0.113.3\n')
+    lines, position, _ = logreader.lines_after(str(path), logreader.CHANGE_MARKER, position)
+    assert lines == ['2024-01-03 00:00:00 - IP changed to: 203.0.113.3']
+    assert logreader.lines_after(str(path), logreader.CHANGE_MARKER, position)[0] == []
+
+    path.write_text('2024-02-01 00:00:00 - IP changed to: 203.0.113.9\n')
+    lines, _, restarted = logreader.lines_after(str(path), logreader.CHANGE_MARKER, position)
+    assert restarted and lines == ['2024-02-01 00:00:00 - IP changed to: 203.0.113.9']
+
+
+def test_snapshot_counts_changes_incrementally(tmp_path):
+    log_file = tmp_path / 'ip_changes.log'
+    now = datetime.now()
+    with open(log_file, 'w') as f:
+        f.writelines(change_log_lines([(_at(now - timedelta(days=400)), '203.0.113.1'),
+                                       (_at(now - timedelta(days=1)), '203.0.113.2')]))
+    monitor = FakeMonitor(log_file)
+    dashboard = Dashboard(monitor, FakeScheduler(), recent=2)
+
+    snapshot = dashboard.snapshot()
+    assert snapshot['status']['status'] == 'pending' and snapshot['status']['ip'] == '203.0.113.1'
+    # The scheduler's debug line quoting each change is not a second change
+    assert snapshot['stats']['total_changes'] == 2 and snapshot['stats']['week_changes'] == 1
+    assert snapshot['history'] == [f'{_at(now - timedelta(days=1))} - IP changed to: 203.0.113.2',
+                                   f'{_at(now - timedelta(days=400))} - IP changed to: 203.0.113.1']
+    assert dashboard.snapshot() is snapshot
+
+    # Debug lines between changes are skipped without being re-read on the next rebuild
+    with open(log_file, 'a') as f:
+        for _ in range(100):
+            f.write(unchanged_log_line(_at(now), '203.0.113.2'))
+        f.writelines(change_log_lines([(_at(now), '203.0.113.3')], previous_ip='203.0.113.2'))
+    monitor.last_status, monitor.last_checked = {'status': 'changed', 'ip': '203.0.113.3'}, now
+    snapshot = dashboard.snapshot()
+    assert snapshot['stats']['total_changes'] == 3 and snapshot['stats']['week_changes'] == 2
+    assert [line[-11:] for line in snapshot['history']] == ['203.0.113.3', '203.0.113.2']
+    assert dashboard._position[1] == log_file.stat().st_size
@@ -0,0 +1,150 @@
+import base64
+import json
+import threading
+
+import pytest
+
+from src import ddns
+from src.ddns import DDNSUpdater, RFC2136Provider
+
+from .stub_dns import StubDNSServer
+
+KEY = base64.b64encode(b'0123456789abcdef0123456789abcdef').decode()
+
+
+@pytest.fixture
+def server():
+    server = StubDNSServer(tsig_name='ddns-key', tsig_key=KEY)
+    yield server
+    server.stop()
+
+
+def _provider(server, key=KEY):
+    host, port = server.address
+    return RFC2136Provider('ns', {'server': host, 'port': port, 'zone': 'example.com',
+                                  'tsig_name': 'ddns-key', 'tsig_key': key}, timeout=2)
+
+
+def _updater(tmp_path, server, key=KEY):
+    host, port = server.address
+    (tmp_path / 'ddns.json').write_text(json.dumps({
+        'enabled': True,
+        'providers': [{'name': 'ns', 'type': 'rfc2136', 'timeout': 2,
+                       'options': {'server': host, 'port': port, 'zone': 'example.com',
+                                   'tsig_name': 'ddns-key', 'tsig_key': key}}],
+        'records': [{'provider': 'ns', 'hostname': 'home.example.com'}]
+    }))
+    return DDNSUpdater(str(tmp_path))
+
+
+def test_signed_update_is_applied(server):
+    provider = _provider(server)
+    assert provider.update_record('home.example.com', 'A', '203.0.113.5')
+    assert server.records[('home.example.com', 1)] == ['203.0.113.5']
+    assert provider.get_record('home.example.com', 'A') == '203.0.113.5'
+    # The RRset is replaced, not appended to
+    assert provider.update_record('home.example.com', 'A', '203.0.113.6')
+    assert server.records[('home.example.com', 1)] == ['203.0.113.6']
+
+
+def test_update_with_wrong_key_is_refused(server):
+    provider = _provider(server, key=base64.b64encode(b'wrong key').decode())
+    assert not provider.update_record('home.example.com', 'A', '203.0.113.5')
+    assert server.requests['refused'] == 1
+    assert ('home.example.com', 1) not in server.records
+
+
+def test_updater_skips_current_and_cached_records(tmp_path, server):
+    updater = _updater(tmp_path, server)
+    assert [r['action'] for r in updater.update_all('203.0.113.5')] == ['updated']
+    assert [r['action'] for r in updater.update_all('203.0.113.5')] == ['cached']
+    updates = server.requests['update']
+    updater.state = {}
+    assert [r['action'] for r in updater.update_all('203.0.113.5')] == ['unchanged']
+    assert server.requests['update'] == updates
+
+
+def test_failed_record_is_retried_on_next_check(tmp_path, server):
+    updater = _updater(tmp_path, server, key=base64.b64encode(b'wrong key').decode())
+    assert [r['action'] for r in updater.update_all('203.0.113.5')] == ['failed']
+    assert updater.pending == ['ns:home.example.com:A']
+    assert json.loads((tmp_path / 'ddns_state.json').read_text())['ns:home.example.com:A']['pending'] == '203.0.113.5'
+
+    updater.providers['ns'].options['tsig_key'] = KEY
+    assert [r['action'] for r in updater.retry_pending('203.0.113.5')] == ['updated']
+    assert updater.pending == []
+    assert updater.retry_pending('203.0.113.5') == []
+
+
+def test_cancelled_sync_leaves_records_pending(tmp_path, server):
+    cancel = threading.Event()
+    cancel.set()
+    updater = _updater(tmp_path, server)
+    assert [r['action'] for r in updater.update_all('203.0.113.5', cancel=cancel)] == ['failed']
+    assert server.requests['update'] == 0 and updater.pending == ['ns:home.example.com:A']
+    assert [r['action'] for r in updater.retry_pending('203.0.113.5')] == ['updated']
+
+
+def test_providers_and_rate_limiters_persist_across_syncs(tmp_path, server):
+    updater = _updater(tmp_path, server)
+    provider = updater.providers['ns']
+    updater.update_all('203.0.113.5')
+    updater.update_all('203.0.113.6')
+    assert updater.providers['ns'] is provider
+
+
+class _Response:
+    def __init__(self, payload):
+        self.status_code = 200
+        self._payload = payload
+
+    def json(self):
+        return self._payload
+
+    def raise_for_status(self):
+        pass
+
+
+class _CountingHTTP:
+    def __init__(self, payload):
+        self.calls = []
+        self.payload = payload
+
+    def get(self, url, **kwargs):
+        self.calls.append('GET')
+        return _Response(self.payload)
+
+    def put(self, url, **kwargs):
+        self.calls.append('PUT')
+        return _Response({'success': True})
+
+    def post(self, url, **kwargs):
+        self.calls.append('POST')
+        return _Response({'success': True})
+
+
+@pytest.mark.parametrize('provider_type, options, payload', [
+    ('cloudflare', {'zone_id': 'z'}, {'result': [{'id': 'r1', 'content': '203.0.113.1'}]}),
+    ('digitalocean', {'domain': 'example.com'}, {'domain_records': [{'id': 7, 'data': '203.0.113.1'}]}),
+])
+def test_api_providers_read_each_record_once_per_update(tmp_path, monkeypatch, provider_type, options, payload):
+    http = _CountingHTTP(payload)
+    monkeypatch.setattr(ddns, 'requests', http)
+    (tmp_path / 'ddns.json').write_text(json.dumps({
+        'enabled': True,
+        'providers': [{'name': 'api', 'type': provider_type, 'options': options}],
+        'records': [{'provider': 'api', 'hostname': 'home.example.com'}]
+    }))
+    results = DDNSUpdater(str(tmp_path)).update_all('203.0.113.5')
+    assert [r['action'] for r in results] == ['updated']
+    assert http.calls == ['GET', 'PUT']
+
+
+def test_incomplete_provider_type_is_rejected():
+    class ReadOnly(ddns.DNSProvider):
+        def get_record(self, hostname, record_type):
+            return None
+
+    with pytest.raises(TypeError, match='update_record'):
+        ddns.register_provider('read-only')(ReadOnly)
+    assert 'read-only' not in ddns.PROVIDER_TYPES
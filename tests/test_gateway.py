@@ -0,0 +1,101 @@
+import socket
+
+import pytest
+
+from src.gateway import (GatewayDiscovery, UnsupportedProtocol, is_public_address,
+                         natpmp_external_address, pcp_external_address)
+
+from .stub_gateway import StubGateway
+
+
+@pytest.fixture
+def stub():
+    stub = StubGateway('198.51.100.7')
+    yield stub
+    stub.stop()
+
+
+def _closed_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _discovery(tmp_path, stub, natpmp_port=None):
+    return GatewayDiscovery(str(tmp_path), gateway='127.0.0.1', natpmp_port=natpmp_port or stub.natpmp_port,
+                            ssdp_address=stub.ssdp_address)
+
+
+def test_natpmp_reports_external_address(tmp_path, stub):
+    assert natpmp_external_address('127.0.0.1', stub.natpmp_port) == '198.51.100.7'
+    assert _discovery(tmp_path, stub).get_external_ip() == ('198.51.100.7', 'natpmp://127.0.0.1')
+
+
+def test_pcp_only_gateway_uses_short_lived_mapping():
+    stub = StubGateway('198.51.100.8', pcp_only=True)
+    try:
+        with pytest.raises(UnsupportedProtocol):
+            natpmp_external_address('127.0.0.1', stub.natpmp_port)
+        assert pcp_external_address('127.0.0.1', stub.natpmp_port) == '198.51.100.8'
+        # Mapped for the shortest lifetime, then deleted
+        assert stub.pcp_lifetimes == [1, 0]
+    finally:
+        stub.stop()
+
+
+def test_upnp_fallback_caches_control_url(tmp_path, stub):
+    discovery = _discovery(tmp_path, stub, natpmp_port=_closed_udp_port())
+    ip, source = discovery.get_external_ip()
+    assert ip == '198.51.100.7' and source.startswith('upnp://127.0.0.1:')
+    searches = stub.requests['ssdp']
+
+    # A fresh instance reads the control URL from gateway.json and skips SSDP
+    again = _discovery(tmp_path, stub, natpmp_port=_closed_udp_port())
+    assert again.get_external_ip()[0] == '198.51.100.7'
+    assert stub.requests['ssdp'] == searches
+    assert stub.requests['soap'] == 2
+
+
+def test_cgnat_address_is_not_trusted(tmp_path):
+    stub = StubGateway('100.64.3.4')
+    try:
+        assert _discovery(tmp_path, stub).get_external_ip() is None
+    finally:
+        stub.stop()
+
+
+def test_mismatch_distrusts_gateway_until_next_validation(tmp_path, stub):
+    discovery = _discovery(tmp_path, stub)
+    discovery.record_validation(False)
+    assert discovery.get_external_ip() is None
+
+
+@pytest.mark.parametrize('ip, public', [
+    ('8.8.8.8', True), ('10.1.2.3', False), ('100.64.0.1', False), ('192.168.1.1', False), ('not an ip', False)
+])
+def test_is_public_address(ip, public):
+    assert is_public_address(ip) is public
+
+
+class _FailingHttp:
+    def __init__(self):
+        self.calls = 0
+
+    def get(self, url, timeout=None):
+        self.calls += 1
+        raise OSError('unreachable')
+
+
+def test_unanswered_validation_is_retried_later_not_every_check(tmp_path, stub):
+    from src.ip_monitor import IPMonitor
+
+    http = _FailingHttp()
+    monitor = IPMonitor(str(tmp_path / 'ip_changes.log'), str(tmp_path), http=http,
+                        gateway=_discovery(tmp_path, stub))
+    assert monitor._get_gateway_ip() == '198.51.100.7'
+    queried = http.calls
+    assert queried > 0
+    assert monitor._get_gateway_ip() == '198.51.100.7'
+    assert http.calls == queried
+    assert not monitor.gateway.validation_due()
+    assert monitor.gateway.distrust_until == 0
@@ -0,0 +1,163 @@
+import ipaddress
+import struct
+
+import pytest
+
+from src.geoip import METADATA_MARKER, GeoIPEnricher, InvalidDatabaseError, MMDBReader
+
+
+def _ctrl(type_num, size):
+    """Control byte(s) for a value of this type and size (up to 284)"""
+    extra = b''
+    if size >= 29:
+        size, extra = 29, bytes([size - 29])
+    if type_num <= 7:
+        return bytes([type_num << 5 | size]) + extra
+    return bytes([size, type_num - 7]) + extra
+
+
+def _encode(value):
+    if isinstance(value, _Pointer):
+        return bytes([1 << 5 | value.offset >> 8, value.offset & 0xFF])
+    if isinstance(value, bool):
+        return _ctrl(14, int(value))
+    if isinstance(value, str):
+        raw = value.encode()
+        return _ctrl(2, len(raw)) + raw
+    if isinstance(value, float):
+        return _ctrl(3, 8) + struct.pack('>d', value)
+    if isinstance(value, int):
+        raw = value.to_bytes(4, 'big').lstrip(b'\0')
+        return _ctrl(6, len(raw)) + raw
+    if isinstance(value, dict):
+        return _ctrl(7, len(value)) + b''.join(_encode(k) + _encode(v) for k, v in value.items())
+    if isinstance(value, list):
+        return _ctrl(11, len(value)) + b''.join(_encode(v) for v in value)
+    raise TypeError(value)
+
+
+class _Pointer:
+    def __init__(self, offset):
+        self.offset = offset
+
+
+def _pack_node(left, right, record_size):
+    if record_size == 24:
+        return left.to_bytes(3, 'big') + right.to_bytes(3, 'big')
+    if record_size == 28:
+        middle = (left >> 24) << 4 | right >> 24
+        return (left & 0xFFFFFF).to_bytes(3, 'big') + bytes([middle]) + (right & 0xFFFFFF).to_bytes(3, 'big')
+    return struct.pack('>II', left, right)
+
+
+def build_mmdb(path, networks, record_size=24, ip_version=6, shared=()):
+    """Write a minimal .mmdb: networks maps CIDR -> record; shared values are stored first for pointers"""
+    data = bytearray()
+    for value in shared:
+        data += _encode(value)
+    nodes = [[None, None]]
+    bit_count = 128 if ip_version == 6 else 32
+    for cidr, record in networks.items():
+        network = ipaddress.ip_network(cidr)
+        prefix = network.prefixlen + (96 if network.version == 4 and ip_version == 6 else 0)
+        address = int(network.network_address)
+        bits = [address >> (bit_count - 1 - i) & 1 for i in range(prefix)]
+        node = 0
+        for bit in bits[:-1]:
+            if nodes[node][bit] is None:
+                nodes.append([None, None])
+                nodes[node][bit] = ('node', len(nodes) - 1)
+            node = nodes[node][bit][1]
+        nodes[node][bits[-1]] = ('data', len(data))
+        data += _encode(record)
+
+    node_count = len(nodes)
+
+    def resolve(record):
+        if record is None:
+            return node_count
+        kind, value = record
+        return value if kind == 'node' else node_count + 16 + value
+
+    tree = b''.join(_pack_node(resolve(left), resolve(right), record_size) for left, right in nodes)
+    metadata = {'node_count': node_count, 'record_size': record_size, 'ip_version': ip_version,
+                'database_type': 'Test-City'}
+    path.write_bytes(tree + bytes(16) + bytes(data) + METADATA_MARKER + _encode(metadata))
+    return str(path)
+
+
+CITY = {'country': {'iso_code': 'NL', 'names': {'en': 'Netherlands'}},
+        'city': {'names': {'en': 'Amsterdam'}}, 'location': {'latitude': 52.37, 'accuracy_radius': 20},
+        'is_anycast': False, 'subdivisions': [{'iso_code': 'NH'}]}
+
+
+@pytest.mark.parametrize('record_size', [24, 28, 32])
+def test_lookup_for_each_record_size(tmp_path, record_size):
+    path = build_mmdb(tmp_path / 'city.mmdb', {'2001:db8::/32': {'isp': 'v6'}, '198.51.100.0/24': CITY},
+                      record_size=record_size)
+    reader = MMDBReader(path)
+    try:
+        assert reader.database_type == 'Test-City'
+        # IPv4 is found through the ::/96 subtree of the IPv6 tree
+        assert reader.get('198.51.100.7') == CITY
+        assert reader.get('2001:db8::1') == {'isp': 'v6'}
+        assert reader.get('203.0.113.1') is None
+        assert reader.get('2001:db9::1') is None
+    finally:
+        reader.close()
+
+
+def test_28_bit_records_keep_the_high_nibble(tmp_path):
+    # A real tree this deep would be hundreds of megabytes, so read a single packed node
+    reader = MMDBReader(build_mmdb(tmp_path / 'city.mmdb', {'198.51.100.0/24': CITY}, record_size=28))
+    mapped, reader._buf = reader._buf, _pack_node(0xABCDEF1, 0x5432109, 28)
+    try:
+        assert (reader._read_node(0, 0), reader._read_node(0, 1)) == (0xABCDEF1, 0x5432109)
+    finally:
+        reader._buf = mapped
+        reader.close()
+
+
+def test_pointer_to_shared_value(tmp_path):
+    isp = 'Example Broadband'
+    path = build_mmdb(tmp_path / 'asn.mmdb', {
+        '198.51.100.0/24': {'autonomous_system_number': 64500, 'autonomous_system_organization': _Pointer(0)},
+        '203.0.113.0/24': {'autonomous_system_number': 64501, 'autonomous_system_organization': _Pointer(0)}
+    }, shared=[isp])
+    reader = MMDBReader(path)
+    try:
+        assert reader.get('198.51.100.1')['autonomous_system_organization'] == isp
+        assert reader.get('203.0.113.1') == {'autonomous_system_number': 64501, 'autonomous_system_organization': isp}
+    finally:
+        reader.close()
+
+
+def test_ipv4_only_database(tmp_path):
+    reader = MMDBReader(build_mmdb(tmp_path / 'v4.mmdb', {'198.51.100.0/25': CITY}, ip_version=4))
+    try:
+        assert reader.get('198.51.100.127') == CITY
+        assert reader.get('198.51.100.128') is None
+        with pytest.raises(ValueError):
+            reader.get('2001:db8::1')
+    finally:
+        reader.close()
+
+
+def test_enricher_merges_city_and_asn(tmp_path):
+    city = build_mmdb(tmp_path / 'city.mmdb', {'198.51.100.0/24': CITY})
+    asn = build_mmdb(tmp_path / 'asn.mmdb', {'198.51.100.0/24': {
+        'autonomous_system_number': 64500, 'autonomous_system_organization': 'Example Broadband'}})
+    enricher = GeoIPEnricher(city_db=city, asn_db=asn)
+    try:
+        assert enricher.lookup('198.51.100.9') == {'country': 'Netherlands', 'country_code': 'NL',
+                                                   'city': 'Amsterdam', 'asn': 'AS64500', 'isp': 'Example Broadband'}
+        assert enricher.lookup('203.0.113.1') is None
+    finally:
+        enricher.close()
+
+
+def test_not_a_database(tmp_path):
+    path = tmp_path / 'junk.mmdb'
+    path.write_bytes(b'not a database' * 10)
+    with pytest.raises(InvalidDatabaseError):
+        MMDBReader(str(path))
@@ -0,0 +1,85 @@
+import json
+import os
+import sys
+import time
+
+from src.hooks import MAX_OUTPUT_BYTES, Hook, HookRunner
+
+PAYLOAD = {'event': 'ip_change', 'new_ip': '203.0.113.2', 'old_ip': '203.0.113.1'}
+
+
+def _hook(tmp_path, code, **spec):
+    return Hook(dict({'name': 'test', 'command': [sys.executable, '-c', code]}, **spec), tmp_path)
+
+
+def _wait(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.02)
+
+
+def _alive(pid):
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().split(') ', 1)[1][0] != 'Z'
+    except FileNotFoundError:
+        return False
+
+
+def test_environment_is_limited_to_the_hook_and_event(tmp_path, monkeypatch):
+    monkeypatch.setenv('AGGREGATOR_TOKEN', 'secret')
+    code = "import json, os, sys; print(json.dumps({'env': dict(os.environ), 'stdin': json.load(sys.stdin)}))"
+    result = _hook(tmp_path, code, env={'ZONE': 'example.com'}).execute(PAYLOAD)
+    assert result['status'] == 'ok' and result['exit_code'] == 0
+    seen = json.loads(result['stdout'])
+    assert seen['stdin'] == PAYLOAD
+    env = seen['env']
+    assert env['IPSENTINEL_EVENT'] == 'ip_change'
+    assert env['IPSENTINEL_NEW_IP'] == '203.0.113.2' and env['IPSENTINEL_OLD_IP'] == '203.0.113.1'
+    assert env['ZONE'] == 'example.com'
+    assert 'AGGREGATOR_TOKEN' not in env
+
+
+def test_command_string_is_split_like_a_shell(tmp_path):
+    hook = Hook({'name': 'test', 'command': "echo 'two words' \"and more\""}, tmp_path)
+    assert hook.argv == ['echo', 'two words', 'and more']
+    assert hook.execute(PAYLOAD)['stdout'] == 'two words and more\n'
+
+
+def test_timeout_kills_the_hook_and_its_children(tmp_path):
+    pid_file = tmp_path / 'child.pid'
+    code = ("import subprocess, sys, time; "
+            "child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)']); "
+            f"open({str(pid_file)!r}, 'w').write(str(child.pid)); time.sleep(60)")
+    started = time.monotonic()
+    result = _hook(tmp_path, code, timeout=1).execute(PAYLOAD)
+    assert result['status'] == 'timeout' and result['exit_code'] < 0
+    assert time.monotonic() - started < 10
+    child = int(pid_file.read_text())
+    _wait(lambda: not _alive(child), timeout=5)
+
+
+def test_output_keeps_only_the_tail(tmp_path):
+    code = f"import sys; sys.stdout.write('x' * {MAX_OUTPUT_BYTES * 2} + 'END'); sys.exit(3)"
+    result = _hook(tmp_path, code).execute(PAYLOAD)
+    assert result['status'] == 'failed' and result['exit_code'] == 3
+    assert len(result['stdout']) == MAX_OUTPUT_BYTES and result['stdout'].endswith('END')
+
+
+def test_busy_hook_runs_once_more_with_the_latest_payload(tmp_path):
+    log = tmp_path / 'runs.log'
+    code = f"import os, time; time.sleep(0.5); open({str(log)!r}, 'a').write(os.environ['IPSENTINEL_NEW_IP'] + '\\n')"
+    (tmp_path / 'hooks.json').write_text(json.dumps({
+        'enabled': True,
+        'hooks': [{'name': 'record', 'command': [sys.executable, '-c', code]}]
+    }))
+    runner = HookRunner(str(tmp_path))
+    for ip in ('203.0.113.1', '203.0.113.2', '203.0.113.3'):
+        assert runner.run('ip_change', ip) == ['record']
+    assert runner.get_status()[0]['pending']
+
+    _wait(lambda: len(runner.history) == 2 and not runner.get_status()[0]['running'])
+    assert log.read_text().split() == ['203.0.113.1', '203.0.113.3']
+    assert [r['new_ip'] for r in runner.get_history()] == ['203.0.113.3', '203.0.113.1']
+    assert runner.run('startup') == []
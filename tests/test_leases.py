@@ -0,0 +1,81 @@
+from datetime import datetime
+
+from src import database
+from src.leases import LeaseIndex, parse_timestamp
+
+from .helpers import change_log_lines
+
+
+def _ts(text):
+    return datetime.fromisoformat(text).timestamp()
+
+
+def _write_log(path, changes):
+    with open(path, 'w') as f:
+        f.writelines(change_log_lines(changes))
+
+
+def _write_db(path, changes):
+    conn = database.get_db_connection(str(path))
+    database.create_table(conn)
+    for when, ip in changes:
+        conn.execute('INSERT INTO ip_log(ip_address, timestamp) VALUES(?, ?)', (ip, when))
+    conn.commit()
+    conn.close()
+
+
+def test_lookup_covers_half_open_leases():
+    index = LeaseIndex([(100.0, '203.0.113.1'), (200.0, '203.0.113.2'), (300.0, '203.0.113.3')])
+    assert index.lookup(99) is None
+    assert index.lookup(100) == ('203.0.113.1', 100.0, 200.0)
+    assert index.lookup(199.9) == ('203.0.113.1', 100.0, 200.0)
+    assert index.lookup(200) == ('203.0.113.2', 200.0, 300.0)
+    assert index.lookup(10 ** 10) == ('203.0.113.3', 300.0, None)
+
+
+def test_repeated_records_of_one_ip_collapse():
+    index = LeaseIndex([(300.0, '203.0.113.2'), (100.0, '203.0.113.1'), (200.0, '203.0.113.1')])
+    assert len(index) == 2
+    assert index.lookup(250) == ('203.0.113.1', 100.0, 300.0)
+
+
+def test_resolve_accepts_epoch_ms_and_iso():
+    index = LeaseIndex([(_ts('2024-01-01 00:00:00'), '203.0.113.1'), (_ts('2024-02-01 00:00:00'), '203.0.113.2')])
+    assert index.resolve('2024-01-15T12:00:00')['ip'] == '203.0.113.1'
+    assert index.resolve(_ts('2024-02-02 00:00:00') * 1000)['ip'] == '203.0.113.2'
+    result = index.resolve('2024-03-01')
+    assert result['since'] == '2024-02-01 00:00:00' and result['until'] is None
+    assert index.resolve('yesterday-ish')['error'] == 'Unparseable timestamp'
+    assert parse_timestamp('') is None
+
+
+def test_load_merges_database_and_log_without_duplicates(tmp_path):
+    db_file, log_file = tmp_path / 'ip_log.db', tmp_path / 'ip_changes.log'
+    # The database was enabled late; the log misses the last change after a failed write
+    _write_log(log_file, [('2024-01-01 00:00:00', '203.0.113.1'), ('2024-02-01 00:00:00', '203.0.113.2')])
+    _write_db(db_file, [('2024-02-01 00:00:00', '203.0.113.2'), ('2024-03-01 00:00:00', '203.0.113.3')])
+
+    index = LeaseIndex.load(str(db_file), str(log_file))
+    assert [lease['ip'] for lease in index.leases()] == ['203.0.113.1', '203.0.113.2', '203.0.113.3']
+    assert index.resolve('2024-01-10')['ip'] == '203.0.113.1'
+    assert index.resolve('2024-03-10')['ip'] == '203.0.113.3'
+
+
+def test_load_without_any_history(tmp_path):
+    index = LeaseIndex.load(str(tmp_path / 'ip_log.db'), str(tmp_path / 'missing.log'))
+    assert len(index) == 0 and index.lookup(0) is None
+
+
+def test_log_lines_quoting_the_marker_are_not_leases(tmp_path):
+    log_file = tmp_path / 'ip_changes.log'
+    _write_log(log_file, [('2024-01-01 00:00:00', '203.0.113.1'), ('2024-02-01 00:00:00', '203.0.113.2')])
+    index = LeaseIndex.from_log(str(log_file))
+    assert index.ips == ['203.0.113.1', '203.0.113.2']
+    assert index.resolve('2024-02-01 00:00:00')['ip'] == '203.0.113.2'
+
+
+def test_database_wins_over_the_log_for_the_same_instant(tmp_path):
+    db_file, log_file = tmp_path / 'ip_log.db', tmp_path / 'ip_changes.log'
+    _write_log(log_file, [('2024-01-01 00:00:00', '198.51.100.1')])
+    _write_db(db_file, [('2024-01-01 00:00:00', '203.0.113.1')])
+    assert LeaseIndex.load(str(db_file), str(log_file)).ips == ['203.0.113.1']
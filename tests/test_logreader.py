@@ -0,0 +1,46 @@
+import json
+from datetime import datetime
+
+from click.testing import CliRunner
+
+from src import logreader
+from src.cli import cli
+
+from .helpers import change_log_lines
+
+
+def test_parse_change_accepts_only_the_change_line():
+    change, result, notify = change_log_lines([('2024-01-01 00:00:00', '203.0.113.1')])
+    assert logreader.parse_change(change) == (datetime(2024, 1, 1), '203.0.113.1')
+    assert logreader.CHANGE_MARKER in result and logreader.parse_change(result) is None
+    assert logreader.parse_change(notify) is None
+    assert logreader.parse_change('2024-01-01 00:00:00 - IP changed to: not-an-ip\n') is None
+    assert logreader.parse_change('2024-01-01 00:00:00 - IP changed to: 2001:db8::1') is not None
+
+
+def test_change_lines_skip_scheduler_debug_lines(tmp_path):
+    path = tmp_path / 'ip_changes.log'
+    path.write_text(''.join(change_log_lines([('2024-01-01 00:00:00', '203.0.113.1'),
+                                              ('2024-01-02 00:00:00', '203.0.113.2')])))
+    assert list(logreader.change_lines(str(path))) == [
+        '2024-01-02 00:00:00 - IP changed to: 203.0.113.2',
+        '2024-01-01 00:00:00 - IP changed to: 203.0.113.1'
+    ]
+
+
+def test_cli_history_json_lists_each_change_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('GATEWAY_DISCOVERY', 'false')
+    (tmp_path / 'logs').mkdir()
+    (tmp_path / 'logs' / 'ip_changes.log').write_text(''.join(change_log_lines([
+        ('2024-01-01 00:00:00', '203.0.113.1'), ('2024-01-02 00:00:00', '203.0.113.2')])))
+
+    result = CliRunner().invoke(cli, ['history', '--changes', '--json'])
+    assert result.exit_code == 0, result.output
+    entries = [json.loads(line) for line in result.output.splitlines()]
+    assert [(e['timestamp'], e['ip']) for e in entries] == [
+        ('2024-01-02T00:00:00', '203.0.113.2'), ('2024-01-01T00:00:00', '203.0.113.1')]
+
+    result = CliRunner().invoke(cli, ['history', '--json', '--limit', '3'])
+    entries = [json.loads(line) for line in result.output.splitlines()]
+    assert [e.get('ip') for e in entries] == [None, None, '203.0.113.2']
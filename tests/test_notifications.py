@@ -0,0 +1,72 @@
+import threading
+
+import pytest
+
+from src import notifications
+from src.notifications import NotificationChannel, NotificationManager
+
+
+class CountingChannel(NotificationChannel):
+    channel_type = 'counting'
+    sent = []
+    lock = threading.Lock()
+
+    def send(self, title, message, fields=None):
+        with self.lock:
+            self.sent.append(self.name)
+        return True
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.setitem(notifications.CHANNEL_TYPES, 'counting', CountingChannel)
+    CountingChannel.sent = []
+    manager = NotificationManager(str(tmp_path))
+    for name in ('a', 'b'):
+        manager.add_channel({'name': name, 'type': 'counting', 'events': ['ip_change']})
+    return manager
+
+
+def test_abstract_channel_cannot_be_registered():
+    class Silent(NotificationChannel):
+        pass
+
+    with pytest.raises(TypeError, match='send'):
+        notifications.register_channel('silent')(Silent)
+
+
+def test_dispatch_reports_each_channel(manager):
+    assert manager.dispatch('ip_change', 'IP changed', 'New IP') == {'a': True, 'b': True}
+    assert manager.dispatch('outage', 'Offline', 'Down') == {}
+
+
+def test_concurrent_dispatch_and_resize_share_one_pool(manager, monkeypatch):
+    created = []
+    real = notifications.ThreadPoolExecutor
+
+    def tracking(*args, **kwargs):
+        pool = real(*args, **kwargs)
+        created.append(pool)
+        return pool
+
+    monkeypatch.setattr(notifications, 'ThreadPoolExecutor', tracking)
+    start = threading.Barrier(16)
+
+    def caller(i):
+        start.wait()
+        if i % 4 == 0:
+            manager.config['max_concurrency'] = 2 + i % 8
+        manager.dispatch_nowait('ip_change', 'IP changed', 'New IP')
+
+    threads = [threading.Thread(target=caller, args=(i,)) for i in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Every pool but the current one was retired, and every queued delivery still ran
+    assert manager._executor is created[-1]
+    assert [pool for pool in created[:-1] if not pool._shutdown] == []
+    for pool in created:
+        pool.shutdown(wait=True)
+    assert len(CountingChannel.sent) == 32
@@ -0,0 +1,163 @@
+import threading
+import time
+
+import pytest
+
+from src.scheduler import ABANDON_GRACE_DEADLINES, Scheduler
+
+
+class FakeMonitor:
+    """check_ip_change blocks until released, recording how many checks overlap"""
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+        self.honour_cancel = True
+        self._lock = threading.Lock()
+
+    def check_ip_change(self, cancel=None):
+        with self._lock:
+            self.calls += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            while not self.release.wait(0.01):
+                if self.honour_cancel and cancel is not None and cancel.is_set():
+                    return {'status': 'cancelled'}
+            return {'status': 'unchanged', 'ip': '203.0.113.1'}
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+@pytest.fixture
+def scheduler(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return Scheduler(FakeMonitor())
+
+
+def _wait(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def _drain(scheduler):
+    """Release the monitor and reap until nothing is running or queued"""
+    scheduler.monitor.release.set()
+    runs = 0
+    while scheduler._busy() or scheduler._pending:
+        _wait(lambda: scheduler._current is None or scheduler._current['done'].is_set())
+        if scheduler._current is not None:
+            runs += 1
+        scheduler._reap()
+    return runs
+
+
+@pytest.mark.parametrize('policy, runs, skipped', [('skip', 1, 3), ('coalesce', 2, 2), ('queue', 4, 0)])
+def test_overrun_policies(scheduler, policy, runs, skipped):
+    scheduler.update_run_policy(overrun_policy=policy)
+    for _ in range(4):
+        scheduler._fire()
+    assert scheduler.stats['overruns'] == 3
+    assert _drain(scheduler) == runs
+    assert scheduler.stats['skipped'] == skipped
+    assert scheduler.stats['runs'] == runs and scheduler.stats['failures'] == 0
+    assert scheduler.monitor.max_active == 1
+
+
+def test_queue_is_bounded(scheduler):
+    scheduler.update_run_policy(overrun_policy='queue')
+    scheduler.max_queue = 2
+    for _ in range(5):
+        scheduler._fire()
+    assert scheduler._pending == 2 and scheduler.stats['skipped'] == 2
+    assert _drain(scheduler) == 3
+
+
+def test_abandoned_check_blocks_the_next_until_it_exits(scheduler):
+    scheduler.monitor.honour_cancel = False
+    scheduler.update_run_policy(overrun_policy='coalesce', run_deadline=0.2)
+    scheduler._fire()
+    time.sleep(0.25)
+    scheduler._reap()
+    assert scheduler.stats['timeouts'] == 1 and scheduler.last_run['status'] == 'timeout'
+    assert scheduler._current is None and scheduler.health()['abandoned'] == 1
+
+    # The abandoned thread is still inside the check, so the next slot waits for it
+    scheduler._fire()
+    scheduler._reap()
+    assert scheduler.monitor.calls == 1 and scheduler._pending == 1
+
+    scheduler.monitor.release.set()
+    _wait(lambda: not scheduler._abandoned[0]['thread'].is_alive())
+    scheduler._reap()
+    assert scheduler.monitor.calls == 2
+    _drain(scheduler)
+    assert scheduler.monitor.max_active == 1
+
+
+def test_hung_check_stops_blocking_after_the_grace_period(scheduler):
+    scheduler.monitor.honour_cancel = False
+    scheduler.update_run_policy(overrun_policy='coalesce', run_deadline=0.1)
+    scheduler._fire()
+    time.sleep(0.15)
+    scheduler._reap()
+    scheduler._fire()
+    assert scheduler._pending == 1 and scheduler.monitor.calls == 1
+
+    # Two more deadlines later the abandoned thread is treated as hung and the queued check runs
+    time.sleep(ABANDON_GRACE_DEADLINES * 0.1 + 0.05)
+    scheduler._reap()
+    _wait(lambda: scheduler.monitor.calls == 2)
+    health = scheduler.health()
+    assert health['hung'] == 1 and health['abandoned_hung'] == 1
+    scheduler.monitor.release.set()
+    _drain(scheduler)
+
+
+def test_unknown_overrun_policy_falls_back_to_coalesce(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'data').mkdir()
+    (tmp_path / 'data' / 'schedule_config.json').write_text('{"overrun_policy": "drop"}')
+    scheduler = Scheduler(FakeMonitor())
+    assert scheduler.overrun_policy == 'coalesce'
+    with pytest.raises(ValueError):
+        scheduler.update_run_policy(overrun_policy='drop')
+
+
+def test_check_now_runs_after_the_current_check(scheduler):
+    scheduler.start()
+    try:
+        scheduler.request_check()
+        _wait(lambda: scheduler._current is not None)  # Another check, still running
+        results = []
+        caller = threading.Thread(target=lambda: results.append(scheduler.check_now(timeout=5)))
+        caller.start()
+        time.sleep(0.1)
+        assert scheduler.monitor.calls == 1
+        scheduler.monitor.release.set()
+        caller.join(timeout=5)
+        assert results == [{'status': 'unchanged', 'ip': '203.0.113.1'}]
+        assert scheduler.monitor.calls == 2 and scheduler.monitor.max_active == 1
+    finally:
+        scheduler.stop()
+
+
+def test_replaced_loop_thread_stops_acting(scheduler):
+    scheduler.monitor.release.set()
+    scheduler.start()
+    try:
+        first = scheduler._thread
+        scheduler._spawn()
+        scheduler._wake.set()
+        first.join(timeout=5)
+        assert not first.is_alive()
+        assert scheduler._thread.is_alive()
+        scheduler.request_check()
+        _wait(lambda: scheduler.stats['runs'] == 1)
+        assert scheduler.health()['status'] == 'ok'
+    finally:
+        scheduler.stop()